@@ -0,0 +1,152 @@
+"""Utilidades de audio compartidas por el vectorizador de pistas y el análisis con Essentia.
+
+Solo dependen de NumPy y de los binarios yt-dlp y ffmpeg: los modelos
+(Essentia) se cargan en cada script.
+
+El audio no pasa por un mp3 intermedio: yt-dlp solo resuelve el enlace del
+mejor stream de audio y ffmpeg lo decodifica directamente a PCM float32 mono
+en memoria (o a WAV en tmpfs cuando la herramienta exige un fichero).
+"""
+import json
+import os
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# Parámetros de entrada de Effnet Discogs (los de TensorflowPredictEffnetDiscogs)
+EFFNET_FRAME_SIZE = 512
+EFFNET_HOP_SIZE = 256
+EFFNET_PATCH_SIZE = 128
+EFFNET_PATCH_HOP = 62
+EFFNET_BATCH_SIZE = 64
+
+# Directorio para los WAV temporales; /dev/shm está en memoria
+AUDIO_TMP_DIR = os.getenv('AUDIO_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp')
+
+
+@dataclass
+class StreamAudio:
+    webpage_url: str
+    stream_url: str
+    duracion: Optional[float] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+def resolver_youtube(query: str, cookies_path: Optional[str] = None, timeout: int = 120) -> StreamAudio:
+    """Resuelve una búsqueda o URL de YouTube al stream `bestaudio` con una sola llamada a yt-dlp."""
+    comando = ["yt-dlp", "-f", "bestaudio/best", "--no-playlist",
+               "--print", "webpage_url", "--print", "urls",
+               "--print", "duration", "--print", "%(http_headers)j"]
+    if cookies_path and os.path.exists(cookies_path):
+        comando += ["--cookies", cookies_path]
+    result = subprocess.run(comando + [query], capture_output=True, text=True, check=True, timeout=timeout)
+    return parsear_salida_ytdlp(result.stdout)
+
+
+def parsear_salida_ytdlp(salida: str) -> StreamAudio:
+    lineas = salida.strip().splitlines()
+    if len(lineas) < 4:
+        raise RuntimeError("yt-dlp no devolvió ningún resultado")
+    webpage_url, stream_url, duracion, headers = lineas[-4:]
+    try:
+        duracion = float(duracion)
+    except ValueError:
+        duracion = None
+    try:
+        headers = json.loads(headers) or {}
+    except ValueError:
+        headers = {}
+    return StreamAudio(webpage_url, stream_url, duracion, headers)
+
+
+def inicio_ventana(duracion: Optional[float], segundos: float) -> Optional[float]:
+    """Segundo en que empieza la ventana central, o None si se decodifica la pista entera."""
+    if not segundos or not duracion or duracion <= segundos:
+        return None
+    return (duracion - segundos) / 2
+
+
+def comando_ffmpeg(fuente: str, salida: str = 'pipe:1', formato: str = 'f32le', sample_rate: int = SAMPLE_RATE,
+                   inicio: Optional[float] = None, duracion: Optional[float] = None,
+                   headers: Optional[Dict[str, str]] = None) -> List[str]:
+    comando = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+    if headers and fuente.startswith("http"):
+        comando += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    if inicio is not None:
+        # -ss antes de -i: ffmpeg salta directamente sin decodificar el principio
+        comando += ["-ss", f"{inicio:.3f}"]
+    comando += ["-i", fuente]
+    if duracion:
+        comando += ["-t", f"{duracion:.3f}"]
+    comando += ["-vn", "-ac", "1", "-ar", str(sample_rate), "-f", formato, "-y", salida]
+    return comando
+
+
+def decodificar_pcm(stream: StreamAudio, segundos: float = 0, sample_rate: int = SAMPLE_RATE,
+                    timeout: int = 600) -> np.ndarray:
+    """Decodifica el stream a float32 mono en memoria, solo la ventana central si `segundos` > 0."""
+    inicio = inicio_ventana(stream.duracion, segundos)
+    comando = comando_ffmpeg(stream.stream_url, sample_rate=sample_rate, inicio=inicio,
+                             duracion=segundos if inicio is not None else None, headers=stream.headers)
+    result = subprocess.run(comando, capture_output=True, check=True, timeout=timeout)
+    audio = np.frombuffer(result.stdout, dtype='<f4')
+    if audio.size == 0:
+        raise RuntimeError(f"ffmpeg no devolvió audio: {result.stderr.decode(errors='replace')[-300:]}")
+    return ventana_central(audio, segundos, sample_rate)
+
+
+def decodificar_wav(stream: StreamAudio, ruta: str, sample_rate: int = 44100, timeout: int = 600) -> str:
+    """Decodifica el stream a un WAV PCM sin pérdidas (para extractores que solo leen ficheros)."""
+    comando = comando_ffmpeg(stream.stream_url, salida=ruta, formato='wav', sample_rate=sample_rate,
+                             headers=stream.headers)
+    subprocess.run(comando, capture_output=True, check=True, timeout=timeout)
+    return ruta
+
+
+def ventana_central(audio: np.ndarray, segundos: float, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Recorta `segundos` del centro de la pista. Con 0 o una pista más corta se devuelve entera."""
+    muestras = int(segundos * sample_rate)
+    if muestras <= 0 or len(audio) <= muestras:
+        return audio
+    inicio = (len(audio) - muestras) // 2
+    return audio[inicio:inicio + muestras]
+
+
+def parches(mel: np.ndarray, patch_size: int = EFFNET_PATCH_SIZE, hop: int = EFFNET_PATCH_HOP) -> np.ndarray:
+    """Corta el espectrograma (frames, bandas) en parches (n, patch_size, bandas).
+
+    Una pista más corta que un parche se rellena con ceros hasta completarlo.
+    """
+    mel = np.asarray(mel, dtype=np.float32)
+    if mel.shape[0] < patch_size:
+        mel = np.pad(mel, ((0, patch_size - mel.shape[0]), (0, 0)))
+    inicios = range(0, mel.shape[0] - patch_size + 1, hop)
+    return np.stack([mel[i:i + patch_size] for i in inicios])
+
+
+def agrupar_parches(parches_por_pista: Sequence[np.ndarray],
+                    batch_size: int = EFFNET_BATCH_SIZE) -> Tuple[np.ndarray, List[int]]:
+    """Concatena los parches de varias pistas y rellena hasta un múltiplo de `batch_size`.
+
+    El modelo bs64 solo acepta lotes de 64 parches: por pista suelta el último
+    lote va casi siempre medio vacío; agrupando pistas se llenan.
+
+    Returns:
+        (parches, conteos): el array relleno y cuántos parches son de cada pista.
+    """
+    conteos = [len(p) for p in parches_por_pista]
+    todos = np.concatenate(parches_por_pista) if parches_por_pista else np.empty((0,), dtype=np.float32)
+    relleno = -len(todos) % batch_size
+    if relleno:
+        todos = np.concatenate([todos, np.zeros((relleno,) + todos.shape[1:], dtype=todos.dtype)])
+    return todos, conteos
+
+
+def repartir_salidas(salidas: np.ndarray, conteos: Sequence[int]) -> List[np.ndarray]:
+    """Separa las salidas del lote por pista (descartando el relleno)."""
+    limites = np.cumsum(conteos)[:-1]
+    return np.split(salidas[:sum(conteos)], limites)
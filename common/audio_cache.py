@@ -0,0 +1,158 @@
+"""Caché local de audio direccionada por id de vídeo de YouTube, con expulsión LRU.
+
+Se guarda el stream `bestaudio` tal cual lo sirve YouTube (normalmente opus),
+copiado sin recodificar a un contenedor Matroska, junto a un JSON con la URL
+y la duración. El vectorizador de pistas y el análisis con Essentia leen de
+aquí, así que volver a procesar el catálogo con otro modelo no descarga nada.
+
+Varios procesos pueden compartir el directorio: las entradas se escriben a un
+temporal y se publican con `os.replace`, y el orden LRU es el mtime, que se
+actualiza en cada lectura.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from typing import Optional
+
+from common.audio import StreamAudio, resolver_youtube
+
+logger = logging.getLogger('tfm.audio_cache')
+
+AUDIO_EXT = '.mka'
+META_EXT = '.json'
+_VIDEO_ID = re.compile(r'(?:v=|youtu\.be/|/shorts/|/embed/)([A-Za-z0-9_-]{11})')
+
+
+def video_id(url: Optional[str]) -> Optional[str]:
+    """Id de 11 caracteres de una URL de YouTube, o None si no lo tiene."""
+    if not url:
+        return None
+    match = _VIDEO_ID.search(url)
+    return match.group(1) if match else None
+
+
+class AudioCache:
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(directorio, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = self._tamano_total()
+
+    def ruta(self, vid: str) -> str:
+        # Subdirectorios por prefijo del hash para no tener cientos de miles de ficheros juntos
+        prefijo = hashlib.sha1(vid.encode()).hexdigest()[:2]
+        return os.path.join(self.directorio, prefijo, vid + AUDIO_EXT)
+
+    def obtener(self, vid: Optional[str]) -> Optional[StreamAudio]:
+        """Entrada de la caché como `StreamAudio` local, o None si no está."""
+        if not vid:
+            return None
+        ruta = self.ruta(vid)
+        try:
+            with open(ruta[:-len(AUDIO_EXT)] + META_EXT, encoding='utf-8') as f:
+                meta = json.load(f)
+            os.utime(ruta)
+        except (OSError, ValueError):
+            return None
+        return StreamAudio(webpage_url=meta.get('webpage_url'), stream_url=ruta, duracion=meta.get('duracion'))
+
+    def guardar_fichero(self, vid: str, origen: str, webpage_url: str, duracion: Optional[float] = None) -> StreamAudio:
+        """Publica en la caché un fichero ya descargado (se mueve, no se copia)."""
+        ruta = self.ruta(vid)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        meta = ruta[:-len(AUDIO_EXT)] + META_EXT
+        with open(meta + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'webpage_url': webpage_url, 'duracion': duracion}, f)
+        # El audio se publica antes que el JSON: sin JSON la entrada no existe
+        os.replace(origen, ruta)
+        os.replace(meta + '.tmp', meta)
+        with self._lock:
+            self._bytes += os.path.getsize(ruta)
+            lleno = self._bytes > self.max_bytes
+        if lleno:
+            self.expulsar()
+        return StreamAudio(webpage_url=webpage_url, stream_url=ruta, duracion=duracion)
+
+    def guardar_stream(self, stream: StreamAudio) -> StreamAudio:
+        """Descarga el stream remoto sin recodificar y lo guarda en la caché."""
+        vid = video_id(stream.webpage_url)
+        if not vid:
+            return stream
+        fd, tmp = tempfile.mkstemp(prefix='.descarga-', suffix=AUDIO_EXT, dir=self.directorio)
+        os.close(fd)
+        comando = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error"]
+        if stream.headers:
+            comando += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in stream.headers.items())]
+        comando += ["-i", stream.stream_url, "-vn", "-c:a", "copy", "-f", "matroska", "-y", tmp]
+        try:
+            subprocess.run(comando, capture_output=True, check=True, timeout=600)
+            return self.guardar_fichero(vid, tmp, stream.webpage_url, stream.duracion)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _entradas(self):
+        for raiz, _, ficheros in os.walk(self.directorio):
+            for nombre in ficheros:
+                if nombre.endswith(AUDIO_EXT) and not nombre.startswith('.'):
+                    ruta = os.path.join(raiz, nombre)
+                    try:
+                        st = os.stat(ruta)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, ruta
+
+    def _tamano_total(self) -> int:
+        return sum(tamano for _, tamano, _ in self._entradas())
+
+    def expulsar(self):
+        """Borra las entradas usadas hace más tiempo hasta quedar por debajo del 90 % del límite."""
+        with self._lock:
+            self._expulsar()
+
+    def _expulsar(self):
+        entradas = sorted(self._entradas())
+        total = sum(tamano for _, tamano, _ in entradas)
+        objetivo = int(self.max_bytes * 0.9)
+        for _, tamano, ruta in entradas:
+            if total <= objetivo:
+                break
+            for fichero in (ruta[:-len(AUDIO_EXT)] + META_EXT, ruta):
+                try:
+                    os.remove(fichero)
+                except OSError:
+                    pass
+            total -= tamano
+        self._bytes = total
+        logger.info(f"Caché de audio reducida a {total / 1e9:.2f} GB")
+
+
+def crear_cache() -> Optional[AudioCache]:
+    """Caché configurada con AUDIO_CACHE_DIR y AUDIO_CACHE_MAX_GB (desactivada si no hay directorio)."""
+    directorio = os.getenv('AUDIO_CACHE_DIR')
+    if not directorio:
+        return None
+    return AudioCache(directorio, int(float(os.getenv('AUDIO_CACHE_MAX_GB', '20')) * 1e9))
+
+
+def obtener_audio(query: str, link: Optional[str] = None, cookies_path: Optional[str] = None,
+                  cache: Optional[AudioCache] = None) -> StreamAudio:
+    """Stream de audio de una canción, de la caché si ya se descargó.
+
+    Con el enlace guardado de una ejecución anterior no se llama a YouTube;
+    sin él se busca con `query` y el resultado se guarda en la caché.
+    """
+    if cache is not None:
+        local = cache.obtener(video_id(link))
+        if local is not None:
+            return local
+    stream = resolver_youtube(link or query, cookies_path)
+    if cache is None:
+        return stream
+    return cache.obtener(video_id(stream.webpage_url)) or cache.guardar_stream(stream)
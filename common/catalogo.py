@@ -0,0 +1,165 @@
+"""Lectura del catálogo de canciones vectorizadas desde Postgres.
+
+La usan la migración a Qdrant, el motor de búsqueda local y la exportación de
+vectores, para que todos construyan el mismo payload y lean los vectores con
+el mismo formato (columnas compactas de `song_vectors` o, en filas sin
+convertir, las antiguas de `lyrics_database`).
+"""
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from common.dedup import filtro_canonicas
+from common.music_metadata import a_camelot, normalizar_generos
+from common.vectors import filtro_pooling, get_track_pooling, get_vector_storage, pool_embeddings
+
+logger = logging.getLogger('tfm.catalogo')
+
+# Los vectores compactos están en song_vectors (alias v); los antiguos, en
+# lyrics_database hasta que se convierten
+VECTORS_JOIN = "LEFT JOIN song_vectors v ON v.song_id = l.id"
+
+
+def filtro_vectorizadas(pooling: str) -> str:
+    """Canciones con vector de letra y de audio utilizable con el pooling `pooling`.
+
+    Un vector de audio compacto de otro modo no cuenta (otra dimensión u otro
+    espacio): la canción queda fuera hasta que se vuelve a vectorizar. Los
+    antiguos por ventana se agregan al leerlos con el modo pedido.
+    """
+    return (
+        f"((v.track_vec_pooled IS NOT NULL AND {filtro_pooling(pooling)}) OR l.track_vector IS NOT NULL) "
+        "AND (v.letra_vec32 IS NOT NULL OR l.letra_vec IS NOT NULL) "
+        # Los duplicados de otra canción no entran en el catálogo
+        f"AND {filtro_canonicas('lyrics_database', 'l.id')}"
+    )
+
+
+@dataclass
+class CancionVectorizada:
+    id: int
+    payload: dict
+    lyrics_vector: np.ndarray
+    track_vector: np.ndarray
+
+
+def construir_payload(artist, title, album, mbid, link, bpm, initialkey, genre, lyric=None,
+                      lyric_cluster_id=None, track_pooling=None) -> dict:
+    payload = {
+        "artist": artist, "title": title,
+        "album": album, "mbid": mbid,
+        "link": link, "bpm": bpm, "key": initialkey,
+        "genre": genre, "camelot": a_camelot(initialkey),
+        "genres": normalizar_generos(genre)
+    }
+    if lyric is not None:
+        payload["lyric"] = lyric
+    # Letras casi idénticas (common.minhash) comparten cluster; la búsqueda las colapsa
+    if lyric_cluster_id is not None:
+        payload["lyric_cluster_id"] = lyric_cluster_id
+    # Modo con que se agregó track_vector; lo comprueba la migración a Qdrant
+    if track_pooling is not None:
+        payload["track_pooling"] = track_pooling
+    return payload
+
+
+def leer_vector(compacto, legacy, storage=None, pooling: str = 'mean') -> np.ndarray:
+    """Vector float32 de una fila, priorizando la columna compacta.
+
+    Las columnas antiguas por ventana (JSONB con lista de listas) se agregan con `pooling`.
+    """
+    storage = storage or get_vector_storage()
+    if compacto is not None:
+        return storage.decode(compacto)
+    if isinstance(legacy, list) and legacy and isinstance(legacy[0], list):
+        return pool_embeddings(legacy, pooling)
+    return storage.decode(legacy)
+
+
+def ids_vectorizados(db_manager, pooling: Optional[str] = None) -> np.ndarray:
+    """Ids (ordenados) de todas las canciones del catálogo, sin leer vectores."""
+    filtro = filtro_vectorizadas(pooling or get_track_pooling())
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT l.id FROM lyrics_database l {VECTORS_JOIN} WHERE {filtro} ORDER BY l.id;")
+        ids = np.fromiter((row[0] for row in cur), dtype=np.int64)
+        cur.close()
+    return ids
+
+
+def leer_catalogo(db_manager, batch_size: int = 1000, condicion: Optional[str] = None,
+                  incluir_letra: bool = False, desde_id: int = 0,
+                  pooling: Optional[str] = None) -> Iterator[List[CancionVectorizada]]:
+    """Recorre por keyset (id > último id) las canciones con ambos vectores.
+
+    Args:
+        condicion: filtro SQL adicional sobre `lyrics_database l` (y `song_vectors v`).
+        incluir_letra: leer también la letra completa (la columna más pesada).
+        desde_id: reanudar a partir de este id.
+        pooling: modo de los vectores de audio (TRACK_POOLING por defecto); va
+            también en el payload (`track_pooling`).
+    """
+    storage = get_vector_storage()
+    pooling = pooling or get_track_pooling()
+    # Los formatos antiguos (JSONB por ventana, float8[]) solo se leen en filas
+    # que no tienen vector compacto del modo pedido
+    compacto = f"CASE WHEN {filtro_pooling(pooling)} THEN v.track_vec_pooled END"
+    vectores = f"""
+        {compacto}, CASE WHEN {compacto} IS NULL THEN l.track_vector END,
+        v.letra_vec32, CASE WHEN v.letra_vec32 IS NULL THEN l.letra_vec END
+    """
+    for rows in _leer_filas(db_manager, batch_size, condicion, incluir_letra, desde_id, pooling, vectores):
+        lote = []
+        for row in rows:
+            track_pooled, track_legacy, letra_compacta, letra_legacy = row[11:]
+            try:
+                lote.append(CancionVectorizada(
+                    id=row[0],
+                    payload=construir_payload(*row[1:11], track_pooling=pooling),
+                    lyrics_vector=leer_vector(letra_compacta, letra_legacy, storage),
+                    track_vector=leer_vector(track_pooled, track_legacy, storage, pooling),
+                ))
+            except Exception:
+                logger.exception(f"Error leyendo los vectores de la canción {row[0]}; se omite")
+        yield lote
+
+
+def leer_payloads(db_manager, batch_size: int = 1000, condicion: Optional[str] = None,
+                  incluir_letra: bool = False, pooling: Optional[str] = None) -> Iterator[List[Tuple[int, dict]]]:
+    """Como `leer_catalogo`, pero solo (id, payload): no lee ni decodifica los vectores."""
+    pooling = pooling or get_track_pooling()
+    for rows in _leer_filas(db_manager, batch_size, condicion, incluir_letra, 0, pooling):
+        yield [(row[0], construir_payload(*row[1:11], track_pooling=pooling)) for row in rows]
+
+
+def _leer_filas(db_manager, batch_size: int, condicion: Optional[str], incluir_letra: bool, desde_id: int,
+                pooling: str, columnas_extra: str = ""):
+    """Filas (id, campos de `construir_payload`..., columnas_extra...) por keyset."""
+    filtro = filtro_vectorizadas(pooling)
+    where = filtro if not condicion else f"{filtro} AND {condicion}"
+    extra = f", {columnas_extra}" if columnas_extra else ""
+    last_id = desde_id
+    while True:
+        with db_manager.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT l.id, l.artista, l.cancion, l.album, l.mbid,
+                       s.link, t.bpm, t.initialkey, t.genre, {'l.letra' if incluir_letra else 'NULL'},
+                       lc.lyric_cluster_id{extra}
+                FROM lyrics_database l
+                {VECTORS_JOIN}
+                LEFT JOIN song_tags t ON t.song_id = l.id
+                LEFT JOIN song_links s ON s.song_id = l.id
+                LEFT JOIN lyric_clusters lc ON lc.song_id = l.id
+                WHERE {where} AND l.id > %s
+                ORDER BY l.id
+                LIMIT %s;
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+            cur.close()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
@@ -1,27 +1,265 @@
+"""Data-access layer shared by every pipeline stage.
+
+- `ConnectionPool`: thread-safe pool with blocking checkout, liveness checks,
+  max connection lifetime and metrics.
+- `DatabaseManager`: pooled connections with per-pool statement timeout and
+  application name; `AsyncDatabaseManager` wraps it for asyncio services.
+- `create_db_manager`: the pool for a stage, tuned from `STAGE_SETTINGS` and
+  `DB_*` environment variables, so DB tuning lives in one place.
+- `execute_prepared`: server-side prepared statements for hot queries.
+- `bulk_insert` / `copy_rows`: batched writes with execute_values or COPY.
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
 from contextlib import contextmanager
+from typing import Callable, Iterable, Optional, Sequence
 
 try:
-    from psycopg2 import pool
+    import psycopg2
 except Exception:
-    pool = None
+    psycopg2 = None
+
+logger = logging.getLogger('tfm.db')
+
+# Per-stage defaults; any of them can be overridden with DB_<SETTING>_<STAGE>
+# (e.g. DB_STATEMENT_TIMEOUT_MS_SEARCH) or, for every stage, DB_<SETTING>.
+STAGE_SETTINGS = {
+    # Interactive queries: fail fast instead of piling up behind a slow one
+    "search": {"statement_timeout_ms": 5000},
+    "mcp": {"statement_timeout_ms": 10000},
+    # Bulk jobs run long statements (COPY, index builds, backfills)
+    "migrations": {"statement_timeout_ms": 0},
+    "musicbrainz_mirror": {"statement_timeout_ms": 0},
+    "import_dump": {"statement_timeout_ms": 0},
+    "deduplicar": {"statement_timeout_ms": 0},
+}
+DEFAULT_STATEMENT_TIMEOUT_MS = 300000
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    """No connection became available within the checkout timeout."""
+
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE / _UNKNOWN
+_TX_IDLE = 0
+_TX_UNKNOWN = 4
+
+
+class ConnectionPool:
+    """Thread-safe connection pool.
+
+    - `getconn` blocks (up to `timeout` seconds) when every connection is in
+      use, instead of failing like psycopg2's SimpleConnectionPool.
+    - Connections idle for more than `check_idle_after` seconds are pinged
+      with SELECT 1 before being handed out, and connections older than
+      `max_lifetime` are replaced: after a Postgres restart the dead
+      connections are dropped instead of poisoning the pool.
+    - `stats()` exposes checkouts, waits, timeouts, in-use/idle counts and
+      checkout latency.
+
+    `connect` is any callable returning a DB-API connection (fake ones in tests).
+    """
+
+    def __init__(self, connect: Callable, min_conn: int = 1, max_conn: int = 10, timeout: float = 30.0,
+                 max_lifetime: float = 3600.0, check_idle_after: float = 30.0, clock: Callable = time.monotonic):
+        if max_conn < 1 or not 0 <= min_conn <= max_conn:
+            raise ValueError(f"Invalid pool size: min_conn={min_conn}, max_conn={max_conn}")
+        self._connect = connect
+        self.max_conn = max_conn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle_after = check_idle_after
+        # Ages are measured with `clock`; waits always use real time
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, returned_at)
+        self._in_use = {}     # id(conn) -> created_at
+        self._total = 0
+        self._closed = False
+        self._metrics = {"checkouts": 0, "waits": 0, "timeouts": 0, "created": 0, "discarded": 0,
+                         "checkout_seconds_total": 0.0, "checkout_seconds_max": 0.0}
+        for _ in range(min_conn):
+            self._idle.append((self._open(), self._clock(), self._clock()))
+            self._total += 1
+
+    def _open(self):
+        conn = self._connect()
+        with self._cond:
+            self._metrics["created"] += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._metrics["discarded"] += 1
+            self._cond.notify()
+
+    def _alive(self, conn, created_at: float, returned_at: float) -> bool:
+        if getattr(conn, "closed", 0):
+            return False
+        now = self._clock()
+        if now - created_at > self.max_lifetime:
+            return False
+        if now - returned_at > self.check_idle_after:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchone()
+                cur.close()
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding dead pooled connection: {e}")
+                return False
+        return True
+
+    def getconn(self, timeout: Optional[float] = None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("The connection pool is closed")
+                    if self._idle:
+                        # LIFO: reuse the most recently returned (warmest) connection
+                        entry = self._idle.pop()
+                        break
+                    if self._total < self.max_conn:
+                        self._total += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise PoolTimeout(f"No connection available after {timeout:.1f}s "
+                                          f"({self.max_conn} in use)")
+                    if not waited:
+                        waited = True
+                        self._metrics["waits"] += 1
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    conn, created_at = self._open(), self._clock()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                conn, created_at, returned_at = entry
+                # The check runs outside the lock: a ping may take a while
+                if not self._alive(conn, created_at, returned_at):
+                    self._close(conn)
+                    continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._in_use[id(conn)] = created_at
+                self._metrics["checkouts"] += 1
+                self._metrics["checkout_seconds_total"] += elapsed
+                self._metrics["checkout_seconds_max"] = max(self._metrics["checkout_seconds_max"], elapsed)
+            return conn
+
+    def putconn(self, conn, close: bool = False):
+        with self._cond:
+            if id(conn) not in self._in_use:
+                raise PoolError("Trying to return a connection that is not checked out from this pool")
+            created_at = self._in_use.pop(id(conn))
+            discard = close or self._closed
+        discard = discard or bool(getattr(conn, "closed", 0)) or self._clock() - created_at > self.max_lifetime
+        if not discard and hasattr(conn, "get_transaction_status"):
+            status = conn.get_transaction_status()
+            if status == _TX_UNKNOWN:
+                discard = True
+            elif status != _TX_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+        if discard:
+            self._close(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, self._clock()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Closes idle connections now; the ones in use are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            metrics = dict(self._metrics)
+            metrics.update(in_use=len(self._in_use), idle=len(self._idle), total=self._total,
+                           max_conn=self.max_conn)
+        checkouts = metrics["checkouts"]
+        metrics["checkout_seconds_avg"] = metrics["checkout_seconds_total"] / checkouts if checkouts else 0.0
+        return metrics
 
 
 class DatabaseManager:
-    """Manages a psycopg2 connection pool. Pool is created lazily on first use.
+    """Manages a connection pool (`ConnectionPool`). Pool is created lazily on first use.
 
     This avoids requiring a running Postgres instance at module import time (useful for tests).
     """
-    def __init__(self, database_url: str, min_conn: int = 1, max_conn: int = 10):
+    def __init__(self, database_url: str, min_conn: int = 1, max_conn: int = 10,
+                 statement_timeout_ms: Optional[int] = None, application_name: Optional[str] = None,
+                 pool_timeout: float = 30.0, max_lifetime: float = 3600.0, check_idle_after: float = 30.0):
         self._database_url = database_url
         self._min_conn = min_conn
         self._max_conn = max_conn
+        self.statement_timeout_ms = statement_timeout_ms
+        self.application_name = application_name
+        self.pool_timeout = pool_timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle_after = check_idle_after
         self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def connect_kwargs(self) -> dict:
+        """Extra psycopg2.connect arguments applied to every pooled connection."""
+        kwargs = {}
+        if self.statement_timeout_ms is not None:
+            kwargs["options"] = f"-c statement_timeout={int(self.statement_timeout_ms)}"
+        if self.application_name:
+            kwargs["application_name"] = self.application_name
+        return kwargs
+
+    def _connect(self):
+        return psycopg2.connect(self._database_url, **self.connect_kwargs())
 
     def _ensure_pool(self):
         if self._pool is None:
-            if pool is None:
-                raise RuntimeError("psycopg2.pool is not available; install psycopg2-binary")
-            self._pool = pool.SimpleConnectionPool(self._min_conn, self._max_conn, dsn=self._database_url)
+            with self._pool_lock:
+                if self._pool is None:
+                    if psycopg2 is None:
+                        raise RuntimeError("psycopg2 is not available; install psycopg2-binary")
+                    self._pool = ConnectionPool(self._connect, self._min_conn, self._max_conn,
+                                                timeout=self.pool_timeout, max_lifetime=self.max_lifetime,
+                                                check_idle_after=self.check_idle_after)
 
     @contextmanager
     def get_connection(self):
@@ -31,11 +269,159 @@ class DatabaseManager:
             yield conn
             conn.commit()
         except Exception:
-            conn.rollback()
+            try:
+                conn.rollback()
+            except Exception:
+                # Dead connection: putconn discards it
+                pass
             raise
         finally:
             self._pool.putconn(conn)
 
+    @contextmanager
+    def cursor(self, name: Optional[str] = None):
+        """Cursor on a pooled connection; commits on exit (named cursors stream server-side)."""
+        with self.get_connection() as conn:
+            cur = conn.cursor(name=name) if name else conn.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    def stats(self) -> dict:
+        return self._pool.stats() if self._pool else {}
+
     def close(self):
         if self._pool:
             self._pool.closeall()
+
+
+class AsyncDatabaseManager:
+    """asyncio front-end of a `DatabaseManager` for the FastAPI/MCP service.
+
+    Checkout and queries run in worker threads (`asyncio.to_thread`), so the
+    event loop never blocks on Postgres or on a full pool.
+    """
+    def __init__(self, db_manager: DatabaseManager):
+        self.db = db_manager
+
+    async def run(self, func: Callable, *args):
+        """Runs `func(conn, *args)` on a pooled connection (committed on success)."""
+        def _run():
+            with self.db.get_connection() as conn:
+                return func(conn, *args)
+        return await asyncio.to_thread(_run)
+
+    async def fetchall(self, sql: str, params: Optional[Sequence] = None) -> list:
+        def _fetchall(conn):
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.fetchall()
+            finally:
+                cur.close()
+        return await self.run(_fetchall)
+
+    async def execute(self, sql: str, params: Optional[Sequence] = None) -> int:
+        def _execute(conn):
+            cur = conn.cursor()
+            try:
+                cur.execute(sql, params)
+                return cur.rowcount
+            finally:
+                cur.close()
+        return await self.run(_execute)
+
+    def stats(self) -> dict:
+        return self.db.stats()
+
+    async def close(self):
+        await asyncio.to_thread(self.db.close)
+
+
+def stage_setting(stage: str, setting: str, default=None):
+    """Value of `setting` for `stage`: env DB_<SETTING>_<STAGE>, then DB_<SETTING>, then STAGE_SETTINGS."""
+    for var in (f"DB_{setting.upper()}_{stage.upper()}", f"DB_{setting.upper()}"):
+        if os.getenv(var):
+            return os.getenv(var)
+    return STAGE_SETTINGS.get(stage, {}).get(setting, default)
+
+
+def create_db_manager(stage: str, max_conn: int = 2, min_conn: int = 1,
+                      database_url: Optional[str] = None) -> DatabaseManager:
+    """Pool for a pipeline stage (DB_MAX_CONN_<STAGE> overrides `max_conn`).
+
+    Pool behaviour is tuned the same way: DB_POOL_TIMEOUT_S, DB_MAX_LIFETIME_S
+    and DB_CHECK_IDLE_AFTER_S (optionally suffixed with _<STAGE>).
+    """
+    if database_url is None:
+        from common.config import config
+        database_url = config.database_url
+    return DatabaseManager(
+        database_url,
+        min_conn=min_conn,
+        max_conn=int(stage_setting(stage, "max_conn", max_conn)),
+        statement_timeout_ms=int(stage_setting(stage, "statement_timeout_ms", DEFAULT_STATEMENT_TIMEOUT_MS)),
+        application_name=f"tfm-{stage}",
+        pool_timeout=float(stage_setting(stage, "pool_timeout_s", 30)),
+        max_lifetime=float(stage_setting(stage, "max_lifetime_s", 3600)),
+        check_idle_after=float(stage_setting(stage, "check_idle_after_s", 30)),
+    )
+
+
+# Prepared statements live in the server session, i.e. per connection
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+def execute_prepared(cur, name: str, sql: str, params: Sequence = ()):
+    """EXECUTE a statement that is PREPAREd once per connection.
+
+    `sql` uses Postgres placeholders ($1, $2...); `params` are passed as usual.
+    Meant for small queries run once per item, where planning dominates.
+    """
+    conn = cur.connection
+    with _prepared_lock:
+        names = _prepared.setdefault(conn, set())
+    if name not in names:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        names.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", tuple(params))
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def bulk_insert(cur, sql: str, rows: Iterable[Sequence], page_size: int = 1000,
+                template: Optional[str] = None) -> int:
+    """execute_values of `sql` (with a `VALUES %s` placeholder). Returns the rows sent."""
+    import psycopg2.extras
+
+    rows = list(rows)
+    if rows:
+        psycopg2.extras.execute_values(cur, sql, rows, template=template, page_size=page_size)
+    return len(rows)
+
+
+def literal_array(valores) -> str:
+    """Postgres text array literal ('{"a","b"}') for COPY."""
+    elementos = ('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in valores)
+    return "{" + ",".join(elementos) + "}"
+
+
+def a_csv(filas) -> io.StringIO:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for fila in filas:
+        # An empty unquoted CSV field is NULL for COPY
+        writer.writerow([
+            "" if v is None else literal_array(v) if isinstance(v, (list, tuple)) else v
+            for v in fila
+        ])
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence]):
+    """COPY rows into `table` (CSV in memory). Fastest path for large loads."""
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", a_csv(rows))
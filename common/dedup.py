@@ -0,0 +1,182 @@
+"""Detección de canciones duplicadas por título normalizado.
+
+Genius devuelve la misma canción con títulos distintos ("Song", "Song
+(Remastered 2011)", "Song - Live"), y cada variante se descargaba, se
+vectorizaba y se analizaba por separado. Aquí:
+
+- `canciones_canonicas` guarda, para cada fila de `canciones` y de
+  `lyrics_database` (columna `fuente`), su artista y `clave_titulo`
+  normalizados. Todas las filas comparten un mismo espacio de grupos: el
+  `grupo_id` es el menor `id` de la tabla entre los miembros del grupo, así
+  una canción de `canciones` y su letra en `lyrics_database` quedan juntas.
+- Las claves casi iguales (erratas) se emparejan con el operador `%` de
+  pg_trgm sobre un índice GIN (migración 8), o, sin pg_trgm, con un índice
+  invertido de trigramas en memoria (`pares_similares`); nunca comparando
+  todos los títulos de un artista entre sí.
+- `canonica_id` es la canción de menor id del grupo dentro de su misma fuente.
+  Las etapas posteriores filtran con `filtro_canonicas` para trabajar una sola
+  vez por canción, y con `filtro_no_catalogadas` para no buscar la letra de
+  canciones que ya están en `lyrics_database`.
+"""
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from common.db import bulk_insert, execute_prepared
+from common.music_metadata import clave_titulo, normalizar_texto
+
+UMBRAL_TRIGRAMAS = 0.85
+
+
+def filtro_canonicas(fuente: str, columna_id: str) -> str:
+    """Condición SQL que descarta las canciones que son duplicado de otra.
+
+    Las que aún no se han agrupado se consideran canónicas.
+    """
+    return (
+        "NOT EXISTS (SELECT 1 FROM canciones_canonicas cc "
+        f"WHERE cc.fuente = '{fuente}' AND cc.song_id = {columna_id} AND cc.canonica_id <> cc.song_id)"
+    )
+
+
+def filtro_no_catalogadas(columna_id: str) -> str:
+    """Condición SQL que descarta las canciones de `canciones` cuyo grupo ya tiene fila en `lyrics_database`."""
+    return (
+        "NOT EXISTS (SELECT 1 FROM canciones_canonicas cc "
+        "JOIN canciones_canonicas cl ON cl.grupo_id = cc.grupo_id AND cl.fuente = 'lyrics_database' "
+        f"WHERE cc.fuente = 'canciones' AND cc.song_id = {columna_id})"
+    )
+
+
+def trigramas(texto: str) -> set:
+    """Trigramas de cada palabra con relleno, como pg_trgm."""
+    resultado = set()
+    for palabra in texto.split():
+        relleno = f"  {palabra} "
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+def similitud(a: str, b: str) -> float:
+    ta, tb = trigramas(a), trigramas(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+def _numeros(texto: str) -> List[str]:
+    return re.findall(r"\d+", texto)
+
+
+def mismos_numeros(a: str, b: str) -> bool:
+    # "Part 1" y "Part 2" se parecen mucho pero son canciones distintas
+    return _numeros(a) == _numeros(b)
+
+
+def pares_similares(claves: Iterable[str], umbral: float = UMBRAL_TRIGRAMAS) -> List[Tuple[str, str]]:
+    """Pares de claves (de un mismo artista) con similitud de trigramas >= umbral.
+
+    Índice invertido trigrama -> claves: solo se comparan las claves que
+    comparten trigramas suficientes para poder llegar al umbral
+    (|A ∩ B| >= umbral * max(|A|, |B|)).
+    """
+    claves = sorted(set(claves))
+    tris = [trigramas(c) for c in claves]
+    indice = defaultdict(list)
+    for i, t in enumerate(tris):
+        for tri in t:
+            indice[tri].append(i)
+
+    pares = []
+    for i, t in enumerate(tris):
+        comunes = defaultdict(int)
+        for tri in t:
+            for j in indice[tri]:
+                if j > i:
+                    comunes[j] += 1
+        for j, n in comunes.items():
+            if n >= math.ceil(umbral * max(len(t), len(tris[j])) - 1e-9) \
+                    and n / len(t | tris[j]) >= umbral and mismos_numeros(claves[i], claves[j]):
+                pares.append((claves[i], claves[j]))
+    return pares
+
+
+def raices(pares: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+    """{clave: representante} de las claves unidas por `pares` (la menor de cada grupo)."""
+    padre: Dict[str, str] = {}
+
+    def raiz(x):
+        padre.setdefault(x, x)
+        while padre[x] != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    for a, b in pares:
+        ra, rb = raiz(a), raiz(b)
+        if ra != rb:
+            padre[max(ra, rb)] = min(ra, rb)
+    return {clave: raiz(clave) for clave in padre}
+
+
+def agrupar(canciones: Sequence[Tuple[int, str]], umbral: float = UMBRAL_TRIGRAMAS) -> Dict[int, int]:
+    """{id: id canónico} para las canciones (id, título) de un mismo artista."""
+    claves = {song_id: clave_titulo(titulo) for song_id, titulo in canciones}
+    representante = raices(pares_similares(claves.values(), umbral))
+    canonicas: Dict[str, int] = {}
+    for song_id, clave in claves.items():
+        grupo = representante.get(clave, clave)
+        canonicas[grupo] = min(song_id, canonicas.get(grupo, song_id))
+    return {song_id: canonicas[representante.get(clave, clave)] for song_id, clave in claves.items()}
+
+
+class IndiceCanonico:
+    """Registro incremental en `canciones_canonicas` (la crean las migraciones 4 y 8).
+
+    Une por clave exacta al guardar cada canción; las erratas las junta el job
+    `extract_data/lyrics/deduplicar`.
+    """
+
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    def buscar(self, fuente: str, artista: str, titulo: str) -> Optional[int]:
+        """Id canónico de una canción ya registrada con la misma clave, o None."""
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            # Se consulta una vez por canción guardada: sentencia preparada
+            execute_prepared(cur, "canonica_buscar", """
+                SELECT canonica_id FROM canciones_canonicas
+                WHERE fuente = $1 AND artista_norm = $2 AND titulo_norm = $3
+                LIMIT 1
+            """, (fuente, normalizar_texto(artista), clave_titulo(titulo)))
+            row = cur.fetchone()
+            cur.close()
+        return row[0] if row else None
+
+    def registrar(self, fuente: str, filas: Iterable[Tuple[int, str, str, int]]):
+        """Guarda filas (song_id, artista, título, canonica_id) y les asigna grupo."""
+        valores = [(fuente, song_id, normalizar_texto(artista), clave_titulo(titulo), canonica_id)
+                   for song_id, artista, titulo, canonica_id in filas]
+        if not valores:
+            return
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            bulk_insert(cur, """
+                INSERT INTO canciones_canonicas (fuente, song_id, artista_norm, titulo_norm, canonica_id)
+                VALUES %s
+                ON CONFLICT (fuente, song_id) DO UPDATE SET
+                    artista_norm = EXCLUDED.artista_norm,
+                    titulo_norm = EXCLUDED.titulo_norm,
+                    canonica_id = EXCLUDED.canonica_id;
+            """, valores, page_size=1000)
+            # El grupo de la misma clave en cualquier fuente o, si no hay, uno nuevo
+            cur.execute("""
+                UPDATE canciones_canonicas c SET grupo_id = COALESCE((
+                    SELECT min(o.grupo_id) FROM canciones_canonicas o
+                    WHERE o.artista_norm = c.artista_norm AND o.titulo_norm = c.titulo_norm
+                ), c.id)
+                WHERE c.fuente = %s AND c.song_id = ANY(%s) AND c.grupo_id IS NULL;
+            """, (fuente, [v[1] for v in valores]))
+            cur.close()
@@ -0,0 +1,107 @@
+"""Feature store: descriptores de cada canción en tablas estrechas por familia.
+
+Antes eran columnas de `lyrics_database`, así que actualizar un BPM reescribía
+una fila ancha con la letra y dos vectores. Cada familia tiene ahora su tabla,
+con clave `song_id`, columnas tipadas e índices en los campos que se filtran:
+
+- song_tags: bpm, tonalidad (con su código Camelot) y géneros.
+- song_essentia: descriptores de MusicExtractor.
+- song_links: enlace de YouTube del audio de la canción.
+- song_vectors: vectores de letra y audio (y el texto procesado de la letra).
+
+Las tablas las crean las migraciones de `common.migrations`. Las escrituras
+son upserts que no tocan las filas cuyo valor final no cambia.
+"""
+from typing import Dict, Iterable, Optional, Sequence
+
+from common.db import bulk_insert, copy_rows
+
+FAMILIAS = {
+    "song_tags": ("bpm", "initialkey", "camelot", "genre", "genres"),
+    "song_essentia": (
+        "ess_bpm", "ess_key", "ess_scale", "ess_key_strength", "ess_danceability", "ess_duration",
+        "ess_loudness", "ess_dynamic_complexity", "ess_spectral_centroid", "ess_mfcc_mean",
+    ),
+    "song_links": ("link",),
+    "song_vectors": ("letra_procesada", "letra_vec32", "track_vec_pooled", "track_pooling"),
+}
+
+# Cómo se combina el valor nuevo con el guardado
+REEMPLAZAR = "reemplazar"  # siempre el nuevo
+ACTUALIZAR = "actualizar"  # el nuevo, salvo que sea NULL
+RELLENAR = "rellenar"      # el nuevo solo si no había valor
+
+_EXPRESIONES = {
+    REEMPLAZAR: "EXCLUDED.{c}",
+    ACTUALIZAR: "COALESCE(EXCLUDED.{c}, {t}.{c})",
+    RELLENAR: "COALESCE({t}.{c}, EXCLUDED.{c})",
+}
+
+
+def _validar(tabla: str, columnas: Sequence[str]):
+    if tabla not in FAMILIAS:
+        raise ValueError(f"Familia de features desconocida: {tabla}")
+    desconocidas = set(columnas) - set(FAMILIAS[tabla])
+    if desconocidas:
+        raise ValueError(f"Columnas que no pertenecen a {tabla}: {', '.join(sorted(desconocidas))}")
+
+
+def sql_upsert(tabla: str, columnas: Sequence[str], politicas: Optional[Dict[str, str]] = None,
+               origen: str = "VALUES %s") -> str:
+    """INSERT ... ON CONFLICT para `tabla` con las filas de `origen`.
+
+    Args:
+        politicas: columna -> REEMPLAZAR / ACTUALIZAR / RELLENAR (por defecto REEMPLAZAR).
+        origen: `VALUES %s` (execute_values) o un SELECT con (song_id, *columnas).
+    """
+    _validar(tabla, columnas)
+    politicas = politicas or {}
+    expresiones = []
+    for columna in columnas:
+        politica = politicas.get(columna, REEMPLAZAR)
+        if politica not in _EXPRESIONES:
+            raise ValueError(f"Política desconocida para {columna}: {politica}")
+        expresiones.append(_EXPRESIONES[politica].format(c=columna, t=tabla))
+
+    asignaciones = ",\n    ".join(f"{c} = {e}" for c, e in zip(columnas, expresiones))
+    actuales = ", ".join(f"{tabla}.{c}" for c in columnas)
+    # ROW(...) también vale con una sola columna
+    return f"""INSERT INTO {tabla} (song_id, {", ".join(columnas)})
+{origen}
+ON CONFLICT (song_id) DO UPDATE SET
+    {asignaciones},
+    updated_at = CURRENT_TIMESTAMP
+WHERE ROW({actuales}) IS DISTINCT FROM ROW({", ".join(expresiones)})"""
+
+
+def _sin_duplicados(filas: Iterable[Sequence]) -> list:
+    # Un mismo song_id dos veces en un INSERT ... ON CONFLICT es un error; gana la última
+    return list({fila[0]: fila for fila in filas}.values())
+
+
+def guardar(cur, tabla: str, columnas: Sequence[str], filas: Iterable[Sequence],
+            politicas: Optional[Dict[str, str]] = None) -> int:
+    """Upsert con execute_values de filas (song_id, *valores). Devuelve las filas escritas."""
+    filas = _sin_duplicados(filas)
+    if not filas:
+        return 0
+    bulk_insert(cur, sql_upsert(tabla, columnas, politicas), filas, page_size=len(filas))
+    return cur.rowcount
+
+
+def copiar(cur, tabla: str, columnas: Sequence[str], filas: Iterable[Sequence],
+           politicas: Optional[Dict[str, str]] = None) -> int:
+    """Como `guardar`, pero carga las filas con COPY en una tabla temporal (bloques grandes)."""
+    _validar(tabla, columnas)
+    filas = _sin_duplicados(filas)
+    if not filas:
+        return 0
+    temporal = f"tmp_{tabla}"
+    cur.execute(f"""
+        DROP TABLE IF EXISTS {temporal};
+        CREATE TEMP TABLE {temporal} (LIKE {tabla} INCLUDING DEFAULTS) ON COMMIT DROP;
+    """)
+    copy_rows(cur, temporal, ("song_id", *columnas), filas)
+    lista = ", ".join(columnas)
+    cur.execute(sql_upsert(tabla, columnas, politicas, origen=f"SELECT song_id, {lista} FROM {temporal}"))
+    return cur.rowcount
@@ -0,0 +1,187 @@
+"""Resolución de MBIDs de grabaciones en MusicBrainz, con caché persistente.
+
+- Caché en Postgres (`mbid_cache`, migración 7 de `common.migrations`) por
+  artista y título normalizados. Los resultados negativos también se guardan y
+  caducan tras `negative_ttl_days`, así una canción sin MBID no se vuelve a
+  consultar en cada ejecución.
+- `resolver_lote` resuelve varios títulos de un mismo artista con una sola
+  consulta Lucene (`artist:"X" AND (recording:"a" OR recording:"b" ...)`). De
+  los títulos que no aparecen entre los resultados, solo `max_fallback` por
+  consulta se buscan uno a uno (la búsqueda sin comillas encuentra variantes
+  como "Remastered"); el resto se devuelve sin resolver y no se guarda en la
+  caché, así se vuelve a buscar en la siguiente ejecución.
+- Las peticiones respetan el límite de MusicBrainz (una por segundo) y se
+  reintentan si el servicio responde 503.
+"""
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from common.db import bulk_insert
+from common.music_metadata import normalizar_texto
+from common.retry import retry
+
+logger = logging.getLogger('tfm.mbid_resolver')
+
+API_URL = "https://musicbrainz.org/ws/2/recording/"
+USER_AGENT = "TFM_Nayare/1.0 (olealpaca@gmail.com)"
+# Máximo de resultados por página que devuelve la API
+MAX_LIMIT = 100
+
+_LUCENE_ESPECIALES = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def clave(artista: str, cancion: str) -> Tuple[str, str]:
+    return normalizar_texto(artista), normalizar_texto(cancion)
+
+
+def _frase(texto: str) -> str:
+    return '"' + texto.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _terminos(texto: str) -> str:
+    return _LUCENE_ESPECIALES.sub(r"\\\1", texto)
+
+
+def consulta_lote(artista: str, titulos: Iterable[str]) -> str:
+    """Consulta Lucene que busca varios títulos exactos de un artista."""
+    grabaciones = " OR ".join(f"recording:{_frase(t)}" for t in titulos)
+    return f"artist:{_frase(artista)} AND ({grabaciones})"
+
+
+def consulta_individual(artista: str, titulo: str) -> str:
+    # Sin comillas: admite títulos con sufijos ("Remastered", "Live"...)
+    return f"artist:({_terminos(artista)}) AND recording:({_terminos(titulo)})"
+
+
+def emparejar(recordings: List[dict], titulos: Iterable[str]) -> Dict[str, str]:
+    """{título: mbid} para los títulos que coinciden (normalizados) con alguna grabación.
+
+    Los resultados vienen ordenados por puntuación, así que gana la primera coincidencia.
+    """
+    buscados = {}
+    for titulo in titulos:
+        buscados.setdefault(normalizar_texto(titulo), []).append(titulo)
+    encontrados = {}
+    for recording in recordings:
+        for titulo in buscados.pop(normalizar_texto(recording.get("title")), []):
+            encontrados[titulo] = recording["id"]
+    return encontrados
+
+
+class MbidResolver:
+    def __init__(self, db_manager=None, negative_ttl_days: int = 30, min_interval: float = 1.0,
+                 batch_titles: int = 10, max_fallback: int = 2):
+        """Sin `db_manager` la caché solo vive en memoria."""
+        self.db = db_manager
+        self.negative_ttl_days = negative_ttl_days
+        self.min_interval = min_interval
+        self.batch_titles = batch_titles
+        self.max_fallback = max_fallback
+        self.peticiones = 0
+        self._memoria: Dict[Tuple[str, str], Optional[str]] = {}
+        self._lock = threading.Lock()
+        self._ultima_peticion = 0.0
+
+    # --- caché ---
+
+    def _leer_cache(self, claves: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[str]]:
+        if self.db is None:
+            return {k: self._memoria[k] for k in claves if k in self._memoria}
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT c.artista, c.cancion, c.mbid
+                FROM mbid_cache c
+                JOIN unnest(%s::text[], %s::text[]) AS k (artista, cancion)
+                  ON c.artista = k.artista AND c.cancion = k.cancion
+                WHERE c.mbid IS NOT NULL
+                   OR c.resuelto_at > CURRENT_TIMESTAMP - make_interval(days => %s);
+            """, ([a for a, _ in claves], [c for _, c in claves], self.negative_ttl_days))
+            encontrados = {(a, c): mbid for a, c, mbid in cur.fetchall()}
+            cur.close()
+        return encontrados
+
+    def _guardar_cache(self, resultados: Dict[Tuple[str, str], Optional[str]]):
+        if not resultados:
+            return
+        if self.db is None:
+            self._memoria.update(resultados)
+            return
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            bulk_insert(cur, """
+                INSERT INTO mbid_cache (artista, cancion, mbid) VALUES %s
+                ON CONFLICT (artista, cancion) DO UPDATE SET
+                    mbid = EXCLUDED.mbid, resuelto_at = CURRENT_TIMESTAMP;
+            """, [(a, c, mbid) for (a, c), mbid in resultados.items()])
+            cur.close()
+
+    # --- API ---
+
+    def _esperar_turno(self):
+        with self._lock:
+            espera = self._ultima_peticion + self.min_interval - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            self._ultima_peticion = time.monotonic()
+
+    @retry(max_attempts=4, initial_delay=2, backoff=2, exceptions=(requests.RequestException, RateLimitError))
+    def buscar(self, query: str, limit: int) -> dict:
+        self._esperar_turno()
+        self.peticiones += 1
+        r = requests.get(API_URL, params={"query": query, "fmt": "json", "limit": limit},
+                         headers={"User-Agent": USER_AGENT}, timeout=15)
+        # MusicBrainz responde 503 cuando se supera el límite de peticiones
+        if r.status_code == 503:
+            raise RateLimitError("MusicBrainz devolvió 503")
+        r.raise_for_status()
+        return r.json()
+
+    def _buscar_uno(self, artista: str, cancion: str) -> Optional[str]:
+        recordings = self.buscar(consulta_individual(artista, cancion), 1).get("recordings") or []
+        return recordings[0].get("id") if recordings else None
+
+    # --- resolución ---
+
+    def resolver(self, artista: str, cancion: str) -> Optional[str]:
+        return self.resolver_lote(artista, [cancion]).get(cancion)
+
+    def resolver_lote(self, artista: str, canciones: Iterable[str]) -> Dict[str, Optional[str]]:
+        """{canción: mbid o None} para varias canciones de un mismo artista."""
+        canciones = list(dict.fromkeys(canciones))
+        claves = {c: clave(artista, c) for c in canciones}
+        cache = self._leer_cache(list(set(claves.values())))
+        resultado = {c: cache[k] for c, k in claves.items() if k in cache}
+        pendientes = [c for c in canciones if c not in resultado]
+
+        for i in range(0, len(pendientes), self.batch_titles):
+            grupo = pendientes[i:i + self.batch_titles]
+            if len(grupo) > 1:
+                datos = self.buscar(consulta_lote(artista, grupo), MAX_LIMIT)
+                encontrados = emparejar(datos.get("recordings") or [], grupo)
+                # Acotado: buscar cada fallo uno a uno costaría N+1 peticiones por lote
+                individuales = [c for c in grupo if c not in encontrados][:self.max_fallback]
+            else:
+                encontrados, individuales = {}, grupo
+            nuevos = {}
+            for cancion in grupo:
+                if cancion in encontrados:
+                    mbid = encontrados[cancion]
+                elif cancion in individuales:
+                    mbid = self._buscar_uno(artista, cancion)
+                else:
+                    # Sin búsqueda individual: no es un negativo, queda pendiente
+                    resultado[cancion] = None
+                    continue
+                resultado[cancion] = nuevos[claves[cancion]] = mbid
+            self._guardar_cache(nuevos)
+        return resultado
@@ -0,0 +1,401 @@
+"""Migraciones versionadas del esquema de Postgres.
+
+Sustituyen a los `ALTER TABLE ... ADD COLUMN IF NOT EXISTS` que cada script
+ejecutaba al arrancar. Cada migración se aplica una sola vez, en orden y en su
+propia transacción, y queda registrada en `schema_migrations`. Un advisory
+lock evita que dos etapas que arrancan a la vez apliquen la misma.
+
+Una migración publicada no se modifica: los cambios van en una nueva.
+
+    python -m common.migrations
+"""
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from common.db import bulk_insert
+from common.music_metadata import a_camelot, normalizar_generos
+
+logger = logging.getLogger('tfm.migrations')
+
+# Clave del advisory lock (arbitraria, fija para todo el proyecto)
+LOCK_KEY = 7240511
+
+TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    aplicada_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+@dataclass
+class Migracion:
+    version: int
+    nombre: str
+    sql: Optional[str] = None
+    # Para migraciones que necesitan Python (recibe el cursor)
+    funcion: Optional[Callable] = None
+    # Tabla que no crea este repositorio y de la que depende la migración
+    # (lyrics_database llega de fuera): mientras no exista, la migración se
+    # deja pendiente y se aplica en una ejecución posterior
+    requiere: Optional[str] = None
+
+    def aplicar(self, cur):
+        if self.sql:
+            cur.execute(self.sql)
+        if self.funcion:
+            self.funcion(cur)
+
+
+# Las columnas compactas nacen como BYTEA en todos los entornos; pasarlas a
+# pgvector (VECTOR_STORAGE=vector/halfvec) es una conversión aparte
+# (vectors/convert_storage), no depende de la configuración al migrar
+COLUMNAS_LYRICS_DATABASE_SQL = """
+ALTER TABLE lyrics_database
+ADD COLUMN IF NOT EXISTS mbid TEXT,
+ADD COLUMN IF NOT EXISTS letra_procesada TEXT,
+ADD COLUMN IF NOT EXISTS letra_vec float8[],
+ADD COLUMN IF NOT EXISTS letra_vec32 BYTEA,
+ADD COLUMN IF NOT EXISTS track_vector JSONB,
+ADD COLUMN IF NOT EXISTS track_vec_pooled BYTEA,
+ADD COLUMN IF NOT EXISTS track_pooling TEXT;
+"""
+
+
+FEATURE_STORE_SQL = """
+CREATE TABLE IF NOT EXISTS song_tags (
+    song_id INTEGER PRIMARY KEY,
+    bpm REAL,
+    initialkey TEXT,
+    camelot VARCHAR(3),
+    genre TEXT,
+    genres TEXT[],
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_song_tags_bpm ON song_tags (bpm);
+CREATE INDEX IF NOT EXISTS idx_song_tags_camelot ON song_tags (camelot);
+CREATE INDEX IF NOT EXISTS idx_song_tags_genres ON song_tags USING GIN (genres);
+
+CREATE TABLE IF NOT EXISTS song_essentia (
+    song_id INTEGER PRIMARY KEY,
+    ess_bpm REAL,
+    ess_key TEXT,
+    ess_scale TEXT,
+    ess_key_strength REAL,
+    ess_danceability REAL,
+    ess_duration REAL,
+    ess_loudness REAL,
+    ess_dynamic_complexity REAL,
+    ess_spectral_centroid REAL,
+    ess_mfcc_mean REAL[],
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS song_links (
+    song_id INTEGER PRIMARY KEY,
+    link TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Canciones ya subidas a Qdrant (antes lyrics_database.vector_migrado)
+CREATE TABLE IF NOT EXISTS qdrant_sync (
+    song_id INTEGER PRIMARY KEY,
+    migrado_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+CANCIONES_CANONICAS_SQL = """
+-- Canción canónica de cada fila de canciones / lyrics_database (common.dedup)
+CREATE TABLE IF NOT EXISTS canciones_canonicas (
+    fuente VARCHAR(30) NOT NULL,
+    song_id INTEGER NOT NULL,
+    artista_norm TEXT NOT NULL,
+    titulo_norm TEXT NOT NULL,
+    canonica_id INTEGER NOT NULL,
+    PRIMARY KEY (fuente, song_id)
+);
+CREATE INDEX IF NOT EXISTS idx_canciones_canonicas_clave
+    ON canciones_canonicas (fuente, artista_norm, titulo_norm);
+"""
+
+
+LYRIC_MINHASH_SQL = """
+-- Buckets LSH de las firmas MinHash de las letras (common.minhash)
+CREATE TABLE IF NOT EXISTS lyric_lsh (
+    banda SMALLINT NOT NULL,
+    bucket BIGINT NOT NULL,
+    song_id INTEGER NOT NULL,
+    PRIMARY KEY (banda, bucket, song_id)
+);
+
+CREATE TABLE IF NOT EXISTS lyric_clusters (
+    song_id INTEGER PRIMARY KEY,
+    lyric_cluster_id INTEGER NOT NULL,
+    firma BYTEA NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_lyric_clusters_cluster ON lyric_clusters (lyric_cluster_id);
+"""
+
+
+PROGRESO_Y_COLA_SQL = """
+-- Antes las creaban ProgressManager y WorkQueue al instanciarse
+CREATE TABLE IF NOT EXISTS progress_tracking (
+    id SERIAL PRIMARY KEY,
+    task_type VARCHAR(50) UNIQUE NOT NULL,
+    current_offset INTEGER DEFAULT 0,
+    total_items INTEGER DEFAULT 0,
+    last_processed_id INTEGER,
+    status VARCHAR(20) DEFAULT 'running',
+    error_message TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Punto de reanudación no entero (p. ej. una fecha de MongoDB)
+ALTER TABLE progress_tracking ADD COLUMN IF NOT EXISTS last_processed_key TEXT;
+
+CREATE TABLE IF NOT EXISTS work_queue (
+    task_type VARCHAR(50) NOT NULL,
+    item_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    -- claimed: fin del lease; pending: no reintentar antes de esta hora
+    lease_until TIMESTAMP,
+    last_error TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (task_type, item_id)
+);
+CREATE INDEX IF NOT EXISTS idx_work_queue_disponibles
+    ON work_queue (task_type, item_id) WHERE status IN ('pending', 'claimed');
+"""
+
+
+MBID_CACHE_SQL = """
+-- Caché de common.mbid_resolver
+CREATE TABLE IF NOT EXISTS mbid_cache (
+    artista TEXT NOT NULL,
+    cancion TEXT NOT NULL,
+    -- NULL: MusicBrainz no devolvió nada (resultado negativo)
+    mbid TEXT,
+    resuelto_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (artista, cancion)
+);
+"""
+
+
+GRUPOS_CANONICOS_SQL = """
+-- Un único espacio de grupos para canciones y lyrics_database: grupo_id es el
+-- menor id de canciones_canonicas entre los miembros del grupo
+ALTER TABLE canciones_canonicas
+    ADD COLUMN IF NOT EXISTS id BIGSERIAL,
+    ADD COLUMN IF NOT EXISTS grupo_id BIGINT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_canciones_canonicas_id ON canciones_canonicas (id);
+CREATE INDEX IF NOT EXISTS idx_canciones_canonicas_grupo ON canciones_canonicas (grupo_id);
+CREATE INDEX IF NOT EXISTS idx_canciones_canonicas_artista_titulo
+    ON canciones_canonicas (artista_norm, titulo_norm);
+UPDATE canciones_canonicas c SET grupo_id = g.grupo_id
+FROM (
+    SELECT fuente, song_id, min(id) OVER (PARTITION BY artista_norm, titulo_norm) AS grupo_id
+    FROM canciones_canonicas
+) g
+WHERE c.fuente = g.fuente AND c.song_id = g.song_id;
+"""
+
+
+QDRANT_PAYLOAD_VERSION_SQL = """
+-- Versión del payload con que se subió cada punto (vectors/postgre_to_qdrant).
+-- Los puntos subidos antes de esta migración quedan en 0 y se actualizan con
+-- set_payload sin volver a subir los vectores
+ALTER TABLE qdrant_sync ADD COLUMN IF NOT EXISTS payload_version INTEGER NOT NULL DEFAULT 0;
+"""
+
+
+SONG_VECTORS_SQL = """
+-- Vectores de cada canción fuera de lyrics_database: escribir un vector ya no
+-- reescribe la fila ancha con la letra. BYTEA como en la migración 1; el paso a
+-- pgvector lo hace vectors/convert_storage
+CREATE TABLE IF NOT EXISTS song_vectors (
+    song_id INTEGER PRIMARY KEY,
+    letra_procesada TEXT,
+    letra_vec32 BYTEA,
+    track_vec_pooled BYTEA,
+    track_pooling TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO song_vectors (song_id, letra_procesada, letra_vec32, track_vec_pooled, track_pooling)
+SELECT id, letra_procesada, letra_vec32, track_vec_pooled, track_pooling FROM lyrics_database
+WHERE letra_procesada IS NOT NULL OR letra_vec32 IS NOT NULL OR track_vec_pooled IS NOT NULL
+ON CONFLICT (song_id) DO NOTHING;
+"""
+
+# Columnas de lyrics_database que ya tienen tabla propia (migraciones 2, 3 y 10)
+# y que ningún proceso lee. letra_vec y track_vector se quedan: son el formato
+# antiguo que aún convierte vectors/convert_storage (CONVERT_DROP_LEGACY las vacía).
+# DROP COLUMN no reescribe la tabla; el espacio se recupera con VACUUM FULL
+COLUMNAS_MOVIDAS = (
+    'bpm', 'initialkey', 'genre', 'link', 'vector_migrado',
+    'ess_bpm', 'ess_key', 'ess_scale', 'ess_key_strength', 'ess_danceability', 'ess_duration',
+    'ess_loudness', 'ess_dynamic_complexity', 'ess_spectral_centroid', 'ess_mfcc_mean', 'ess_analizado_at',
+    'letra_procesada', 'letra_vec32', 'track_vec_pooled', 'track_pooling',
+)
+SIN_COLUMNAS_MOVIDAS_SQL = "ALTER TABLE lyrics_database " + ", ".join(
+    f"DROP COLUMN IF EXISTS {columna}" for columna in COLUMNAS_MOVIDAS) + ";"
+
+
+def _grupos_canonicos(cur):
+    cur.execute(GRUPOS_CANONICOS_SQL)
+    # Índice de trigramas para emparejar erratas con el operador %; sin permisos
+    # para crear pg_trgm, common.dedup usa un índice invertido en memoria
+    cur.execute("SAVEPOINT trgm;")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT trgm;")
+        logger.warning(f"pg_trgm no disponible ({e}); la deduplicación no usará índice de trigramas")
+        return
+    cur.execute("RELEASE SAVEPOINT trgm;")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_canciones_canonicas_titulo_trgm
+            ON canciones_canonicas USING GIN (titulo_norm gin_trgm_ops);
+    """)
+
+
+def _columnas_existentes(cur, tabla: str) -> set:
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s;", (tabla,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def _copiar_columnas_antiguas(cur):
+    """Pasa al feature store lo que ya hubiera en las columnas de lyrics_database."""
+    columnas = _columnas_existentes(cur, 'lyrics_database')
+
+    if {'bpm', 'initialkey', 'genre'} <= columnas:
+        cur.execute("""
+            SELECT id, bpm, initialkey, genre FROM lyrics_database
+            WHERE bpm IS NOT NULL OR initialkey IS NOT NULL OR genre IS NOT NULL;
+        """)
+        filas = [(id_, bpm, key, a_camelot(key), genre, normalizar_generos(genre))
+                 for id_, bpm, key, genre in cur.fetchall()]
+        bulk_insert(cur, """
+            INSERT INTO song_tags (song_id, bpm, initialkey, camelot, genre, genres) VALUES %s
+            ON CONFLICT (song_id) DO NOTHING;
+        """, filas, page_size=5000)
+        logger.info(f"{len(filas)} filas copiadas a song_tags")
+
+    ess = [c for c in ('ess_bpm', 'ess_key', 'ess_scale', 'ess_key_strength', 'ess_danceability',
+                       'ess_duration', 'ess_loudness', 'ess_dynamic_complexity', 'ess_spectral_centroid',
+                       'ess_mfcc_mean') if c in columnas]
+    if 'ess_analizado_at' in columnas and ess:
+        cur.execute(f"""
+            INSERT INTO song_essentia (song_id, {", ".join(ess)}, updated_at)
+            SELECT id, {", ".join(ess)}, ess_analizado_at FROM lyrics_database
+            WHERE ess_analizado_at IS NOT NULL
+            ON CONFLICT (song_id) DO NOTHING;
+        """)
+        logger.info(f"{cur.rowcount} filas copiadas a song_essentia")
+
+    if 'link' in columnas:
+        cur.execute("""
+            INSERT INTO song_links (song_id, link)
+            SELECT id, link FROM lyrics_database WHERE link IS NOT NULL
+            ON CONFLICT (song_id) DO NOTHING;
+        """)
+        logger.info(f"{cur.rowcount} filas copiadas a song_links")
+
+    if 'vector_migrado' in columnas:
+        cur.execute("""
+            INSERT INTO qdrant_sync (song_id)
+            SELECT id FROM lyrics_database WHERE vector_migrado
+            ON CONFLICT (song_id) DO NOTHING;
+        """)
+
+
+MIGRACIONES: List[Migracion] = [
+    Migracion(1, "columnas_lyrics_database", sql=COLUMNAS_LYRICS_DATABASE_SQL, requiere="lyrics_database"),
+    Migracion(2, "feature_store", sql=FEATURE_STORE_SQL),
+    Migracion(3, "feature_store_desde_columnas", funcion=_copiar_columnas_antiguas, requiere="lyrics_database"),
+    Migracion(4, "canciones_canonicas", sql=CANCIONES_CANONICAS_SQL),
+    Migracion(5, "lyric_minhash", sql=LYRIC_MINHASH_SQL),
+    Migracion(6, "progress_tracking_y_work_queue", sql=PROGRESO_Y_COLA_SQL),
+    Migracion(7, "mbid_cache", sql=MBID_CACHE_SQL),
+    Migracion(8, "grupos_canonicos", funcion=_grupos_canonicos),
+    Migracion(9, "qdrant_payload_version", sql=QDRANT_PAYLOAD_VERSION_SQL),
+    # Requieren lyrics_database para aplicarse después de la 1 y la 3, que la necesitan
+    Migracion(10, "song_vectors", sql=SONG_VECTORS_SQL, requiere="lyrics_database"),
+    Migracion(11, "lyrics_database_sin_columnas_movidas", sql=SIN_COLUMNAS_MOVIDAS_SQL,
+              requiere="lyrics_database"),
+]
+
+
+def pendientes(aplicadas, migraciones: Optional[List[Migracion]] = None) -> List[Migracion]:
+    migraciones = MIGRACIONES if migraciones is None else migraciones
+    versiones = [m.version for m in migraciones]
+    if len(set(versiones)) != len(versiones):
+        raise ValueError("Hay versiones de migración repetidas")
+    return sorted((m for m in migraciones if m.version not in aplicadas), key=lambda m: m.version)
+
+
+SIN_TIMEOUT_SQL = "SET LOCAL statement_timeout = 0;"
+
+
+def migrar(conn, migraciones: Optional[List[Migracion]] = None) -> List[int]:
+    """Aplica sobre la conexión las migraciones pendientes. Devuelve las versiones aplicadas."""
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    cur = conn.cursor()
+    aplicadas = []
+    try:
+        # El pool de cada etapa fija su statement_timeout; esperar el lock o
+        # construir un índice puede tardar más. SET LOCAL dura hasta el commit
+        cur.execute(SIN_TIMEOUT_SQL)
+        cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_KEY,))
+        cur.execute(TABLE_SQL)
+        cur.execute("SELECT version FROM schema_migrations;")
+        ya_aplicadas = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        for migracion in pendientes(ya_aplicadas, migraciones):
+            if migracion.requiere:
+                cur.execute("SELECT to_regclass(%s);", (migracion.requiere,))
+                if cur.fetchone()[0] is None:
+                    logger.info(f"Migración {migracion.version} pendiente: aún no existe {migracion.requiere}")
+                    continue
+            logger.info(f"Aplicando migración {migracion.version}: {migracion.nombre}")
+            cur.execute(SIN_TIMEOUT_SQL)
+            migracion.aplicar(cur)
+            cur.execute("INSERT INTO schema_migrations (version, nombre) VALUES (%s, %s);",
+                        (migracion.version, migracion.nombre))
+            conn.commit()
+            aplicadas.append(migracion.version)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # El lock es de sesión: sobrevive al rollback y hay que soltarlo
+        cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_KEY,))
+        conn.commit()
+        cur.close()
+        conn.autocommit = autocommit
+    return aplicadas
+
+
+def aplicar_migraciones(db_manager) -> List[int]:
+    with db_manager.get_connection() as conn:
+        return migrar(conn)
+
+
+def main():
+    from common.db import create_db_manager
+    from common.logging import setup_logging
+
+    setup_logging()
+    db_manager = create_db_manager("migrations", max_conn=1)
+    aplicadas = aplicar_migraciones(db_manager)
+    logger.info(f"Migraciones aplicadas: {aplicadas or 'ninguna, el esquema está al día'}")
+    db_manager.close()
+
+
+if __name__ == '__main__':
+    main()
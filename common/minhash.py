@@ -0,0 +1,263 @@
+"""Detección de letras casi idénticas con MinHash y LSH.
+
+Versiones en directo, reediciones y covers llegan a `lyrics_database` con la
+misma letra (salvo algún verso o un pie de página distinto). Cada una se
+vectorizaba, se subía a Qdrant y aparecía como un resultado más.
+
+- `firmas` calcula en NumPy la firma MinHash de cada letra a partir de sus
+  shingles de `SHINGLE_SIZE` palabras.
+- La firma se parte en `BANDAS` bandas; dos letras con una banda igual son
+  candidatas y se confirman si la similitud estimada supera `UMBRAL`.
+- Los buckets de cada banda (`lyric_lsh`) y la firma y el cluster de cada
+  canción (`lyric_clusters`) se guardan, así cada pasada solo procesa las
+  letras nuevas. El `lyric_cluster_id` es el menor id del grupo.
+
+    python -m common.minhash
+"""
+import logging
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.db import bulk_insert
+from common.music_metadata import normalizar_texto
+
+logger = logging.getLogger('tfm.minhash')
+
+NUM_PERM = int(os.getenv('LYRIC_MINHASH_PERM', '128'))
+BANDAS = int(os.getenv('LYRIC_MINHASH_BANDS', '16'))
+SHINGLE_SIZE = 3
+# Similitud de Jaccard estimada mínima para considerar dos letras la misma
+UMBRAL = float(os.getenv('LYRIC_MINHASH_THRESHOLD', '0.8'))
+SEED = 1
+
+# Primo menor que 2**32: (a * h + b) cabe en uint64 sin desbordar
+_PRIMO = np.uint64(4294967291)
+_BASE_BANDA = np.uint64(1000003)
+
+# Con LIMIT por página se lee por keyset (funciona también en autocommit)
+PENDIENTES_SQL = """
+    SELECT l.id, l.letra FROM lyrics_database l
+    WHERE l.letra IS NOT NULL AND l.id > %s
+      AND NOT EXISTS (SELECT 1 FROM lyric_clusters c WHERE c.song_id = l.id)
+    ORDER BY l.id
+    LIMIT %s;
+"""
+
+
+def filtro_no_duplicadas(columna_id: str, miembros: Optional[str] = None) -> str:
+    """Condición SQL que descarta las letras duplicadas de otra (no canónicas en su cluster).
+
+    Con `miembros` (condición SQL sobre `o.song_id`) solo cuentan los miembros
+    del cluster que la cumplen: pasa la de menor id entre ellos, aunque la
+    canónica del cluster (su menor id) no la cumpla.
+    """
+    if miembros is None:
+        return (
+            "NOT EXISTS (SELECT 1 FROM lyric_clusters lc "
+            f"WHERE lc.song_id = {columna_id} AND lc.lyric_cluster_id <> lc.song_id)"
+        )
+    return (
+        "NOT EXISTS (SELECT 1 FROM lyric_clusters lc "
+        "JOIN lyric_clusters o ON o.lyric_cluster_id = lc.lyric_cluster_id "
+        f"WHERE lc.song_id = {columna_id} AND o.song_id < {columna_id} AND {miembros})"
+    )
+
+
+def _permutaciones(num_perm: int, seed: int = SEED) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_PRIMO), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_PRIMO), size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def limpiar_letra(letra: Optional[str]) -> str:
+    # Genius añade a veces un pie separado por "____"
+    return normalizar_texto((letra or "").split("____")[0])
+
+
+def shingles(texto: str, k: int = SHINGLE_SIZE) -> np.ndarray:
+    """Hashes uint32 de los shingles de k palabras, sin repetir."""
+    palabras = texto.split()
+    if not palabras:
+        return np.empty(0, dtype=np.uint64)
+    # crc32 es estable entre procesos (hash() no), y las firmas se guardan
+    tokens = np.fromiter((zlib.crc32(p.encode()) for p in palabras), dtype=np.uint64, count=len(palabras))
+    if len(tokens) < k:
+        k = len(tokens)
+    combinados = np.zeros(len(tokens) - k + 1, dtype=np.uint64)
+    for i in range(k):
+        combinados = combinados * np.uint64(31) + tokens[i:len(tokens) - k + 1 + i]
+    return np.unique(combinados & np.uint64(0xFFFFFFFF))
+
+
+def firmas(textos: Sequence[str], num_perm: int = NUM_PERM, seed: int = SEED) -> np.ndarray:
+    """Firmas MinHash (n, num_perm) uint32; las letras vacías quedan a 0xFFFFFFFF."""
+    a, b = _permutaciones(num_perm, seed)
+    resultado = np.full((len(textos), num_perm), 0xFFFFFFFF, dtype=np.uint32)
+    for i, texto in enumerate(textos):
+        hashes = shingles(texto)
+        if hashes.size:
+            resultado[i] = ((np.outer(hashes, a) + b) % _PRIMO).min(axis=0)
+    return resultado
+
+
+def buckets(firmas_: np.ndarray, bandas: int = BANDAS) -> np.ndarray:
+    """Hash int64 de cada banda de cada firma: matriz (n, bandas)."""
+    n, num_perm = firmas_.shape
+    if num_perm % bandas:
+        raise ValueError(f"{num_perm} permutaciones no se reparten en {bandas} bandas")
+    filas = firmas_.reshape(n, bandas, num_perm // bandas).astype(np.uint64)
+    h = np.zeros((n, bandas), dtype=np.uint64)
+    for j in range(filas.shape[2]):
+        # Desborda a propósito (módulo 2**64)
+        h = h * _BASE_BANDA + filas[:, :, j]
+    return h.view(np.int64)
+
+
+def similitud(a: np.ndarray, b: np.ndarray) -> float:
+    """Jaccard estimada: fracción de posiciones iguales de dos firmas."""
+    return float(np.mean(a == b))
+
+
+def _fusionar(clusters_existentes: Dict[int, int], nuevas: List[int],
+              parejas: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    """{song_id: cluster} de las canciones nuevas y {cluster antiguo: cluster nuevo}
+    de los clusters existentes que se fusionan.
+
+    `parejas` son pares (nueva, candidata) ya confirmados; la candidata puede
+    ser otra nueva o una canción con cluster en `clusters_existentes`.
+    """
+    padre = {}
+
+    def raiz(x):
+        padre.setdefault(x, x)
+        while padre[x] != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    for song_id in nuevas:
+        raiz(song_id)
+    for nueva, candidata in parejas:
+        ra, rb = raiz(nueva), raiz(clusters_existentes.get(candidata, candidata))
+        if ra != rb:
+            padre[max(ra, rb)] = min(ra, rb)
+
+    resultado = {song_id: raiz(song_id) for song_id in nuevas}
+    for cluster in set(clusters_existentes.values()):
+        if cluster in padre and raiz(cluster) != cluster:
+            resultado[cluster] = raiz(cluster)
+    return resultado
+
+
+class LyricLSH:
+    """Índice LSH persistente en Postgres; trabaja sobre un cursor."""
+
+    def __init__(self, num_perm: int = NUM_PERM, bandas: int = BANDAS, umbral: float = UMBRAL):
+        self.num_perm = num_perm
+        self.bandas = bandas
+        self.umbral = umbral
+
+    def _candidatos(self, cur, ids: List[int], bks: np.ndarray) -> List[Tuple[int, int]]:
+        cur.execute("""
+            SELECT DISTINCT k.song_id, b.song_id
+            FROM unnest(%s::int[], %s::smallint[], %s::bigint[]) AS k (song_id, banda, bucket)
+            JOIN lyric_lsh b ON b.banda = k.banda AND b.bucket = k.bucket
+            WHERE b.song_id <> k.song_id;
+        """, (
+            np.repeat(ids, self.bandas).tolist(),
+            np.tile(np.arange(self.bandas), len(ids)).tolist(),
+            bks.ravel().tolist(),
+        ))
+        return cur.fetchall()
+
+    def _firmas_guardadas(self, cur, ids) -> Dict[int, Tuple[int, np.ndarray]]:
+        cur.execute("SELECT song_id, lyric_cluster_id, firma FROM lyric_clusters WHERE song_id = ANY(%s);",
+                    (list(ids),))
+        return {song_id: (cluster, np.frombuffer(bytes(firma), dtype=np.uint32))
+                for song_id, cluster, firma in cur.fetchall()}
+
+    def agrupar(self, cur, letras: Sequence[Tuple[int, str]]) -> Dict[int, int]:
+        """Añade al índice las letras (id, letra). Devuelve lo mismo que `_fusionar`."""
+        from psycopg2 import Binary
+
+        letras = [(song_id, limpiar_letra(letra)) for song_id, letra in letras]
+        ids = [song_id for song_id, _ in letras]
+        fs = firmas([texto for _, texto in letras], self.num_perm)
+        bks = buckets(fs, self.bandas)
+        # Sin ningún shingle no hay con qué comparar: la canción es su propio cluster
+        con_texto = np.array([bool(texto) for _, texto in letras], dtype=bool)
+
+        bulk_insert(cur, """
+            INSERT INTO lyric_lsh (banda, bucket, song_id) VALUES %s ON CONFLICT DO NOTHING;
+        """, [(banda, int(bks[i, banda]), ids[i])
+              for i in np.flatnonzero(con_texto) for banda in range(self.bandas)], page_size=10000)
+
+        pares = self._candidatos(cur, [ids[i] for i in np.flatnonzero(con_texto)], bks[con_texto]) \
+            if con_texto.any() else []
+        por_id = {song_id: fs[i] for i, song_id in enumerate(ids)}
+        guardadas = self._firmas_guardadas(cur, {c for _, c in pares if c not in por_id})
+        confirmadas = []
+        for nueva, candidata in pares:
+            firma = por_id[candidata] if candidata in por_id else guardadas.get(candidata, (None, None))[1]
+            if firma is not None and similitud(por_id[nueva], firma) >= self.umbral:
+                confirmadas.append((nueva, candidata))
+
+        existentes = {song_id: cluster for song_id, (cluster, _) in guardadas.items()}
+        cambios = _fusionar(existentes, ids, confirmadas)
+
+        bulk_insert(cur, """
+            INSERT INTO lyric_clusters (song_id, lyric_cluster_id, firma) VALUES %s
+            ON CONFLICT (song_id) DO UPDATE SET
+                lyric_cluster_id = EXCLUDED.lyric_cluster_id, updated_at = CURRENT_TIMESTAMP;
+        """, [(song_id, cambios[song_id], Binary(fs[i].tobytes())) for i, song_id in enumerate(ids)],
+            page_size=1000)
+        fusionados = {c: nuevo for c, nuevo in cambios.items() if c not in por_id}
+        if fusionados:
+            # Una letra nueva puede unir dos clusters que ya existían
+            cur.execute("""
+                UPDATE lyric_clusters c SET lyric_cluster_id = f.nuevo, updated_at = CURRENT_TIMESTAMP
+                FROM unnest(%s::int[], %s::int[]) AS f (antiguo, nuevo)
+                WHERE c.lyric_cluster_id = f.antiguo;
+            """, (list(fusionados), list(fusionados.values())))
+        return cambios
+
+    def agrupar_pendientes(self, conn, batch_size: int = 2000) -> Tuple[int, int]:
+        """Procesa las letras sin cluster, confirmando cada lote. Devuelve (procesadas, duplicadas)."""
+        cur = conn.cursor()
+        procesadas = duplicadas = 0
+        ultimo = 0
+        while True:
+            cur.execute(PENDIENTES_SQL, (ultimo, batch_size))
+            filas = cur.fetchall()
+            if not filas:
+                break
+            ultimo = filas[-1][0]
+            cambios = self.agrupar(cur, filas)
+            conn.commit()
+            procesadas += len(filas)
+            duplicadas += sum(1 for song_id, _ in filas if cambios[song_id] != song_id)
+            logger.info(f"{procesadas} letras agrupadas ({duplicadas} duplicadas)")
+        cur.close()
+        return procesadas, duplicadas
+
+
+def main():
+    from common.db import create_db_manager
+    from common.logging import setup_logging
+    from common.migrations import aplicar_migraciones
+
+    setup_logging()
+    db_manager = create_db_manager("lyric_minhash", max_conn=1)
+    aplicar_migraciones(db_manager)
+    with db_manager.get_connection() as conn:
+        procesadas, duplicadas = LyricLSH().agrupar_pendientes(conn)
+    logger.info(f"✅ {procesadas} letras agrupadas; {duplicadas} son duplicado de otra")
+    db_manager.close()
+
+
+if __name__ == '__main__':
+    main()
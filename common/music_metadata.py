@@ -0,0 +1,132 @@
+"""Normalización de metadatos musicales (tonalidad, género, títulos) compartida entre etapas.
+
+La tonalidad llega con notaciones distintas según la fuente ("Am", "A minor",
+"C#", "8A"...). Aquí se traduce todo a la notación Camelot, que es la que se
+guarda en el payload de Qdrant y la que usan los filtros de búsqueda.
+
+Los títulos de Genius traen sufijos de versión ("Song (Remastered 2011)",
+"Song - Live"); `clave_titulo` los quita para reconocer la misma canción.
+"""
+import re
+import unicodedata
+from typing import Iterable, List, Optional
+
+_NOTAS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_ALTERACIONES = {'': 0, '#': 1, '♯': 1, 'b': -1, '♭': -1}
+_MODOS_MENORES = {'m', 'min', 'minor', 'menor'}
+_MODOS_MAYORES = {'', 'maj', 'major', 'mayor'}
+
+_KEY_RE = re.compile(r'^([A-Ga-g])([#♯b♭]?)\s*([A-Za-z]*)$')
+_CAMELOT_RE = re.compile(r'^(1[0-2]|[1-9])\s*([ABab])$')
+
+
+def a_camelot(tonalidad: Optional[str]) -> Optional[str]:
+    """Convierte una tonalidad en cualquier notación habitual a código Camelot.
+
+    Devuelve None si no se reconoce la notación.
+    """
+    if not tonalidad:
+        return None
+    texto = str(tonalidad).strip()
+
+    camelot = _CAMELOT_RE.match(texto)
+    if camelot:
+        return f"{int(camelot.group(1))}{camelot.group(2).upper()}"
+
+    match = _KEY_RE.match(texto)
+    if not match:
+        return None
+    nota, alteracion, modo = match.groups()
+    # "M" (mayúscula) es mayor; el resto de modos no distingue mayúsculas
+    modo = modo if modo == 'M' else modo.lower()
+    if modo == 'M' or modo in _MODOS_MAYORES:
+        menor = False
+    elif modo in _MODOS_MENORES:
+        menor = True
+    else:
+        return None
+
+    clase = (_NOTAS[nota.upper()] + _ALTERACIONES[alteracion]) % 12
+    if menor:
+        # La relativa mayor está tres semitonos por encima
+        clase = (clase + 3) % 12
+    numero = ((7 * clase) % 12 + 7) % 12 + 1
+    return f"{numero}{'A' if menor else 'B'}"
+
+
+def tonalidades_compatibles(tonalidad: Optional[str]) -> List[str]:
+    """Códigos Camelot compatibles para mezclar con la tonalidad dada.
+
+    Incluye la propia tonalidad, su relativa mayor/menor y las vecinas
+    (±1) en la rueda de Camelot.
+    """
+    codigo = a_camelot(tonalidad)
+    if not codigo:
+        return []
+    numero, letra = int(codigo[:-1]), codigo[-1]
+    otra_letra = 'B' if letra == 'A' else 'A'
+    anterior = (numero - 2) % 12 + 1
+    siguiente = numero % 12 + 1
+    return [codigo, f"{numero}{otra_letra}", f"{anterior}{letra}", f"{siguiente}{letra}"]
+
+
+def normalizar_generos(generos) -> List[str]:
+    """Devuelve una lista de géneros en minúsculas, sin duplicados.
+
+    Acepta listas (tags de AcousticBrainz), arrays de Postgres en texto
+    ('{rock,pop}') o cadenas separadas por comas, punto y coma o barras.
+    """
+    if not generos:
+        return []
+    if isinstance(generos, str):
+        texto = generos.strip()
+        if texto.startswith('{') and texto.endswith('}'):
+            texto = texto[1:-1]
+        partes: Iterable = re.split(r'[,;/]', texto)
+    else:
+        partes = generos
+
+    resultado = []
+    for parte in partes:
+        if parte is None:
+            continue
+        genero = str(parte).strip().strip('"').strip().lower()
+        if genero and genero not in resultado:
+            resultado.append(genero)
+    return resultado
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """Minúsculas, sin acentos ni puntuación y con los espacios colapsados."""
+    if not texto:
+        return ""
+    texto = unicodedata.normalize("NFKD", texto.replace("∕", "/"))
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w]+", " ", texto).split())
+
+
+# Palabras que marcan una versión de la misma grabación o una colaboración. No se
+# incluyen remix, acoustic ni instrumental: son otro audio (o no tienen letra)
+_VERSION = (
+    r"remaster(?:ed|izad[oa])?|live|en vivo|en directo|version|versión|edit|radio|single|album|"
+    r"mono|stereo|demo|bonus|deluxe|explicit|clean|feat|ft|featuring"
+)
+# Entre paréntesis también "(with X)" / "(con X)"
+_GRUPO_VERSION_RE = re.compile(rf"[(\[][^)\]]*\b(?:{_VERSION}|with|con)\b[^)\]]*[)\]]", re.IGNORECASE)
+_SUFIJO_VERSION_RE = re.compile(rf"\s+[-–—]\s+[^-–—]*\b(?:{_VERSION})\b.*$", re.IGNORECASE)
+_FEAT_RE = re.compile(r"\s+(?:feat\.?|ft\.|featuring)\s.*$", re.IGNORECASE)
+
+
+def clave_titulo(titulo: Optional[str]) -> str:
+    """Título normalizado sin sufijos de versión ni colaboraciones.
+
+    "Song (Remastered 2011)", "Song - Live" y "Song feat. X" dan la misma clave.
+    """
+    if not titulo:
+        return ""
+    texto = _GRUPO_VERSION_RE.sub(" ", titulo)
+    texto = _SUFIJO_VERSION_RE.sub("", texto)
+    texto = _FEAT_RE.sub("", texto)
+    # "Don't" y "Dont" deben coincidir: el apóstrofo no separa palabras
+    texto = re.sub(r"['’`´]", "", texto)
+    return normalizar_texto(texto) or normalizar_texto(titulo)
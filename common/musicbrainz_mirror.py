@@ -0,0 +1,170 @@
+"""Resolución de MBIDs contra un espejo local de MusicBrainz, sin red.
+
+Lee el volcado de MusicBrainz cargado en un Postgres local (p. ej. con
+musicbrainz-docker; tablas `recording` y `artist_credit_name`). A partir de él
+se construye una vez la tabla `mbid_lookup` con artista y título normalizados
+igual que en `common.mbid_resolver`, con un índice B-tree para la coincidencia
+exacta y uno de trigramas (pg_trgm) sobre el título para la aproximada.
+
+Cada consulta resuelve una lista de pares (artista, título) de golpe, así que
+una página de `get_mbid.py` son una o dos consultas en lugar de cientos de
+peticiones a musicbrainz.org.
+
+    python -m common.musicbrainz_mirror   # (re)construye mbid_lookup
+"""
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from common.db import copy_rows, create_db_manager
+from common.mbid_resolver import clave
+
+logger = logging.getLogger('tfm.musicbrainz_mirror')
+
+MIRROR_URL = os.getenv('MUSICBRAINZ_MIRROR_URL')
+MIRROR_SCHEMA = os.getenv('MUSICBRAINZ_MIRROR_SCHEMA', 'musicbrainz')
+# Similitud mínima de trigramas para aceptar un título aproximado (0 desactiva la búsqueda)
+SIMILARITY = float(os.getenv('MUSICBRAINZ_MIRROR_SIMILARITY', '0.6'))
+
+
+def filas_indice(rows: Iterable[Tuple]) -> Iterable[Tuple[str, str, str, int]]:
+    """(artista, título, gid, recording_id) del volcado -> filas normalizadas de mbid_lookup."""
+    for artista, titulo, gid, recording_id in rows:
+        artista_n, titulo_n = clave(artista, titulo)
+        if artista_n and titulo_n:
+            yield artista_n, titulo_n, str(gid), recording_id
+
+
+class MusicBrainzMirror:
+    def __init__(self, db_manager, schema: str = MIRROR_SCHEMA, similarity: float = SIMILARITY):
+        self.db = db_manager
+        self.schema = schema
+        self.similarity = similarity
+        self._trigramas = None
+
+    def construir_indice(self, chunk_size: int = 200000) -> int:
+        """Crea `mbid_lookup` desde las tablas del volcado y la sustituye de forma atómica."""
+        total = 0
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                DROP TABLE IF EXISTS mbid_lookup_nuevo;
+                CREATE TABLE mbid_lookup_nuevo (
+                    artista TEXT NOT NULL,
+                    titulo TEXT NOT NULL,
+                    mbid UUID NOT NULL,
+                    recording_id INTEGER NOT NULL
+                );
+            """)
+            # Se indexa cada artista acreditado, así "A feat. B" se encuentra por A y por B
+            lector = conn.cursor(name='mb_recordings')
+            lector.itersize = chunk_size
+            lector.execute(f"""
+                SELECT acn.name, r.name, r.gid, r.id
+                FROM {self.schema}.recording r
+                JOIN {self.schema}.artist_credit_name acn ON acn.artist_credit = r.artist_credit;
+            """)
+            while True:
+                rows = lector.fetchmany(chunk_size)
+                if not rows:
+                    break
+                copy_rows(cur, "mbid_lookup_nuevo", ("artista", "titulo", "mbid", "recording_id"), filas_indice(rows))
+                total += len(rows)
+                logger.info(f"{total} grabaciones indexadas")
+            lector.close()
+
+            cur.execute("CREATE INDEX ON mbid_lookup_nuevo (artista, titulo, recording_id);")
+            if self._crear_extension_trigramas(cur):
+                cur.execute("CREATE INDEX ON mbid_lookup_nuevo USING GIN (titulo gin_trgm_ops);")
+            cur.execute("""
+                DROP TABLE IF EXISTS mbid_lookup;
+                ALTER TABLE mbid_lookup_nuevo RENAME TO mbid_lookup;
+                ANALYZE mbid_lookup;
+            """)
+            cur.close()
+        return total
+
+    def _crear_extension_trigramas(self, cur) -> bool:
+        cur.execute("SAVEPOINT trgm;")
+        try:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT trgm;")
+            logger.warning(f"pg_trgm no disponible ({e}); solo habrá coincidencia exacta")
+            return False
+        cur.execute("RELEASE SAVEPOINT trgm;")
+        return True
+
+    def _hay_trigramas(self, cur) -> bool:
+        if self._trigramas is None:
+            cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm';")
+            self._trigramas = cur.fetchone() is not None
+        return self._trigramas
+
+    def resolver(self, pares: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """MBID (o None) de cada par (artista, título), en el mismo orden."""
+        claves = [clave(a, t) for a, t in pares]
+        validos = [(i, a, t) for i, (a, t) in enumerate(claves) if a and t]
+        resultado: List[Optional[str]] = [None] * len(pares)
+        if not validos:
+            return resultado
+
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            encontrados = self._exactos(cur, validos)
+            faltan = [v for v in validos if v[0] not in encontrados]
+            if faltan and self.similarity > 0 and self._hay_trigramas(cur):
+                encontrados.update(self._aproximados(cur, faltan))
+            cur.close()
+
+        for i, mbid in encontrados.items():
+            resultado[i] = mbid
+        return resultado
+
+    @staticmethod
+    def _parametros(validos) -> tuple:
+        return [i for i, _, _ in validos], [a for _, a, _ in validos], [t for _, _, t in validos]
+
+    def _exactos(self, cur, validos) -> Dict[int, str]:
+        # Si hay varias grabaciones con el mismo título se queda la más antigua
+        cur.execute("""
+            SELECT DISTINCT ON (k.i) k.i, l.mbid::text
+            FROM unnest(%s::int[], %s::text[], %s::text[]) AS k (i, artista, titulo)
+            JOIN mbid_lookup l ON l.artista = k.artista AND l.titulo = k.titulo
+            ORDER BY k.i, l.recording_id;
+        """, self._parametros(validos))
+        return dict(cur.fetchall())
+
+    def _aproximados(self, cur, validos) -> Dict[int, str]:
+        cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true);", (str(self.similarity),))
+        cur.execute("""
+            SELECT k.i, m.mbid
+            FROM unnest(%s::int[], %s::text[], %s::text[]) AS k (i, artista, titulo)
+            CROSS JOIN LATERAL (
+                SELECT l.mbid::text AS mbid FROM mbid_lookup l
+                WHERE l.artista = k.artista AND l.titulo %% k.titulo
+                ORDER BY similarity(l.titulo, k.titulo) DESC, l.recording_id
+                LIMIT 1
+            ) AS m;
+        """, self._parametros(validos))
+        return dict(cur.fetchall())
+
+
+def crear_mirror() -> MusicBrainzMirror:
+    if not MIRROR_URL:
+        raise RuntimeError("Define MUSICBRAINZ_MIRROR_URL con la conexión al espejo local de MusicBrainz")
+    return MusicBrainzMirror(create_db_manager("musicbrainz_mirror", database_url=MIRROR_URL))
+
+
+def main():
+    from common.logging import setup_logging
+
+    setup_logging()
+    mirror = crear_mirror()
+    total = mirror.construir_indice()
+    logger.info(f"✅ mbid_lookup construida con {total} pares artista-grabación")
+    mirror.db.close()
+
+
+if __name__ == '__main__':
+    main()
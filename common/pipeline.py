@@ -0,0 +1,90 @@
+"""Pipeline de dos etapas: descarga concurrente y procesamiento en un único hilo.
+
+Pensado para los scripts de audio: varios hilos hacen el trabajo de red
+(yt-dlp) y de decodificación, y dejan el resultado en una cola acotada que
+consume el hilo que llama, que es el que tiene cargado el modelo y escribe en
+la base de datos. Así la red y la CPU se solapan sin cargar en memoria más de
+`queue_size` pistas decodificadas a la vez.
+"""
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger('tfm.pipeline')
+
+_FIN = object()
+
+
+@dataclass
+class Resultado:
+    tarea: Any
+    valor: Any = None
+    error: Optional[BaseException] = None
+
+
+def ejecutar_pipeline(tareas: Iterable, preparar: Callable[[Any], Any],
+                      procesar: Callable[[Resultado], None], workers: int = 4, queue_size: int = 8) -> int:
+    """Ejecuta `preparar(tarea)` en `workers` hilos y `procesar(resultado)` en el hilo actual.
+
+    Los errores de `preparar` no detienen el pipeline: llegan a `procesar`
+    como `Resultado.error`. Las tareas se leen del iterable de forma perezosa,
+    así que puede ser un generador que consulte la base de datos.
+
+    Returns:
+        Número de resultados procesados.
+    """
+    pendientes = queue.Queue(maxsize=workers * 2)
+    preparados = queue.Queue(maxsize=queue_size)
+    parar = threading.Event()
+
+    def alimentar():
+        try:
+            for tarea in tareas:
+                if parar.is_set():
+                    break
+                pendientes.put(tarea)
+        except Exception:
+            logger.exception("Error leyendo las tareas del pipeline")
+        finally:
+            for _ in range(workers):
+                pendientes.put(_FIN)
+
+    def trabajar():
+        while True:
+            tarea = pendientes.get()
+            if tarea is _FIN:
+                preparados.put(_FIN)
+                return
+            if parar.is_set():
+                continue
+            try:
+                preparados.put(Resultado(tarea, valor=preparar(tarea)))
+            except Exception as e:
+                preparados.put(Resultado(tarea, error=e))
+
+    hilos = [threading.Thread(target=alimentar, name='pipeline-feeder', daemon=True)]
+    hilos += [threading.Thread(target=trabajar, name=f'pipeline-worker-{i}', daemon=True) for i in range(workers)]
+    for hilo in hilos:
+        hilo.start()
+
+    procesados = 0
+    terminados = 0
+    try:
+        while terminados < workers:
+            resultado = preparados.get()
+            if resultado is _FIN:
+                terminados += 1
+                continue
+            procesar(resultado)
+            procesados += 1
+    finally:
+        # Si `procesar` falla, se vacían las colas para que los hilos no queden bloqueados
+        parar.set()
+        while any(hilo.is_alive() for hilo in hilos):
+            try:
+                preparados.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return procesados
@@ -0,0 +1,188 @@
+"""Volcado del catálogo vectorizado en ficheros `.npy` memory-mappables.
+
+Estructura de un directorio de snapshot:
+
+    ids.npy              int64 (n,), en el orden en que se añadieron las filas
+    ids_order.npy        int64 (n,), argsort de ids.npy (índice id -> fila con searchsorted)
+    lyrics_vector.npy    float32 (n, dim_letra)
+    track_vector.npy     float32 (n, dim_audio)
+    payload.jsonl        una línea JSON por fila, en el mismo orden
+    manifest.json        filas confirmadas, dimensiones y atributos (p. ej. track_pooling)
+
+Los `.npy` se escriben con una cabecera de tamaño fijo, de modo que se pueden
+ampliar añadiendo filas al final y reescribiendo solo la forma. El manifiesto
+se actualiza al final de cada append: si el proceso se corta, lo que sobra
+tras las filas confirmadas se descarta en el siguiente.
+
+Los ids no tienen por qué llegar en orden: una canción puede terminar de
+vectorizarse después de otras con id mayor (reintentos de la cola, dedup), así
+que el snapshot guarda qué ids tiene y no un último id exportado.
+"""
+import json
+import os
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from common.vectors import VECTOR_DTYPE
+
+ID_DTYPE = np.dtype('<i8')
+VECTOR_NAMES = ('lyrics_vector', 'track_vector')
+MANIFEST = 'manifest.json'
+PAYLOAD = 'payload.jsonl'
+ORDER = 'ids_order.npy'
+# Magic (6) + versión (2) + longitud (2) + diccionario con relleno; múltiplo de 64
+HEADER_SIZE = 128
+
+
+def _escribir_cabecera(f, dtype: np.dtype, shape: tuple):
+    cabecera = repr({'descr': dtype.str, 'fortran_order': False, 'shape': shape})
+    longitud = HEADER_SIZE - 10
+    if len(cabecera) + 1 > longitud:
+        raise ValueError(f"Forma {shape} demasiado grande para la cabecera")
+    f.seek(0)
+    f.write(b'\x93NUMPY\x01\x00')
+    f.write(longitud.to_bytes(2, 'little'))
+    f.write(cabecera.ljust(longitud - 1).encode('latin1') + b'\n')
+
+
+def _ampliar_npy(ruta: str, filas_previas: int, datos: np.ndarray):
+    """Añade `datos` tras las `filas_previas` confirmadas y actualiza la forma."""
+    fila_bytes = datos.dtype.itemsize * int(np.prod(datos.shape[1:], dtype=np.int64))
+    with open(ruta, 'r+b' if os.path.exists(ruta) else 'w+b') as f:
+        f.truncate(HEADER_SIZE + filas_previas * fila_bytes)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(datos).tobytes())
+        _escribir_cabecera(f, datos.dtype, (filas_previas + datos.shape[0],) + datos.shape[1:])
+
+
+def _leer_manifest(directorio: str) -> Optional[dict]:
+    ruta = os.path.join(directorio, MANIFEST)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _escribir_manifest(directorio: str, manifest: dict):
+    # Escritura atómica: el manifiesto es lo que confirma las filas añadidas
+    tmp = os.path.join(directorio, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(directorio, MANIFEST))
+
+
+def _leer_ids(directorio: str, filas: int) -> np.ndarray:
+    ruta = os.path.join(directorio, 'ids.npy')
+    if not filas or not os.path.exists(ruta):
+        return np.empty(0, dtype=ID_DTYPE)
+    return np.load(ruta, mmap_mode='r')[:filas]
+
+
+def _leer_orden(directorio: str, ids: np.ndarray) -> np.ndarray:
+    ruta = os.path.join(directorio, ORDER)
+    if os.path.exists(ruta):
+        orden = np.load(ruta, mmap_mode='r')
+        if len(orden) == len(ids):
+            return orden
+    # Snapshot anterior al índice o append interrumpido antes del manifiesto
+    return np.argsort(ids, kind='stable')
+
+
+def ids_exportados(directorio: str) -> np.ndarray:
+    """Ids confirmados en el snapshot, ordenados (vacío si no existe)."""
+    manifest = _leer_manifest(directorio)
+    ids = _leer_ids(directorio, manifest['rows'] if manifest else 0)
+    return np.asarray(ids)[_leer_orden(directorio, ids)]
+
+
+def anadir_filas(directorio: str, ids: List[int], vectores: Dict[str, np.ndarray], payloads: List[dict],
+                 atributos: Optional[Dict[str, str]] = None) -> int:
+    """Añade un lote al snapshot (creándolo si no existe). Devuelve las filas totales.
+
+    Los ids pueden llegar en cualquier orden, pero no repetirse ni estar ya
+    en el snapshot. `atributos` (p. ej. el pooling de los vectores de audio)
+    se guardan en el manifest y tienen que coincidir en todos los lotes.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    manifest = _leer_manifest(directorio) or {'rows': 0, 'dims': {}}
+    guardados = manifest.setdefault('atributos', {})
+    for clave, valor in (atributos or {}).items():
+        if guardados.setdefault(clave, valor) != valor:
+            raise ValueError(f"El snapshot tiene {clave}={guardados[clave]} y el lote {clave}={valor}; "
+                             "expórtalo en un directorio vacío")
+    if not ids:
+        return manifest['rows']
+    nuevos = np.asarray(ids, dtype=ID_DTYPE)
+    filas = manifest['rows']
+    previos = np.asarray(_leer_ids(directorio, filas))
+    if len(np.unique(nuevos)) != len(nuevos) or np.isin(nuevos, previos).any():
+        raise ValueError("Los ids no pueden repetirse ni estar ya en el snapshot")
+
+    _ampliar_npy(os.path.join(directorio, 'ids.npy'), filas, nuevos)
+    for name, matriz in vectores.items():
+        matriz = np.asarray(matriz, dtype=VECTOR_DTYPE)
+        dim = manifest['dims'].setdefault(name, int(matriz.shape[1]))
+        if matriz.shape != (len(ids), dim):
+            raise ValueError(f"{name}: se esperaba forma ({len(ids)}, {dim}) y llegó {matriz.shape}")
+        _ampliar_npy(os.path.join(directorio, f'{name}.npy'), filas, matriz)
+
+    ruta_payload = os.path.join(directorio, PAYLOAD)
+    with open(ruta_payload, 'a+', encoding='utf-8') as f:
+        # Descartar líneas de un append interrumpido
+        f.seek(0)
+        confirmadas = sum(len(linea.encode('utf-8')) for _, linea in zip(range(filas), f))
+        f.truncate(confirmadas)
+        f.seek(confirmadas)
+        for payload in payloads:
+            f.write(json.dumps(payload, ensure_ascii=False, default=str) + '\n')
+
+    todos = np.concatenate([previos, nuevos])
+    tmp = os.path.join(directorio, ORDER + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, np.argsort(todos, kind='stable').astype(ID_DTYPE))
+    os.replace(tmp, os.path.join(directorio, ORDER))
+
+    manifest.pop('last_id', None)
+    manifest['rows'] = filas + len(ids)
+    _escribir_manifest(directorio, manifest)
+    return manifest['rows']
+
+
+@dataclass
+class Snapshot:
+    ids: np.ndarray
+    vectores: Dict[str, np.ndarray]
+    directorio: str
+    orden: np.ndarray
+
+    @cached_property
+    def ids_ordenados(self) -> np.ndarray:
+        return np.asarray(self.ids)[self.orden]
+
+    def fila(self, song_id: int) -> Optional[int]:
+        """Fila de un id (búsqueda binaria sobre ids.npy a través de ids_order.npy)."""
+        ordenados = self.ids_ordenados
+        pos = int(np.searchsorted(ordenados, song_id))
+        return int(self.orden[pos]) if pos < len(ordenados) and ordenados[pos] == song_id else None
+
+    def payloads(self) -> Iterable[dict]:
+        with open(os.path.join(self.directorio, PAYLOAD), encoding='utf-8') as f:
+            for _, linea in zip(range(len(self.ids)), f):
+                yield json.loads(linea)
+
+
+def abrir_snapshot(directorio: str) -> Snapshot:
+    """Abre el snapshot sin copiar los datos (np.load con mmap_mode='r')."""
+    manifest = _leer_manifest(directorio)
+    ids = np.load(os.path.join(directorio, 'ids.npy'), mmap_mode='r')
+    filas = manifest['rows'] if manifest else len(ids)
+    vectores = {}
+    for name in VECTOR_NAMES:
+        ruta = os.path.join(directorio, f'{name}.npy')
+        if os.path.exists(ruta):
+            vectores[name] = np.load(ruta, mmap_mode='r')[:filas]
+    ids = ids[:filas]
+    return Snapshot(ids=ids, vectores=vectores, directorio=directorio, orden=_leer_orden(directorio, ids))
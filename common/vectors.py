@@ -0,0 +1,119 @@
+"""Utilidades para vectores de embeddings: pooling y codificación binaria.
+
+Los vectores se guardan en Postgres como `bytea` con los float32 en bruto, de
+forma que al leerlos basta con `np.frombuffer` (sin parsear JSON ni arrays).
+"""
+import os
+
+import numpy as np
+
+# float32 little-endian, independiente de la arquitectura que escriba o lea
+VECTOR_DTYPE = np.dtype('<f4')
+POOLING_MODES = ('mean', 'mean_std', 'attention')
+
+
+def pool_embeddings(frames, mode: str = 'mean') -> np.ndarray:
+    """Reduce los embeddings por ventana (n_frames, dim) a un único vector float32.
+
+    Modos:
+        mean: media de las ventanas (dim).
+        mean_std: media y desviación típica concatenadas (2 * dim).
+        attention: media ponderada con softmax de la similitud de cada ventana
+            con la media, que resta peso a ventanas atípicas (silencios, intros).
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    if frames.ndim == 1:
+        frames = frames[np.newaxis, :]
+    if frames.shape[0] == 0:
+        raise ValueError("No hay ventanas que agregar")
+
+    media = frames.mean(axis=0)
+    if mode == 'mean':
+        return media
+    if mode == 'mean_std':
+        return np.concatenate([media, frames.std(axis=0)]).astype(np.float32)
+    if mode == 'attention':
+        logits = frames @ media / np.sqrt(frames.shape[1])
+        pesos = np.exp(logits - logits.max())
+        pesos /= pesos.sum()
+        return (pesos[:, np.newaxis] * frames).sum(axis=0).astype(np.float32)
+    raise ValueError(f"Modo de pooling desconocido: {mode} (válidos: {', '.join(POOLING_MODES)})")
+
+
+def to_bytes(vector) -> bytes:
+    """Serializa un vector como float32 little-endian en bruto."""
+    return np.ascontiguousarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def from_bytes(buffer) -> np.ndarray:
+    """Lee un vector float32 desde bytes/memoryview sin copiar."""
+    return np.frombuffer(buffer, dtype=VECTOR_DTYPE)
+
+
+class VectorStorage:
+    """Cómo se guarda un vector en una columna de Postgres.
+
+    - bytea: float32 en bruto; se lee con `np.frombuffer` sin copiar (por defecto).
+    - vector / halfvec: tipos de pgvector (float32 / float16), útiles si se quiere
+      buscar por similitud dentro de Postgres. Se envían como literal de texto,
+      así que no hace falta registrar adaptadores en psycopg2.
+    """
+    KINDS = ('bytea', 'vector', 'halfvec')
+
+    def __init__(self, kind: str = 'bytea'):
+        if kind not in self.KINDS:
+            raise ValueError(f"Almacenamiento de vectores desconocido: {kind} (válidos: {', '.join(self.KINDS)})")
+        self.kind = kind
+
+    def column_type(self) -> str:
+        return 'BYTEA' if self.kind == 'bytea' else self.kind
+
+    def placeholder(self) -> str:
+        """Marcador para usar en INSERT/UPDATE (incluye el cast en pgvector)."""
+        return '%s' if self.kind == 'bytea' else f'%s::{self.kind}'
+
+    def encode(self, vector):
+        if self.kind == 'bytea':
+            from psycopg2 import Binary
+            return Binary(to_bytes(vector))
+        valores = np.asarray(vector, dtype=np.float32)
+        return '[' + ','.join(repr(float(v)) for v in valores) + ']'
+
+    def decode(self, value) -> np.ndarray:
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return from_bytes(value)
+        if isinstance(value, str):
+            # Literal de pgvector: '[0.1,0.2,...]'
+            return np.array(value.strip('[]').split(','), dtype=np.float32)
+        # float8[] / JSON ya parseados por psycopg2
+        return np.asarray(value, dtype=np.float32)
+
+
+def get_track_pooling() -> str:
+    """Pooling de los vectores de audio configurado con TRACK_POOLING (mean por defecto).
+
+    Se guarda con cada vector (`song_vectors.track_pooling`): mean_std duplica
+    la dimensión y los modos no son comparables entre sí, así que los lectores
+    solo usan los vectores del modo configurado.
+    """
+    modo = os.getenv('TRACK_POOLING', 'mean')
+    if modo not in POOLING_MODES:
+        raise ValueError(f"TRACK_POOLING desconocido: {modo} (válidos: {', '.join(POOLING_MODES)})")
+    return modo
+
+
+def filtro_pooling(pooling: str, alias: str = 'v') -> str:
+    """Condición SQL: el vector de audio compacto de `alias` (song_vectors) es del modo `pooling`.
+
+    Las filas anteriores a guardar el modo (track_pooling NULL) son de mean.
+    """
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"Modo de pooling desconocido: {pooling}")
+    return f"COALESCE({alias}.track_pooling, 'mean') = '{pooling}'"
+
+
+def get_vector_storage() -> VectorStorage:
+    """Almacenamiento configurado con VECTOR_STORAGE (bytea, vector o halfvec)."""
+    return VectorStorage(os.getenv('VECTOR_STORAGE', 'bytea'))
@@ -0,0 +1,202 @@
+"""Cola de trabajo en Postgres con reclamación por lease.
+
+Permite ejecutar varias réplicas de un worker sobre las mismas filas:
+
+- `reclamar` toma elementos con `FOR UPDATE SKIP LOCKED`, así dos réplicas
+  nunca reciben el mismo.
+- Cada reclamación tiene un lease; si el worker muere, el elemento vuelve a
+  estar disponible cuando el lease caduca. Mientras sigue vivo, el worker lo
+  renueva con `mantener_leases` desde su bucle, y `completar`/`fallar` solo
+  tocan elementos que sigue teniendo reclamados.
+- Los fallos se reintentan con espera creciente y, tras `max_attempts`, el
+  elemento queda en cuarentena (status 'failed') con su último error.
+- `encolar` reabre los elementos terminados ('done') que vuelven a necesitar
+  trabajo, p. ej. un vector borrado para recalcularlo con otro modelo.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+from common.db import execute_prepared
+
+logger = logging.getLogger('tfm.work_queue')
+
+
+class WorkQueue:
+    """Cola sobre la tabla `work_queue` (la crea la migración 6 de `common.migrations`)."""
+
+    def __init__(self, db_manager, task_type: str, lease_seconds: int = 900, max_attempts: int = 3,
+                 retry_delay_seconds: int = 60, worker_id: Optional[str] = None):
+        self.db = db_manager
+        self.task_type = task_type
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        # Reclamados por este worker y aún sin completar ni fallar
+        self._en_proceso = set()
+        self._lock = threading.Lock()
+        self._ultima_renovacion = time.monotonic()
+
+    def _terminados(self, ids):
+        with self._lock:
+            self._en_proceso.difference_update(ids)
+
+    def encolar(self, ids_sql: str, params: tuple = ()) -> int:
+        """Añade los ids que devuelve la consulta `ids_sql`. Devuelve cuántos se añadieron o reabrieron.
+
+        Los que ya estaban terminados vuelven a 'pending': si la consulta los
+        devuelve es que su trabajo hay que rehacerlo. Los pendientes, en curso o
+        en cuarentena no se tocan.
+        """
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"INSERT INTO work_queue (task_type, item_id) SELECT %s, id FROM ({ids_sql}) AS t "
+                "ON CONFLICT (task_type, item_id) DO UPDATE SET "
+                "status = 'pending', attempts = 0, worker_id = NULL, lease_until = NULL, last_error = NULL, "
+                "updated_at = CURRENT_TIMESTAMP "
+                "WHERE work_queue.status = 'done';",
+                (self.task_type,) + tuple(params)
+            )
+            nuevos = cur.rowcount
+            cur.close()
+        return nuevos
+
+    def reclamar(self, n: int) -> List[int]:
+        """Reclama hasta `n` elementos disponibles (pendientes o con el lease caducado)."""
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            # Leases caducados que ya agotaron sus intentos (el worker murió con ellos): cuarentena
+            cur.execute(
+                """
+                UPDATE work_queue SET status = 'failed', updated_at = CURRENT_TIMESTAMP,
+                    last_error = COALESCE(last_error, 'lease caducado')
+                WHERE task_type = %s AND status = 'claimed'
+                  AND lease_until < CURRENT_TIMESTAMP AND attempts >= %s;
+                """,
+                (self.task_type, self.max_attempts)
+            )
+            if cur.rowcount:
+                logger.warning(f"{cur.rowcount} elementos de {self.task_type} en cuarentena por leases caducados")
+            # Es la consulta que más se repite: se prepara una vez por conexión
+            execute_prepared(
+                cur, "work_queue_reclamar",
+                """
+                UPDATE work_queue AS q SET
+                    status = 'claimed', worker_id = $1, attempts = q.attempts + 1,
+                    lease_until = CURRENT_TIMESTAMP + make_interval(secs => $2),
+                    updated_at = CURRENT_TIMESTAMP
+                FROM (
+                    SELECT item_id FROM work_queue
+                    WHERE task_type = $3 AND status IN ('pending', 'claimed')
+                      AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)
+                    ORDER BY item_id
+                    LIMIT $4
+                    FOR UPDATE SKIP LOCKED
+                ) AS libres
+                WHERE q.task_type = $3 AND q.item_id = libres.item_id
+                RETURNING q.item_id
+                """,
+                (self.worker_id, self.lease_seconds, self.task_type, n)
+            )
+            ids = sorted(row[0] for row in cur.fetchall())
+            cur.close()
+        with self._lock:
+            self._en_proceso.update(ids)
+        return ids
+
+    def renovar(self, ids: List[int]):
+        """Amplía el lease de elementos que siguen en proceso."""
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE work_queue SET lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE task_type = %s AND item_id = ANY(%s) AND status = 'claimed' AND worker_id = %s;
+                """,
+                (self.lease_seconds, self.task_type, list(ids), self.worker_id)
+            )
+            cur.close()
+
+    def mantener_leases(self):
+        """Renueva el lease de lo que este worker tiene en proceso cada tercio de lease.
+
+        Se llama desde el bucle del worker (descargas e inferencias largas
+        pueden durar más que el lease); no hace nada si aún no toca.
+        """
+        with self._lock:
+            if time.monotonic() - self._ultima_renovacion < self.lease_seconds / 3:
+                return
+            self._ultima_renovacion = time.monotonic()
+            ids = list(self._en_proceso)
+        if ids:
+            self.renovar(ids)
+
+    def completar(self, ids: List[int]):
+        """Marca como terminados los elementos que este worker sigue teniendo reclamados.
+
+        Si el lease caducó y otro worker los reclamó, no se tocan.
+        """
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE work_queue SET status = 'done', lease_until = NULL, last_error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE task_type = %s AND item_id = ANY(%s) AND status = 'claimed' AND worker_id = %s;
+                """,
+                (self.task_type, list(ids), self.worker_id)
+            )
+            cur.close()
+        self._terminados(ids)
+
+    def fallar(self, item_id: int, error: str):
+        """Devuelve el elemento a la cola con espera creciente, o lo pone en cuarentena."""
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE work_queue SET
+                    status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s * power(2, attempts - 1)),
+                    last_error = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE task_type = %s AND item_id = %s AND status = 'claimed' AND worker_id = %s
+                RETURNING status;
+                """,
+                (self.max_attempts, self.retry_delay_seconds, str(error)[:2000], self.task_type, item_id,
+                 self.worker_id)
+            )
+            row = cur.fetchone()
+            cur.close()
+        self._terminados([item_id])
+        if row and row[0] == 'failed':
+            logger.warning(f"{self.task_type} {item_id} en cuarentena tras {self.max_attempts} intentos: {error}")
+
+    def resumen(self) -> Dict[str, int]:
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT status, COUNT(*) FROM work_queue WHERE task_type = %s GROUP BY status;",
+                        (self.task_type,))
+            resumen = dict(cur.fetchall())
+            cur.close()
+        return resumen
+
+    def reintentar_cuarentena(self) -> int:
+        """Vuelve a poner en cola los elementos en cuarentena (p. ej. tras corregir un bug)."""
+        with self.db.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                UPDATE work_queue SET status = 'pending', attempts = 0, lease_until = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE task_type = %s AND status = 'failed';
+                """,
+                (self.task_type,)
+            )
+            n = cur.rowcount
+            cur.close()
+        return n
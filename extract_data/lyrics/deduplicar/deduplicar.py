@@ -0,0 +1,166 @@
+"""Agrupa las canciones duplicadas de `canciones` y `lyrics_database`.
+
+1. Registra en `canciones_canonicas` el artista y la clave de título
+   normalizados de cada fila de las dos tablas.
+2. Empareja las claves casi iguales de un mismo artista: con pg_trgm, una
+   consulta con el operador `%` que usa el índice GIN de la migración 8; sin
+   pg_trgm, `common.dedup.pares_similares` por artista.
+3. Recalcula en una sola sentencia el `grupo_id`, común a las dos tablas, y la
+   `canonica_id` de cada fila dentro de su tabla.
+
+Las etapas de letras, audio y vectores solo procesan las canónicas. Se puede
+relanzar: recalcula los grupos con los títulos actuales.
+"""
+from itertools import groupby
+
+from common.logging import setup_logging
+from common.db import bulk_insert, copy_rows, create_db_manager
+from common.dedup import UMBRAL_TRIGRAMAS, mismos_numeros, pares_similares, raices
+from common.migrations import aplicar_migraciones
+from common.music_metadata import clave_titulo, normalizar_texto
+
+logger = setup_logging()
+db_manager = create_db_manager("deduplicar", max_conn=2)
+
+FUENTES = {
+    "canciones": "SELECT id, artista, cancion FROM canciones",
+    "lyrics_database": "SELECT id, artista, cancion FROM lyrics_database",
+}
+WRITE_BATCH = 5000
+
+# Para cada clave, las claves posteriores del mismo artista con similitud >= umbral.
+# El LATERAL deja que cada búsqueda use el índice GIN de trigramas
+PARES_TRGM_SQL = """
+    SELECT a.artista_norm, a.titulo_norm, b.titulo_norm
+    FROM (SELECT DISTINCT artista_norm, titulo_norm FROM canciones_canonicas) a
+    CROSS JOIN LATERAL (
+        SELECT DISTINCT o.titulo_norm FROM canciones_canonicas o
+        WHERE o.titulo_norm % a.titulo_norm
+          AND o.artista_norm = a.artista_norm
+          AND o.titulo_norm > a.titulo_norm
+    ) b;
+"""
+
+ACTUALIZAR_GRUPOS_SQL = """
+    WITH g AS (
+        SELECT c.fuente, c.song_id,
+               min(c.id) OVER grupo AS grupo_id,
+               min(c.song_id) OVER (PARTITION BY c.artista_norm, COALESCE(r.raiz, c.titulo_norm), c.fuente)
+                   AS canonica_id
+        FROM canciones_canonicas c
+        LEFT JOIN dedup_raices r ON r.artista_norm = c.artista_norm AND r.titulo_norm = c.titulo_norm
+        WINDOW grupo AS (PARTITION BY c.artista_norm, COALESCE(r.raiz, c.titulo_norm))
+    )
+    UPDATE canciones_canonicas c SET grupo_id = g.grupo_id, canonica_id = g.canonica_id
+    FROM g
+    WHERE c.fuente = g.fuente AND c.song_id = g.song_id
+      AND (c.grupo_id IS DISTINCT FROM g.grupo_id OR c.canonica_id <> g.canonica_id);
+"""
+
+
+def tabla_existe(nombre: str) -> bool:
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (nombre,))
+        existe = cur.fetchone()[0]
+        cur.close()
+    return existe
+
+
+def registrar(fuente: str) -> int:
+    """Guarda las claves normalizadas de todas las filas de la fuente. Devuelve cuántas hay."""
+    total = 0
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        lector = conn.cursor(name=f"dedup_{fuente}")
+        lector.itersize = WRITE_BATCH
+        lector.execute(FUENTES[fuente])
+        while True:
+            rows = lector.fetchmany(WRITE_BATCH)
+            if not rows:
+                break
+            # Las filas nuevas empiezan siendo su propia canónica; el grupo se calcula después
+            bulk_insert(cur, """
+                INSERT INTO canciones_canonicas (fuente, song_id, artista_norm, titulo_norm, canonica_id)
+                VALUES %s
+                ON CONFLICT (fuente, song_id) DO UPDATE SET
+                    artista_norm = EXCLUDED.artista_norm,
+                    titulo_norm = EXCLUDED.titulo_norm;
+            """, [(fuente, song_id, normalizar_texto(artista), clave_titulo(titulo), song_id)
+                  for song_id, artista, titulo in rows], page_size=WRITE_BATCH)
+            total += len(rows)
+        lector.close()
+        # Canciones borradas de la tabla de origen
+        cur.execute(f"""
+            DELETE FROM canciones_canonicas c
+            WHERE c.fuente = %s AND NOT EXISTS (SELECT 1 FROM {fuente} t WHERE t.id = c.song_id);
+        """, (fuente,))
+        cur.close()
+    return total
+
+
+def hay_trigramas(cur) -> bool:
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm';")
+    return cur.fetchone() is not None
+
+
+def pares_con_trigramas(cur, umbral: float = UMBRAL_TRIGRAMAS):
+    cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true);", (str(umbral),))
+    cur.execute(PARES_TRGM_SQL)
+    return [((artista, a), (artista, b)) for artista, a, b in cur.fetchall() if mismos_numeros(a, b)]
+
+
+def pares_en_memoria(cur, umbral: float = UMBRAL_TRIGRAMAS):
+    cur.execute("SELECT DISTINCT artista_norm, titulo_norm FROM canciones_canonicas ORDER BY 1, 2;")
+    pares = []
+    for artista, filas in groupby(cur.fetchall(), key=lambda r: r[0]):
+        pares.extend(((artista, a), (artista, b)) for a, b in pares_similares((t for _, t in filas), umbral))
+    return pares
+
+
+def actualizar_grupos(cur, representantes) -> int:
+    """Aplica {(artista, clave): (artista, clave representante)}. Devuelve las filas que cambiaron."""
+    cur.execute("""
+        CREATE TEMP TABLE dedup_raices (artista_norm TEXT, titulo_norm TEXT, raiz TEXT) ON COMMIT DROP;
+    """)
+    copy_rows(cur, "dedup_raices", ("artista_norm", "titulo_norm", "raiz"),
+              ((artista, titulo, raiz[1]) for (artista, titulo), raiz in representantes.items()))
+    cur.execute("ANALYZE dedup_raices;")
+    cur.execute(ACTUALIZAR_GRUPOS_SQL)
+    return cur.rowcount
+
+
+def resumen(cur):
+    cur.execute("""
+        SELECT fuente, count(*), count(*) FILTER (WHERE canonica_id <> song_id)
+        FROM canciones_canonicas GROUP BY fuente ORDER BY fuente;
+    """)
+    return cur.fetchall()
+
+
+def main():
+    aplicar_migraciones(db_manager)
+    for fuente in FUENTES:
+        if not tabla_existe(fuente):
+            logger.info(f"La tabla {fuente} no existe todavía; se omite")
+            continue
+        logger.info(f"{fuente}: {registrar(fuente)} canciones registradas")
+
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        if hay_trigramas(cur):
+            pares = pares_con_trigramas(cur)
+        else:
+            logger.warning("pg_trgm no disponible; las erratas se emparejan en memoria")
+            pares = pares_en_memoria(cur)
+        logger.info(f"{len(pares)} pares de títulos casi iguales")
+        cambios = actualizar_grupos(cur, raices(pares))
+        logger.info(f"{cambios} canciones cambian de grupo")
+        for fuente, total, duplicadas in resumen(cur):
+            logger.info(f"✅ {fuente}: {duplicadas} de {total} canciones son duplicado de otra")
+        cur.close()
+    db_manager.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,29 @@
 import time
-import subprocess
-import psycopg2
-import os
-from psycopg2 import sql
 from obtener_artistas.obtener_artistas import obtener_artistas_musicbrainz
 from obtener_canciones.obtener_canciones import obtener_canciones
 from obtener_letras.obtener_letras import obtener_datos_y_guardar
 
-# Cargar variables de entorno
-POSTGRES_USER = os.getenv("POSTGRES_USER")
-POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
-POSTGRES_DB = 'artistas'
+from common.db import create_db_manager
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@db:5432/{POSTGRES_DB}"
-# Conexión a la base de datos
-def conectar_db():
+# Conexión desde POSTGRES_* (common.config), como el resto de etapas
+db_manager = create_db_manager("orquestador", max_conn=1)
+
+def contar(tabla):
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        with db_manager.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {tabla}")
+            return cursor.fetchone()[0]
     except Exception as e:
         print(f"Error de conexión: {e}")
-        return None
+        return 0
 
 # Comprobar si hay suficientes artistas
 def hay_artistas_suficientes():
-    conn = conectar_db()
-    if conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM artistas")
-        count = cursor.fetchone()[0]
-        cursor.close()
-        conn.close()
-        return count >= 100
-    return False
+    return contar("artistas") >= 100
 
 # Comprobar si hay suficientes canciones
 def hay_canciones_suficientes():
-    conn = conectar_db()
-    if conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM canciones")
-        count = cursor.fetchone()[0]
-        cursor.close()
-        conn.close()
-        return count >= 10
-    return False
+    return contar("canciones") >= 10
 
 # Orquestación
 def orquestar():
@@ -1,9 +1,8 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from common.config import config
 from common.logging import setup_logging
-from common.db import DatabaseManager
+from common.db import AsyncDatabaseManager, create_db_manager
 import asyncio
 import random
 import time
@@ -14,7 +13,10 @@ from extract_data.lyrics.obtener_letras.rasca_genio import obtener_letra as scra
 logger = setup_logging()
 app = FastAPI(title="Lyrics MCP")
 
-db_manager = DatabaseManager(config.database_url, min_conn=1, max_conn=5)
+# Los endpoints síncronos corren en el threadpool de FastAPI y comparten el
+# pool (thread-safe); los asíncronos usan async_db para no bloquear el bucle
+db_manager = create_db_manager("mcp", max_conn=5)
+async_db = AsyncDatabaseManager(db_manager)
 
 
 class FetchRequest(BaseModel):
@@ -119,6 +121,16 @@ def fetch_lyrics_internet(artista: str, cancion: str):
     return None, None, None
 
 
+@app.get("/health")
+async def health():
+    """Comprueba la conexión a Postgres y devuelve las métricas del pool."""
+    try:
+        await async_db.fetchall("SELECT 1")
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"database unavailable: {e}")
+    return {"status": "ok", "db_pool": async_db.stats()}
+
+
 @app.post("/fetch_and_save")
 def fetch_and_save(req: FetchRequest):
     letra, song_id, source = fetch_lyrics_internet(req.artista, req.cancion)
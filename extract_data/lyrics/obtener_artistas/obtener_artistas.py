@@ -3,14 +3,14 @@ import time
 import os
 from datetime import datetime
 
-from common.config import config
 from common.logging import setup_logging
-from common.db import DatabaseManager
+from common.db import create_db_manager
+from common.migrations import aplicar_migraciones
 from common.progress import ProgressManager, ProgressType
 from common.retry import retry
 
 logger = setup_logging()
-db_manager = DatabaseManager(config.database_url, min_conn=1, max_conn=5)
+db_manager = create_db_manager("obtener_artistas", max_conn=5)
 progress_manager = ProgressManager(db_manager)
 
 QUERY_BUSQUEDA = os.getenv('QUERY_BUSQUEDA', 'a')
@@ -74,6 +74,7 @@ def buscar_artistas_musicbrainz(query: str, offset: int, limit: int = 100):
 
 
 def obtener_artistas_musicbrainz():
+    aplicar_migraciones(db_manager)
     crear_tabla_artistas()
     offset = obtener_offset()
     limit = 100
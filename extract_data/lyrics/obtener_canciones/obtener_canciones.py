@@ -4,17 +4,27 @@ import time
 import random
 from datetime import datetime
 
-from common.config import config
 from common.logging import setup_logging
-from common.db import DatabaseManager
+from common.db import create_db_manager, execute_prepared
+from common.dedup import IndiceCanonico
+from common.migrations import aplicar_migraciones
 from common.progress import ProgressManager, ProgressType
 from common.retry import retry
 
 # Inicializaciones centrales
 logger = setup_logging()
 API_KEY_GENIUS = os.getenv("API_KEY_GENIUS")
-db_manager = DatabaseManager(config.database_url, min_conn=1, max_conn=5)
+db_manager = create_db_manager("obtener_canciones", max_conn=5)
 progress_manager = ProgressManager(db_manager)
+_indice_canonico = None
+
+
+def get_indice_canonico():
+    """Índice de canciones canónicas; se crea en el primer uso, no al importar el módulo."""
+    global _indice_canonico
+    if _indice_canonico is None:
+        _indice_canonico = IndiceCanonico(db_manager)
+    return _indice_canonico
 
 
 # ==========================
@@ -41,22 +51,26 @@ def crear_tabla_canciones():
         """)
         cursor.close()
 
-def cancion_existe(id_artista, cancion):
-    """Verifica si una canción ya está guardada para evitar duplicados."""
+def cancion_existe(id_artista, artista, cancion):
+    """Verifica si la canción, o una variante suya ("Song - Live"), ya está guardada."""
     with db_manager.get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM canciones WHERE id_artista = %s AND cancion = %s", (id_artista, cancion))
+        execute_prepared(cursor, "canciones_existe",
+                         "SELECT 1 FROM canciones WHERE id_artista = $1 AND cancion = $2", (id_artista, cancion))
         existe = cursor.fetchone() is not None
         cursor.close()
-        return existe
+    return existe or get_indice_canonico().buscar("canciones", artista, cancion) is not None
 
 def guardar_cancion(id_artista, artista, cancion):
-    """Guarda una canción en la base de datos usando el pool."""
+    """Guarda una canción en la base de datos usando el pool y la registra como canónica."""
     fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     with db_manager.get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO canciones (id_artista, artista, cancion, fecha_guardado) VALUES (%s, %s, %s, %s) ON CONFLICT (id_artista, cancion) DO NOTHING;", (id_artista, artista, cancion, fecha_actual))
+        cursor.execute("INSERT INTO canciones (id_artista, artista, cancion, fecha_guardado) VALUES (%s, %s, %s, %s) ON CONFLICT (id_artista, cancion) DO NOTHING RETURNING id;", (id_artista, artista, cancion, fecha_actual))
+        row = cursor.fetchone()
         cursor.close()
+    if row:
+        get_indice_canonico().registrar("canciones", [(row[0], artista, cancion, row[0])])
 
 # ==========================
 # Funciones de offset
@@ -115,6 +129,7 @@ def buscar_canciones_de_artista(artista):
 # ==========================
 
 def obtener_canciones():
+    aplicar_migraciones(db_manager)
     crear_tabla_canciones()
     """Obtiene todas las canciones de los artistas en la base de datos.
     Utiliza pool, logging y progress manager.
@@ -143,7 +158,7 @@ def obtener_canciones():
             continue
 
         for j, cancion in enumerate(canciones, start=0):
-            if cancion_existe(id_artista, cancion):
+            if cancion_existe(id_artista, nombre_artista, cancion):
                 logger.debug(f"✅ {cancion} ya está en la base de datos. Saltando...")
                 continue
 
@@ -2,52 +2,79 @@ import os
 import time
 import requests
 from datetime import datetime
+from itertools import groupby
 
-from common.config import config
 from common.logging import setup_logging
-from common.db import DatabaseManager
+from common.db import create_db_manager
+from common.dedup import filtro_canonicas, filtro_no_catalogadas
+from common.mbid_resolver import MbidResolver
+from common.migrations import aplicar_migraciones
 from common.progress import ProgressManager, ProgressType
-from common.retry import retry
-import requests
 
 # Usamos un MCP para obtener y guardar letras en lugar de Genius
 MCP_URL = os.getenv('MCP_LETTERS_URL', 'http://localhost:8000/fetch_and_save')
 
 logger = setup_logging()
-db_manager = DatabaseManager(config.database_url, min_conn=1, max_conn=5)
-progress_manager = ProgressManager(db_manager)
+db_manager = create_db_manager("obtener_letras", max_conn=5)
+_progress_manager = None
+_mbid_resolver = None
+
+
+def get_progress_manager():
+    """Se crea en el primer uso, como el resolvedor de MBIDs."""
+    global _progress_manager
+    if _progress_manager is None:
+        _progress_manager = ProgressManager(db_manager)
+    return _progress_manager
+
+
+def get_mbid_resolver():
+    """Resolvedor compartido; se crea en el primer uso, no al importar el módulo."""
+    global _mbid_resolver
+    if _mbid_resolver is None:
+        _mbid_resolver = MbidResolver(db_manager,
+                                      negative_ttl_days=int(os.getenv('MBID_NEGATIVE_TTL_DAYS', '30')),
+                                      max_fallback=int(os.getenv('MUSICBRAINZ_MAX_FALLBACK', '2')))
+    return _mbid_resolver
 
 
-@retry(max_attempts=4, initial_delay=1, backoff=2, exceptions=(Exception,))
 def obtener_mbid_en_musicbrainz(artista, cancion):
-    search_url = f'https://musicbrainz.org/ws/2/recording/'
-    params = {'query': f'artist:{artista} recording:{cancion}', 'fmt': 'json'}
-    r = requests.get(search_url, params=params, timeout=10)
-    r.raise_for_status()
-    data = r.json()
-    if 'recordings' in data and data['recordings']:
-        return data['recordings'][0].get('id')
-    return None
+    return get_mbid_resolver().resolver(artista, cancion)
+
+
+def obtener_mbids_de_artista(artista, canciones):
+    """MBIDs de todas las canciones de un artista (varias por petición a MusicBrainz)."""
+    try:
+        return get_mbid_resolver().resolver_lote(artista, canciones)
+    except Exception:
+        logger.exception(f"Error obteniendo MBIDs de {artista}")
+        return {}
 
 
 def obtener_artistas_y_canciones():
     with db_manager.get_connection() as conn:
         cur = conn.cursor()
-        cur.execute('SELECT id_artista, artista, cancion FROM canciones ORDER BY id_artista, id')
+        # Las variantes de una misma canción ("Song - Live") se consultan una sola vez,
+        # y las que ya están en lyrics_database no se consultan
+        cur.execute(f"""
+            SELECT c.id_artista, c.artista, c.cancion FROM canciones c
+            WHERE {filtro_canonicas('canciones', 'c.id')} AND {filtro_no_catalogadas('c.id')}
+            ORDER BY c.id_artista, c.id
+        """)
         rows = cur.fetchall()
         cur.close()
         return rows
 
 
 def obtener_progreso():
-    p = progress_manager.get_progress(ProgressType.LETRAS)
+    p = get_progress_manager().get_progress(ProgressType.LETRAS)
     # Devolver tupla (id_artista, id_cancion) si existe
     return (p.get('last_processed_id'), 0) if p.get('last_processed_id') else None
 
 
 def guardar_progreso(id_artista, id_cancion):
     # Guardamos last_processed_id como id_artista (simplificado)
-    progress_manager.update_progress(ProgressType.LETRAS, id_artista, last_processed_id=id_artista)
+    get_progress_manager().update_progress(ProgressType.LETRAS, id_artista, last_processed_id=id_artista)
 
 
 def guardar_en_db(datos):
@@ -73,6 +100,7 @@ def guardar_en_db(datos):
 
 
 def obtener_datos_y_guardar():
+    aplicar_migraciones(db_manager)
     progreso = obtener_progreso()
     last_artista_id = progreso[0] if progreso else None
 
@@ -84,36 +112,33 @@ def obtener_datos_y_guardar():
     artistas_canciones = obtener_artistas_y_canciones()
     datos = []
 
-    for artista_id, artista, cancion in artistas_canciones:
+    for (artista_id, artista), filas in groupby(artistas_canciones, key=lambda r: (r[0], r[1])):
         if last_artista_id and artista_id < last_artista_id:
             continue
-
-        logger.info(f'Buscando via MCP: {artista} - {cancion}')
-        letra = None
-        song_id = None
-        try:
-            resp = requests.post(MCP_URL, json={
-                'id_artista': artista_id,
-                'id_cancion': cancion,  # passing name in id field if id unknown to MCP
-                'artista': artista,
-                'cancion': cancion
-            }, timeout=15)
-            if resp.ok:
-                payload = resp.json()
-                letra = payload.get('letra')
-                song_id = payload.get('id_cancion')
-            else:
-                logger.warning(f"MCP no encontró letra: {resp.status_code} {resp.text}")
-        except Exception:
-            logger.exception(f"Error calling MCP for {artista} - {cancion}")
-
-        try:
-            mbid = obtener_mbid_en_musicbrainz(artista, cancion)
-        except Exception:
-            logger.exception(f"Error obteniendo MBID para {artista} - {cancion}")
-            mbid = None
-
-        datos.append([artista_id, artista, cancion, song_id, mbid, letra, datetime.now()])
+        canciones = [cancion for _, _, cancion in filas]
+        mbids = obtener_mbids_de_artista(artista, canciones)
+
+        for cancion in canciones:
+            logger.info(f'Buscando via MCP: {artista} - {cancion}')
+            letra = None
+            song_id = None
+            try:
+                resp = requests.post(MCP_URL, json={
+                    'id_artista': artista_id,
+                    'id_cancion': cancion,  # passing name in id field if id unknown to MCP
+                    'artista': artista,
+                    'cancion': cancion
+                }, timeout=15)
+                if resp.ok:
+                    payload = resp.json()
+                    letra = payload.get('letra')
+                    song_id = payload.get('id_cancion')
+                else:
+                    logger.warning(f"MCP no encontró letra: {resp.status_code} {resp.text}")
+            except Exception:
+                logger.exception(f"Error calling MCP for {artista} - {cancion}")
+
+            datos.append([artista_id, artista, cancion, song_id, mbids.get(cancion), letra, datetime.now()])
 
         if datos:
             guardar_en_db(datos)
@@ -7,14 +7,15 @@ from bs4 import BeautifulSoup
 from datetime import datetime
 
 from common.retry import retry
-from common.config import config
 from common.logging import setup_logging
-from common.db import DatabaseManager
+from common.db import create_db_manager, execute_prepared
+from common.dedup import filtro_canonicas, filtro_no_catalogadas
+from common.migrations import aplicar_migraciones
 from common.progress import ProgressManager, ProgressType
 from .genius import buscar_cancion
 
 logger = setup_logging()
-db_manager = DatabaseManager(config.database_url, min_conn=1, max_conn=5)
+db_manager = create_db_manager("rasca_genio", max_conn=5)
 progress_manager = ProgressManager(db_manager)
 
 
@@ -38,7 +39,7 @@ def crear_tabla_letras():
 def cancion_existe(id_cancion):
     with db_manager.get_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT 1 FROM letras WHERE id_cancion = %s", (id_cancion,))
+        execute_prepared(cur, "letras_existe", "SELECT 1 FROM letras WHERE id_cancion = $1", (id_cancion,))
         existe = cur.fetchone() is not None
         cur.close()
         return existe
@@ -94,10 +95,14 @@ def obtener_letra(song_url):
 
 
 def obtener_letras():
+    aplicar_migraciones(db_manager)
     crear_tabla_letras()
     with db_manager.get_connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT ID_ARTISTA, ID, artista, cancion FROM canciones")
+        # Una vez por canción canónica, y no las que ya están en lyrics_database
+        cur.execute(f"SELECT c.id_artista, c.id, c.artista, c.cancion FROM canciones c "
+                    f"WHERE {filtro_canonicas('canciones', 'c.id')} AND {filtro_no_catalogadas('c.id')} "
+                    f"ORDER BY c.id")
         canciones = cur.fetchall()
         cur.close()
 
@@ -1,49 +1,181 @@
+"""Extracción de descriptores con Essentia para todo el catálogo.
+
+Etapa batch: reclama canciones pendientes de `lyrics_database` (cola con
+lease, varias réplicas posibles), las analiza con `MusicExtractor` en un pool
+de procesos (un extractor por proceso) y escribe los descriptores por lotes en
+`song_essentia`. El audio sale de la caché compartida con el vectorizador de
+pistas cuando ya se descargó.
+
+BPM y tonalidad también rellenan `song_tags` si AcousticBrainz no los tenía,
+para que los filtros de la búsqueda cubran todo el catálogo.
+"""
 import os
-import subprocess
-import essentia.standard as es
-from essentia.standard import YamlOutput
-import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-os.environ['ESSENTIA_MODEL_PATH'] = '/home/perseis/master_big_data/tfm_similarity_canciones/vector_search/essentia-models'
-
-def download_audio(youtube_url, output_name="audio.mp3"):
-    print("⬇️  Descargando audio...")
-    command = [
-        "yt-dlp", "-x", "--audio-format", "mp3",
-        "-o", output_name,
-        youtube_url
-    ]
-    subprocess.run(command, check=True)
-    return output_name
-
-def analyze_audio(file_path):
-    # Cargar el audio desde archivo
-    #loader = es.MonoLoader(filename=file_path)
-    #audio = loader()
-    print("🎧 Analizando audio...")
-    #features= es.Extractor()(audio)
-    extractor=es.MusicExtractor(lowlevelStats=['mean', 'stdev'], rhythmStats=['mean'], tonalStats=['mean'])
-    features, _ = extractor(file_path)
-    print(_)
-
-    fea=YamlOutput(filename = 'mfcc.sig', format='json')(features)
-    print(fea)
-
-    print("\n🎵 Metadatos extraídos:")
-    print("  - BPM:", features['rhythm.bpm'])
-    print("  - Tono (Key):", features['tonal.chords_key'])
-    print("  - Duracion:", features['metadata.audio_properties.analysis.length'])
-    print("  - Danceability:", features['rhythm.danceability'])
+from common.audio import AUDIO_TMP_DIR, decodificar_wav
+from common.audio_cache import crear_cache, obtener_audio
+from common.logging import setup_logging
+from common.db import create_db_manager
+from common.dedup import filtro_canonicas
+from common.feature_store import FAMILIAS, RELLENAR, guardar as guardar_features
+from common.migrations import aplicar_migraciones
+from common.music_metadata import a_camelot
+from common.work_queue import WorkQueue
+
+logger = setup_logging()
+db_manager = create_db_manager("essentia", max_conn=2)
+
+TASK_TYPE = "essentia_features"
+WORKERS = int(os.getenv("ESSENTIA_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+WRITE_BATCH = int(os.getenv("ESSENTIA_WRITE_BATCH", "50"))
+MAX_ATTEMPTS = int(os.getenv("ESSENTIA_MAX_ATTEMPTS", "3"))
+LEASE_SECONDS = int(os.getenv("ESSENTIA_LEASE_SECONDS", "1800"))
+COOKIES_PATH = "cookies.txt"
+
+# Estado de cada proceso del pool
+_extractor = None
+_cache = None
+
+
+def _iniciar_worker():
+    global _extractor, _cache
+    import essentia.standard as es
+
+    _extractor = es.MusicExtractor(lowlevelStats=['mean', 'stdev'], rhythmStats=['mean'], tonalStats=['mean'])
+    _cache = crear_cache()
+
+
+def _valor(features, nombre, default=None):
+    return features[nombre] if nombre in features.descriptorNames() else default
+
+
+def descriptores(features) -> dict:
+    """Selecciona los descriptores que se guardan del Pool de MusicExtractor."""
+    mfcc = _valor(features, 'lowlevel.mfcc.mean')
+    return {
+        "ess_bpm": float(features['rhythm.bpm']),
+        "ess_key": _valor(features, 'tonal.key_edma.key', _valor(features, 'tonal.chords_key')),
+        "ess_scale": _valor(features, 'tonal.key_edma.scale', _valor(features, 'tonal.chords_scale')),
+        "ess_key_strength": _valor(features, 'tonal.key_edma.strength'),
+        "ess_danceability": _valor(features, 'rhythm.danceability'),
+        "ess_duration": _valor(features, 'metadata.audio_properties.length',
+                               _valor(features, 'metadata.audio_properties.analysis.length')),
+        "ess_loudness": _valor(features, 'lowlevel.average_loudness'),
+        "ess_dynamic_complexity": _valor(features, 'lowlevel.dynamic_complexity'),
+        "ess_spectral_centroid": _valor(features, 'lowlevel.spectral_centroid.mean'),
+        "ess_mfcc_mean": [float(x) for x in mfcc] if mfcc is not None else None,
+    }
 
-if __name__ == "__main__":
-    url = input("🔗 Introduce URL de YouTube: ").strip()
-    filename = "temp_audio.mp3"
 
+def analizar(cancion):
+    """Corre en un proceso del pool: obtiene el audio, lo decodifica a WAV en tmpfs y lo analiza."""
+    id_, artist, title, link = cancion
+    query = f"ytsearch1:{artist.replace('∕', '/')} {title.replace('∕', '/')}"
+    stream = obtener_audio(query, link, COOKIES_PATH, _cache)
+    ruta = os.path.join(AUDIO_TMP_DIR, f"essentia_{os.getpid()}_{id_}.wav")
     try:
-        download_audio(url, filename)
-        analyze_audio(filename)
-    except Exception as e:
-        print("❌ Error:", e)
+        # MusicExtractor solo lee ficheros: se decodifica a WAV sin recodificar a mp3
+        decodificar_wav(stream, ruta)
+        features, _ = _extractor(ruta)
+        return descriptores(features), stream.webpage_url
     finally:
-        if os.path.exists(filename):
-            os.remove(filename)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+
+def leer_canciones(ids):
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT l.id, l.artista, l.cancion, s.link
+            FROM lyrics_database l
+            LEFT JOIN song_links s ON s.song_id = l.id
+            WHERE l.id = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM song_essentia e WHERE e.song_id = l.id)
+            ORDER BY l.id;
+        """, (ids,))
+        canciones = cur.fetchall()
+        cur.close()
+    return canciones
+
+
+def guardar(resultados):
+    """Escribe un lote de descriptores en una transacción, un upsert por familia."""
+    if not resultados:
+        return
+    columnas = FAMILIAS["song_essentia"]
+    tags = []
+    for id_, d, _ in resultados:
+        key = f"{d['ess_key']} {d['ess_scale']}" if d['ess_key'] and d['ess_scale'] else None
+        tags.append((id_, d['ess_bpm'], key, a_camelot(key)))
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        guardar_features(cur, "song_essentia", columnas,
+                         [(id_, *(d[c] for c in columnas)) for id_, d, _ in resultados])
+        guardar_features(cur, "song_tags", ("bpm", "initialkey", "camelot"), tags,
+                         politicas={c: RELLENAR for c in ("bpm", "initialkey", "camelot")})
+        guardar_features(cur, "song_links", ("link",), [(id_, link) for id_, _, link in resultados],
+                         politicas={"link": RELLENAR})
+        cur.close()
+
+
+def main():
+    aplicar_migraciones(db_manager)
+    cola = WorkQueue(db_manager, TASK_TYPE, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS)
+    nuevas = cola.encolar(
+        "SELECT id FROM lyrics_database l WHERE NOT EXISTS (SELECT 1 FROM song_essentia e WHERE e.song_id = l.id) "
+        f"AND {filtro_canonicas('lyrics_database', 'l.id')}"
+    )
+    logger.info(f"{nuevas} canciones nuevas en la cola de Essentia; {WORKERS} procesos")
+
+    resultados = []
+    analizadas = 0
+
+    def volcar():
+        nonlocal analizadas
+        if not resultados:
+            return
+        guardar(resultados)
+        cola.completar([id_ for id_, _, _ in resultados])
+        analizadas += len(resultados)
+        logger.info(f"✅ {analizadas} canciones analizadas")
+        resultados.clear()
+
+    def recoger(done):
+        cola.mantener_leases()
+        for future in done:
+            id_ = en_vuelo.pop(future)
+            try:
+                datos, link = future.result()
+                resultados.append((id_, datos, link))
+            except Exception as e:
+                logger.error(f"❌ Error analizando la canción {id_}: {e}")
+                cola.fallar(id_, str(e))
+        if len(resultados) >= WRITE_BATCH:
+            volcar()
+
+    en_vuelo = {}
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=_iniciar_worker) as executor:
+        while True:
+            cola.mantener_leases()
+            ids = cola.reclamar(WORKERS * 2)
+            if not ids:
+                break
+            canciones = leer_canciones(ids)
+            ya_hechas = set(ids) - {c[0] for c in canciones}
+            if ya_hechas:
+                cola.completar(list(ya_hechas))
+            for cancion in canciones:
+                # Como mucho dos canciones por proceso en vuelo
+                if len(en_vuelo) >= WORKERS * 2:
+                    done, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    recoger(done)
+                en_vuelo[executor.submit(analizar, cancion)] = cancion[0]
+        done, _ = wait(en_vuelo)
+        recoger(done)
+    volcar()
+    logger.info(f"Análisis con Essentia finalizado. Estado: {cola.resumen()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Importa a MongoDB los volcados de AcousticBrainz en lugar de consultar la API.
+
+Los volcados (`acousticbrainz-highlevel-json-*.tar.zst`,
+`acousticbrainz-lowlevel-json-*.tar.zst`) se leen en streaming, sin
+descomprimirlos a disco. Cada miembro se llama `<mbid>-<n>.json`: el MBID se
+filtra con el nombre contra un set en memoria con los MBIDs de
+`lyrics_database`, así que solo se parsea el JSON de las grabaciones del
+catálogo. Como la API, se usa el primer envío (`n = 0`).
+
+Los documentos tienen el mismo formato que los de `fetch_features.py`
+(`features` para high-level, `lowlevel` para low-level) y se escriben con
+upserts en lotes, repartidos entre varios hilos.
+"""
+import glob
+import json
+import os
+import sys
+import tarfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import zstandard
+from pymongo import MongoClient, UpdateOne
+
+from common.logging import setup_logging
+from common.db import create_db_manager
+from obtain_metadata.get_features.fetch_features import MONGO_URI, MONGO_DB, MONGO_COLLECTION, crear_indice
+
+logger = setup_logging()
+db_manager = create_db_manager("import_dump", max_conn=2)
+
+DUMP_DIR = os.getenv('ACOUSTICBRAINZ_DUMP_DIR', 'data/acousticbrainz')
+WRITE_BATCH = int(os.getenv('DUMP_WRITE_BATCH', '1000'))
+WRITERS = int(os.getenv('DUMP_WRITERS', '4'))
+
+
+def cargar_mbids() -> dict:
+    """{mbid: [ids de lyrics_database]} (varias canciones pueden compartir grabación)."""
+    mbids = defaultdict(list)
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, lower(mbid) FROM lyrics_database WHERE mbid IS NOT NULL;")
+        for song_id, mbid in cur:
+            mbids[mbid].append(song_id)
+        cur.close()
+    return mbids
+
+
+def campo_destino(ruta_dump: str) -> str:
+    return "lowlevel" if "lowlevel" in os.path.basename(ruta_dump) else "features"
+
+
+def mbid_de_miembro(nombre: str):
+    """(mbid, envío) a partir de `.../<mbid>-<n>.json`, o None si no es un documento."""
+    base = os.path.basename(nombre)
+    if not base.endswith(".json"):
+        return None
+    mbid, _, envio = base[:-5].rpartition("-")
+    if len(mbid) != 36 or not envio.isdigit():
+        return None
+    return mbid.lower(), int(envio)
+
+
+def leer_dump(ruta_dump: str, mbids: dict):
+    """Genera (mbid, documento) de los miembros del volcado que están en el catálogo."""
+    with open(ruta_dump, "rb") as f:
+        lector = zstandard.ZstdDecompressor().stream_reader(f)
+        # Modo "r|": lectura secuencial, sin buscar en el fichero
+        with tarfile.open(fileobj=lector, mode="r|") as tar:
+            for miembro in tar:
+                if not miembro.isfile():
+                    continue
+                clave = mbid_de_miembro(miembro.name)
+                if clave is None or clave[1] != 0 or clave[0] not in mbids:
+                    continue
+                yield clave[0], json.load(tar.extractfile(miembro))
+
+
+def operaciones(mbid, documento, campo, mbids):
+    return [
+        UpdateOne({"postgre_id": song_id},
+                  {"$set": {"postgre_id": song_id, "mbid": mbid, campo: documento},
+                   "$currentDate": {"updated_at": True}},
+                  upsert=True)
+        for song_id in mbids[mbid]
+    ]
+
+
+def importar(ruta_dump: str, mbids: dict, mongo_collection) -> int:
+    campo = campo_destino(ruta_dump)
+    logger.info(f"Importando {ruta_dump} en '{campo}'")
+    escritos = 0
+    lote = []
+    with ThreadPoolExecutor(max_workers=WRITERS) as executor:
+        en_vuelo = set()
+
+        def enviar(ops):
+            nonlocal en_vuelo
+            if len(en_vuelo) >= WRITERS:
+                done, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            en_vuelo.add(executor.submit(mongo_collection.bulk_write, ops, ordered=False))
+
+        for mbid, documento in leer_dump(ruta_dump, mbids):
+            lote.extend(operaciones(mbid, documento, campo, mbids))
+            if len(lote) >= WRITE_BATCH:
+                enviar(lote)
+                escritos += len(lote)
+                lote = []
+                logger.info(f"{escritos} documentos enviados desde {os.path.basename(ruta_dump)}")
+        if lote:
+            enviar(lote)
+            escritos += len(lote)
+        for future in wait(en_vuelo).done:
+            future.result()
+    return escritos
+
+
+def main(rutas=None):
+    rutas = rutas or sys.argv[1:] or sorted(glob.glob(os.path.join(DUMP_DIR, "*.tar.zst")))
+    if not rutas:
+        logger.info(f"No hay volcados en {DUMP_DIR}")
+        return
+
+    mbids = cargar_mbids()
+    logger.info(f"{len(mbids)} MBIDs del catálogo en memoria")
+    mongo_client = MongoClient(MONGO_URI)
+    mongo_collection = mongo_client[MONGO_DB][MONGO_COLLECTION]
+    crear_indice(mongo_collection)
+    try:
+        total = sum(importar(ruta, mbids, mongo_collection) for ruta in rutas)
+    finally:
+        mongo_client.close()
+    logger.info(f"✅ Importación finalizada: {total} documentos escritos")
+
+
+if __name__ == '__main__':
+    main()
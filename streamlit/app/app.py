@@ -1,19 +1,27 @@
 import streamlit as st
-from search_for_songs import buscar_canciones
+from search_for_songs import buscar_canciones, obtener_letra
 import json
 
 st.set_page_config(page_title="Buscador Musical", layout="centered")
 
 st.title("🎵 Buscador de Canciones por Tema")
 
+
+@st.cache_data(show_spinner=False)
+def cargar_letra(song_id):
+    return obtener_letra(song_id)
+
+
 # Entrada principal del usuario
 query = st.text_input("Introduce una frase temática para buscar canciones", placeholder="Ej. canciones sobre soledad")
 
 # Filtros opcionales
 with st.expander("Filtros opcionales"):
-    genre = st.text_input("🎧 Género musical (opcional)", placeholder="Ej. rock, pop, electronic")
-    key = st.text_input("🎼 Tono musical (opcional)", placeholder="Ej. C major, A minor")
+    genre = st.text_input("🎧 Géneros musicales (opcional, separados por comas)", placeholder="Ej. rock, pop, electronic")
+    key = st.text_input("🎼 Tono musical (opcional)", placeholder="Ej. C major, A minor, 8A")
+    compatible_keys = st.checkbox("Incluir tonos compatibles (relativo y vecinos en la rueda Camelot)")
     bpm = st.number_input("⏱️ BPM (opcional)", min_value=0, max_value=300, step=1)
+    bpm_tolerance = st.slider("± Tolerancia de BPM", min_value=0, max_value=30, value=3)
 
 # Entrada para canción de referencia
 with st.expander("Usar canción de referencia (opcional)"):
@@ -30,7 +38,9 @@ if st.button("🔍 Buscar canciones"):
             "query": query,
             "genre": genre if genre else None,
             "key": key if key else None,
+            "compatible_keys": True if key and compatible_keys else None,
             "bpm": int(bpm) if bpm else None,
+            "bpm_tolerance": bpm_tolerance if bpm else None,
             "artist_ref": artist_ref if artist_ref else None,
             "title_ref": title_ref if title_ref else None
         }
@@ -38,32 +48,37 @@ if st.button("🔍 Buscar canciones"):
         # Limpiar None
         input_data = {k: v for k, v in input_data.items() if v is not None}
 
-        # Ejecutar búsqueda
+        # Ejecutar búsqueda (se guarda en la sesión para sobrevivir a los reruns
+        # que provoca abrir una letra)
         with st.spinner("Buscando canciones..."):
-            resultados = buscar_canciones(json.dumps(input_data))
+            st.session_state["resultados"] = buscar_canciones(json.dumps(input_data))
 
-        # Mostrar resultados
-        if "error" in resultados:
-            st.error(resultados["error"])
-        elif not resultados["results"]:
-            st.info("No se encontraron resultados.")
-        else:
-            st.success(f"Se encontraron {len(resultados['results'])} canciones similares:")
-            for r in resultados["results"]:
-                st.markdown(f"""
-                **🎵 {r['title']}**  
-                *Artista:* {r['artist']}  
-                *Álbum:* {r.get('album', 'N/A')}  
-                *Género:* {r.get('genre', 'N/A')}  
-                *Tono:* {r.get('key', 'N/A')}  
-                *BPM:* {r.get('bpm', 'N/A')}  
-                *MBID:* {r.get('mbid', 'N/A')}  
-                *Link:* {r.get('link', 'N/A')}  
-                *Score:* {r['score']}
-                ---
-                """)
-                with st.expander("Ver letra"):
-                    st.text(r.get("letra", "Letra no disponible."))
+# Mostrar resultados
+resultados = st.session_state.get("resultados")
+if resultados is not None:
+    if "error" in resultados:
+        st.error(resultados["error"])
+    elif not resultados["results"]:
+        st.info("No se encontraron resultados.")
+    else:
+        st.success(f"Se encontraron {len(resultados['results'])} canciones similares:")
+        for r in resultados["results"]:
+            st.markdown(f"""
+            **🎵 {r['title']}**  
+            *Artista:* {r['artist']}  
+            *Álbum:* {r.get('album', 'N/A')}  
+            *Género:* {r.get('genre', 'N/A')}  
+            *Tono:* {r.get('key', 'N/A')}  
+            *BPM:* {r.get('bpm', 'N/A')}  
+            *MBID:* {r.get('mbid', 'N/A')}  
+            *Link:* {r.get('link', 'N/A')}  
+            *Score:* {r['score']}
+            ---
+            """)
+            with st.expander("Ver letra"):
+                # La letra no viene en el resultado: se pide por id solo si se activa
+                if st.toggle("Mostrar letra", key=f"letra_{r['id']}"):
+                    st.text(cargar_letra(r["id"]) or "Letra no disponible.")
 
-            with st.expander("📤 Consulta enviada"):
-                st.json(resultados["query_input"])
+        with st.expander("📤 Consulta enviada"):
+            st.json(resultados["query_input"])
@@ -0,0 +1,60 @@
+"""Reordenación de resultados para listas de reproducción diversas."""
+from typing import List
+
+import numpy as np
+
+
+def mmr(relevancias, vectores, k: int, lambda_: float = 0.7) -> List[int]:
+    """Maximal Marginal Relevance sobre candidatos ya recuperados.
+
+    Args:
+        relevancias: puntuación de cada candidato respecto a la consulta.
+        vectores: matriz (n, d) con el embedding de cada candidato.
+        k: número de candidatos a seleccionar.
+        lambda_: peso de la relevancia frente a la diversidad (1.0 = solo relevancia).
+
+    Returns:
+        Índices de los candidatos seleccionados, en orden.
+    """
+    relevancias = np.asarray(relevancias, dtype=np.float32)
+    n = len(relevancias)
+    if n == 0 or k <= 0:
+        return []
+
+    vectores = np.asarray(vectores, dtype=np.float32)
+    normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+    vectores = vectores / np.where(normas == 0, 1.0, normas)
+
+    similitud_max = np.zeros(n, dtype=np.float32)
+    disponibles = np.ones(n, dtype=bool)
+    seleccion = []
+    for _ in range(min(k, n)):
+        puntuacion = lambda_ * relevancias - (1.0 - lambda_) * similitud_max
+        puntuacion[~disponibles] = -np.inf
+        elegido = int(np.argmax(puntuacion))
+        seleccion.append(elegido)
+        disponibles[elegido] = False
+        similitud_max = np.maximum(similitud_max, vectores @ vectores[elegido])
+    return seleccion
+
+
+def cluster_de(song_id, payload) -> int:
+    """Cluster de letra de un resultado; sin `lyric_cluster_id` es su propio cluster."""
+    cluster = (payload or {}).get("lyric_cluster_id")
+    return song_id if cluster is None else cluster
+
+
+def colapsar_por_cluster(items, clave) -> list:
+    """Deja el primer elemento de cada cluster de letra (los items ya vienen ordenados por score).
+
+    Args:
+        clave: función que devuelve el cluster de cada item (p. ej. con `cluster_de`).
+    """
+    vistos = set()
+    resultado = []
+    for item in items:
+        cluster = clave(item)
+        if cluster not in vistos:
+            vistos.add(cluster)
+            resultado.append(item)
+    return resultado
@@ -0,0 +1,340 @@
+"""Motores de búsqueda detrás de `buscar_canciones`.
+
+- QdrantBackend: la colección TFM en Qdrant (por defecto).
+- LocalBackend: los vectores en una matriz float32 en memoria, cargada desde
+  Postgres o desde un volcado `.npy` memory-mapped. Hace top-k exacto por
+  bloques (producto matricial + argpartition) y, opcionalmente, usa un índice
+  HNSW en proceso (hnswlib). Sirve para tests, trabajos offline, despliegues
+  pequeños sin Qdrant y como referencia exacta para medir el recall de Qdrant.
+"""
+import logging
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from qdrant_client import models
+
+from search_filters import Filtros, a_filtro_qdrant
+
+try:
+    import hnswlib
+except Exception:
+    hnswlib = None
+
+logger = logging.getLogger('tfm.search')
+
+
+@dataclass
+class Hit:
+    """Resultado de búsqueda con la misma forma que `ScoredPoint` de Qdrant."""
+    id: int
+    score: float
+    payload: Optional[dict] = None
+    vector: Optional[Dict[str, list]] = None
+
+
+class SearchBackend:
+    """Interfaz común de los motores de búsqueda."""
+
+    def search(self, vector_name: str, vector, limit: int, filtros: Optional[Filtros] = None,
+               with_payload=True, with_vector: bool = False) -> List[Hit]:
+        return self.search_batch(vector_name, [vector], limit, filtros, with_payload, with_vector)[0]
+
+    def search_batch(self, vector_name: str, vectors: Sequence, limit: int, filtros: Optional[Filtros] = None,
+                     with_payload=True, with_vector: bool = False) -> List[List[Hit]]:
+        raise NotImplementedError
+
+    def find_reference(self, artist: str, title: str, vector_name: str = "track_vector") -> Optional[Hit]:
+        """Canción de referencia por artista y título, con su vector `vector_name`."""
+        raise NotImplementedError
+
+    def get_payload(self, song_id, fields: List[str]) -> Optional[dict]:
+        raise NotImplementedError
+
+
+def parametros_busqueda_qdrant() -> models.SearchParams:
+    """Parámetros de búsqueda para colecciones cuantizadas.
+
+    Se piden `oversampling` veces más candidatos con los vectores cuantizados y
+    se reordenan (rescore) con los originales. En colecciones sin cuantizar
+    Qdrant los ignora.
+    """
+    oversampling = os.getenv("SEARCH_OVERSAMPLING")
+    hnsw_ef = os.getenv("SEARCH_HNSW_EF")
+    return models.SearchParams(
+        hnsw_ef=int(hnsw_ef) if hnsw_ef else None,
+        quantization=models.QuantizationSearchParams(
+            rescore=os.getenv("SEARCH_RESCORE", "true").lower() in ("1", "true", "yes"),
+            oversampling=float(oversampling) if oversampling else None,
+        ),
+    )
+
+
+def _como_lista(vector):
+    return vector.tolist() if isinstance(vector, np.ndarray) else list(vector)
+
+
+class QdrantBackend(SearchBackend):
+    def __init__(self, client, collection_name: str = "TFM", search_params: Optional[models.SearchParams] = None):
+        self.client = client
+        self.collection_name = collection_name
+        self.search_params = search_params
+
+    def search(self, vector_name, vector, limit, filtros=None, with_payload=True, with_vector=False):
+        return self.client.search(
+            collection_name=self.collection_name,
+            query_vector=(vector_name, _como_lista(vector)),
+            limit=limit,
+            query_filter=a_filtro_qdrant(filtros),
+            search_params=self.search_params,
+            with_payload=with_payload,
+            with_vectors=[vector_name] if with_vector else False,
+        )
+
+    def search_batch(self, vector_name, vectors, limit, filtros=None, with_payload=True, with_vector=False):
+        qdrant_filter = a_filtro_qdrant(filtros)
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=_como_lista(vector),
+                    using=vector_name,
+                    filter=qdrant_filter,
+                    params=self.search_params,
+                    limit=limit,
+                    with_payload=with_payload,
+                    with_vector=[vector_name] if with_vector else False,
+                )
+                for vector in vectors
+            ],
+        )
+        return [response.points for response in responses]
+
+    def find_reference(self, artist, title, vector_name="track_vector"):
+        points, _ = self.client.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=models.Filter(must=[
+                models.FieldCondition(key="artist", match=models.MatchValue(value=artist)),
+                models.FieldCondition(key="title", match=models.MatchValue(value=title)),
+            ]),
+            limit=1,
+            with_payload=False,
+            with_vectors=[vector_name],
+        )
+        return points[0] if points else None
+
+    def get_payload(self, song_id, fields):
+        points = self.client.retrieve(collection_name=self.collection_name, ids=[song_id],
+                                      with_payload=fields, with_vectors=False)
+        return points[0].payload if points else None
+
+
+def _normalizar(matriz) -> np.ndarray:
+    matriz = np.ascontiguousarray(matriz, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    return matriz / np.where(normas == 0, 1.0, normas)
+
+
+def top_k_exacto(matriz: np.ndarray, consultas: np.ndarray, k: int, mascara: Optional[np.ndarray] = None,
+                 block_size: int = 65536):
+    """Top-k exacto por producto escalar, recorriendo la matriz por bloques.
+
+    Cada bloque se multiplica por todas las consultas a la vez y solo se
+    conservan sus k mejores candidatos (argpartition), así que la memoria es
+    O(consultas * block_size) aunque el catálogo no quepa entero en una pasada.
+
+    Returns:
+        (filas, scores) de forma (n_consultas, k'), ordenados de mayor a menor.
+        Las filas excluidas por la máscara llegan con score -inf.
+    """
+    n_consultas = consultas.shape[0]
+    mejores_filas = np.empty((n_consultas, 0), dtype=np.int64)
+    mejores_scores = np.empty((n_consultas, 0), dtype=np.float32)
+    for inicio in range(0, matriz.shape[0], block_size):
+        bloque = matriz[inicio:inicio + block_size]
+        scores = consultas @ bloque.T
+        if mascara is not None:
+            scores = np.where(mascara[inicio:inicio + bloque.shape[0]], scores, -np.inf)
+        kb = min(k, bloque.shape[0])
+        idx = np.argpartition(-scores, kb - 1, axis=1)[:, :kb]
+        mejores_filas = np.concatenate([mejores_filas, idx + inicio], axis=1)
+        mejores_scores = np.concatenate([mejores_scores, np.take_along_axis(scores, idx, axis=1)], axis=1)
+        if mejores_filas.shape[1] > k:
+            sel = np.argpartition(-mejores_scores, k - 1, axis=1)[:, :k]
+            mejores_filas = np.take_along_axis(mejores_filas, sel, axis=1)
+            mejores_scores = np.take_along_axis(mejores_scores, sel, axis=1)
+    orden = np.argsort(-mejores_scores, axis=1)
+    return np.take_along_axis(mejores_filas, orden, axis=1), np.take_along_axis(mejores_scores, orden, axis=1)
+
+
+class LocalBackend(SearchBackend):
+    """Búsqueda en proceso sobre matrices float32 normalizadas (similitud coseno)."""
+
+    def __init__(self, ids, vectores: Dict[str, np.ndarray], payloads: List[dict], use_hnsw: bool = False,
+                 block_size: int = 65536):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectores = {name: _normalizar(matriz) for name, matriz in vectores.items()}
+        self.payloads = payloads
+        self.block_size = block_size
+        self._fila_por_id = {int(song_id): fila for fila, song_id in enumerate(self.ids)}
+
+        # Columnas de payload como arrays para filtrar con máscaras NumPy
+        self._bpm = np.array([p.get("bpm") if p.get("bpm") is not None else np.nan for p in payloads],
+                             dtype=np.float32)
+        self._camelot = np.array([p.get("camelot") or "" for p in payloads], dtype=object)
+        self._key = np.array([p.get("key") or "" for p in payloads], dtype=object)
+        filas_por_genero = defaultdict(list)
+        self._referencias = {}
+        for fila, payload in enumerate(payloads):
+            for genero in payload.get("genres") or []:
+                filas_por_genero[genero].append(fila)
+            self._referencias.setdefault((payload.get("artist"), payload.get("title")), fila)
+        self._filas_por_genero = {g: np.asarray(filas, dtype=np.int64) for g, filas in filas_por_genero.items()}
+
+        self._hnsw = {}
+        if use_hnsw:
+            if hnswlib is None:
+                logger.warning("hnswlib no está instalado; se usa búsqueda exacta")
+            else:
+                for name, matriz in self.vectores.items():
+                    self._hnsw[name] = self._construir_hnsw(matriz)
+
+    @staticmethod
+    def _construir_hnsw(matriz):
+        index = hnswlib.Index(space="cosine", dim=matriz.shape[1])
+        index.init_index(max_elements=max(1, matriz.shape[0]), ef_construction=200, M=16)
+        index.add_items(matriz, np.arange(matriz.shape[0]))
+        index.set_ef(int(os.getenv("SEARCH_HNSW_EF", "128")))
+        return index
+
+    @classmethod
+    def desde_npy(cls, directorio: str, **kwargs) -> "LocalBackend":
+        """Carga un snapshot de `common.snapshot` (ids.npy, <vector>.npy y payload.jsonl)."""
+        from common.snapshot import abrir_snapshot
+
+        snapshot = abrir_snapshot(directorio)
+        return cls(snapshot.ids, snapshot.vectores, list(snapshot.payloads()), **kwargs)
+
+    @classmethod
+    def desde_postgres(cls, db_manager, **kwargs) -> "LocalBackend":
+        from common.catalogo import leer_catalogo
+
+        ids, payloads, letras, pistas = [], [], [], []
+        for lote in leer_catalogo(db_manager, batch_size=5000):
+            for cancion in lote:
+                ids.append(cancion.id)
+                payloads.append(cancion.payload)
+                letras.append(cancion.lyrics_vector)
+                pistas.append(cancion.track_vector)
+        vectores = {"lyrics_vector": np.vstack(letras), "track_vector": np.vstack(pistas)} if ids else {}
+        return cls(ids, vectores, payloads, **kwargs)
+
+    def mascara(self, filtros: Optional[Filtros]) -> Optional[np.ndarray]:
+        if filtros is None:
+            return None
+        mascara = np.ones(len(self.ids), dtype=bool)
+        if filtros.generos:
+            con_genero = np.zeros(len(self.ids), dtype=bool)
+            for genero in filtros.generos:
+                if genero in self._filas_por_genero:
+                    con_genero[self._filas_por_genero[genero]] = True
+            mascara &= con_genero
+        if filtros.camelot:
+            mascara &= np.isin(self._camelot, filtros.camelot)
+        if filtros.key_literal:
+            mascara &= self._key == filtros.key_literal
+        if filtros.bpm:
+            bpm_min, bpm_max = filtros.bpm
+            # Las comparaciones con NaN (sin BPM) son False: quedan fuera del filtro
+            if bpm_min is not None:
+                mascara &= self._bpm >= bpm_min
+            if bpm_max is not None:
+                mascara &= self._bpm <= bpm_max
+        return mascara
+
+    def _payload(self, fila, with_payload):
+        if not with_payload:
+            return None
+        payload = self.payloads[fila]
+        if with_payload is True:
+            return dict(payload)
+        return {campo: payload[campo] for campo in with_payload if campo in payload}
+
+    def search_batch(self, vector_name, vectors, limit, filtros=None, with_payload=True, with_vector=False):
+        if not len(self.ids):
+            return [[] for _ in vectors]
+        matriz = self.vectores[vector_name]
+        consultas = _normalizar(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+        mascara = self.mascara(filtros)
+        k = min(limit, len(self.ids))
+
+        if mascara is None and vector_name in self._hnsw:
+            filas, distancias = self._hnsw[vector_name].knn_query(consultas, k=k)
+            scores = 1.0 - distancias
+        else:
+            # Con filtros se busca de forma exacta sobre la máscara, como hace
+            # Qdrant cuando el filtro es muy selectivo
+            filas, scores = top_k_exacto(matriz, consultas, k, mascara, self.block_size)
+
+        resultados = []
+        for filas_q, scores_q in zip(filas, scores):
+            hits = []
+            for fila, score in zip(filas_q, scores_q):
+                if not np.isfinite(score):
+                    continue
+                fila = int(fila)
+                hits.append(Hit(
+                    id=int(self.ids[fila]),
+                    score=float(score),
+                    payload=self._payload(fila, with_payload),
+                    vector={vector_name: matriz[fila].tolist()} if with_vector else None,
+                ))
+            resultados.append(hits)
+        return resultados
+
+    def find_reference(self, artist, title, vector_name="track_vector"):
+        fila = self._referencias.get((artist, title))
+        if fila is None:
+            return None
+        return Hit(id=int(self.ids[fila]), score=1.0, vector={vector_name: self.vectores[vector_name][fila].tolist()})
+
+    def get_payload(self, song_id, fields):
+        fila = self._fila_por_id.get(int(song_id))
+        return None if fila is None else self._payload(fila, fields)
+
+
+def medir_recall(referencia: SearchBackend, candidato: SearchBackend, vector_name: str, consultas, k: int = 10) -> float:
+    """Recall@k del motor `candidato` tomando `referencia` (p. ej. LocalBackend exacto) como verdad."""
+    esperados = referencia.search_batch(vector_name, consultas, k, with_payload=False)
+    obtenidos = candidato.search_batch(vector_name, consultas, k, with_payload=False)
+    aciertos = total = 0
+    for hits_ref, hits_cand in zip(esperados, obtenidos):
+        ids_ref = {hit.id for hit in hits_ref}
+        aciertos += len(ids_ref & {hit.id for hit in hits_cand})
+        total += len(ids_ref)
+    return aciertos / total if total else 1.0
+
+
+def crear_backend(collection_name: str = "TFM") -> SearchBackend:
+    """Motor configurado con SEARCH_BACKEND (qdrant o local).
+
+    En modo local los vectores se cargan de LOCAL_VECTORS_PATH (volcado .npy)
+    o, si no se indica, de Postgres. SEARCH_LOCAL_HNSW=true activa hnswlib.
+    """
+    tipo = os.getenv("SEARCH_BACKEND", "qdrant")
+    if tipo == "qdrant":
+        from qdrant_client import QdrantClient
+
+        client = QdrantClient(host=os.getenv("QDRANT_HOST", "localhost"), port=int(os.getenv("QDRANT_PORT", 6333)))
+        return QdrantBackend(client, collection_name, parametros_busqueda_qdrant())
+    if tipo == "local":
+        use_hnsw = os.getenv("SEARCH_LOCAL_HNSW", "false").lower() in ("1", "true", "yes")
+        if ruta := os.getenv("LOCAL_VECTORS_PATH"):
+            return LocalBackend.desde_npy(ruta, use_hnsw=use_hnsw)
+        from common.db import create_db_manager
+
+        # Carga el catálogo entero: sin el timeout corto de las consultas de búsqueda
+        return LocalBackend.desde_postgres(create_db_manager("local_backend"), use_hnsw=use_hnsw)
+    raise ValueError(f"SEARCH_BACKEND desconocido: {tipo} (válidos: qdrant, local)")
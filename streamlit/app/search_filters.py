@@ -0,0 +1,85 @@
+"""Construcción de filtros para la búsqueda de canciones.
+
+La consulta se traduce primero a `Filtros`, independiente del motor de
+búsqueda, y después a un `models.Filter` de Qdrant o a una máscara NumPy en
+el motor local. Los campos filtrables (`bpm`, `camelot`, `genres`, `key`) tienen
+índice de payload creado en la migración, así que Qdrant puede combinar el
+filtro con el HNSW en lugar de recorrer todos los puntos.
+"""
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from qdrant_client import models
+
+from common.music_metadata import a_camelot, normalizar_generos, tonalidades_compatibles
+
+DEFAULT_BPM_TOLERANCE = 3.0
+
+
+@dataclass
+class Filtros:
+    generos: List[str] = field(default_factory=list)
+    # Códigos Camelot aceptados (uno, o varios si se piden tonalidades compatibles)
+    camelot: List[str] = field(default_factory=list)
+    # Tonalidad en notación no reconocida: se compara con el valor original
+    key_literal: Optional[str] = None
+    bpm: Optional[Tuple[Optional[float], Optional[float]]] = None
+
+    def vacio(self) -> bool:
+        return not (self.generos or self.camelot or self.key_literal or self.bpm)
+
+
+def rango_bpm(data: dict) -> Optional[Tuple[Optional[float], Optional[float]]]:
+    """Devuelve (mínimo, máximo) de BPM a partir de la consulta.
+
+    Se admiten `bpm_min`/`bpm_max` explícitos o `bpm` con `bpm_tolerance`.
+    """
+    bpm_min, bpm_max = data.get("bpm_min"), data.get("bpm_max")
+    if bpm_min is not None or bpm_max is not None:
+        return (float(bpm_min) if bpm_min is not None else None,
+                float(bpm_max) if bpm_max is not None else None)
+
+    bpm = data.get("bpm")
+    if not bpm:
+        return None
+    tolerancia = data.get("bpm_tolerance")
+    tolerancia = DEFAULT_BPM_TOLERANCE if tolerancia is None else float(tolerancia)
+    return float(bpm) - tolerancia, float(bpm) + tolerancia
+
+
+def parsear_filtros(data: dict) -> Optional[Filtros]:
+    """Extrae los filtros opcionales de la consulta; None si no hay ninguno."""
+    filtros = Filtros(generos=normalizar_generos(data.get("genre")), bpm=rango_bpm(data))
+
+    if key := data.get("key"):
+        codigo = a_camelot(key)
+        if codigo is None:
+            filtros.key_literal = key
+        elif data.get("compatible_keys"):
+            filtros.camelot = tonalidades_compatibles(key)
+        else:
+            filtros.camelot = [codigo]
+
+    return None if filtros.vacio() else filtros
+
+
+def a_filtro_qdrant(filtros: Optional[Filtros]) -> Optional[models.Filter]:
+    if filtros is None:
+        return None
+    condiciones = []
+    if filtros.generos:
+        condiciones.append(models.FieldCondition(key="genres", match=models.MatchAny(any=filtros.generos)))
+    if filtros.key_literal:
+        condiciones.append(models.FieldCondition(key="key", match=models.MatchValue(value=filtros.key_literal)))
+    if len(filtros.camelot) == 1:
+        condiciones.append(models.FieldCondition(key="camelot", match=models.MatchValue(value=filtros.camelot[0])))
+    elif filtros.camelot:
+        condiciones.append(models.FieldCondition(key="camelot", match=models.MatchAny(any=filtros.camelot)))
+    if filtros.bpm:
+        condiciones.append(models.FieldCondition(key="bpm", range=models.Range(gte=filtros.bpm[0], lte=filtros.bpm[1])))
+    return models.Filter(must=condiciones)
+
+
+def construir_filtro(data: dict) -> Optional[models.Filter]:
+    """Traduce los filtros opcionales de la consulta a un `models.Filter`."""
+    return a_filtro_qdrant(parsear_filtros(data))
@@ -1,16 +1,30 @@
-from qdrant_client import QdrantClient
 from sentence_transformers import SentenceTransformer
 from collections import defaultdict
-import numpy as np
 import json
 import os
 
-# Inicializar Qdrant y modelo
-qdrant_host = os.getenv("QDRANT_HOST", "localhost")
-qdrant_port = int(os.getenv("QDRANT_PORT", 6333))
+from search_filters import parsear_filtros
+from search_backends import crear_backend
+from reranking import cluster_de, colapsar_por_cluster, mmr
 
-qdrant = QdrantClient(host=qdrant_host, port=qdrant_port)
+# Motor de búsqueda (Qdrant por defecto; SEARCH_BACKEND=local usa NumPy en proceso) y modelo
 model = SentenceTransformer("intfloat/multilingual-e5-small")
+_backends = {}
+
+# Solo se piden al motor los campos que se muestran; la letra se carga aparte
+DISPLAY_FIELDS = ["artist", "title", "album", "mbid", "bpm", "key", "genre", "link", "yotube_link", "lyric_cluster_id"]
+# Origen de las letras bajo demanda: "postgres" o "qdrant" (payload `lyric`)
+LYRICS_SOURCE = os.getenv("LYRICS_SOURCE", "qdrant")
+# Mostrar solo una versión de cada letra (directos, reediciones, covers)
+COLLAPSE_CLUSTERS = os.getenv("SEARCH_COLLAPSE_LYRIC_CLUSTERS", "true").lower() in ("1", "true", "yes")
+_db_manager = None
+
+
+def get_backend(collection_name="TFM"):
+    if collection_name not in _backends:
+        _backends[collection_name] = crear_backend(collection_name)
+    return _backends[collection_name]
+
 
 def buscar_canciones(json_input: str, collection_name="TFM", top_k=5):
     data = json.loads(json_input)
@@ -23,24 +37,12 @@ def buscar_canciones(json_input: str, collection_name="TFM", top_k=5):
     
     query_vector = model.encode(user_query, normalize_embeddings=True).tolist()
 
-    # Filtros opcionales
-    filters = []
-    if genre := data.get("genre"):
-        filters.append({"key": "genre", "match": {"value": genre}})
-    if key := data.get("key"):
-        filters.append({"key": "key", "match": {"value": key}})
-    if bpm := data.get("bpm"):
-        filters.append({"key": "bpm", "match": {"value": bpm}})
-    
-    qdrant_filter = {"must": filters} if filters else None
+    # Filtros opcionales (rango de BPM, tonalidades compatibles, varios géneros)
+    filtros = parsear_filtros(data)
+    backend = get_backend(collection_name)
 
     # Buscar por lyrics_vector
-    lyrics_hits = qdrant.search(
-        collection_name=collection_name,
-        query_vector=("lyrics_vector", query_vector),
-        limit=top_k * 3,
-        query_filter=qdrant_filter
-    )
+    lyrics_hits = backend.search("lyrics_vector", query_vector, top_k * 3, filtros, with_payload=DISPLAY_FIELDS)
 
     for hit in lyrics_hits:
         combined_scores[hit.id]["score"] += hit.score * 0.5
@@ -51,54 +53,129 @@ def buscar_canciones(json_input: str, collection_name="TFM", top_k=5):
     artist_ref = data.get("artist_ref")
     title_ref = data.get("title_ref")
     if artist_ref and title_ref:
-        scroll_result = qdrant.scroll(
-            collection_name=collection_name,
-            scroll_filter={
-                "must": [
-                    {"key": "artist", "match": {"value": artist_ref}},
-                    {"key": "title", "match": {"value": title_ref}}
-                ]
-            },
-            limit=1,
-            with_vectors=True
-        )
-        if scroll_result[0]:
-            ref_vector = scroll_result[0][0].vector["track_vector"]
-            track_hits = qdrant.search(
-                collection_name=collection_name,
-                query_vector=("track_vector", ref_vector),
-                limit=top_k * 3,
-                query_filter=qdrant_filter
-            )
+        reference = backend.find_reference(artist_ref, title_ref, "track_vector")
+        if reference:
+            ref_vector = reference.vector["track_vector"]
+            track_hits = backend.search("track_vector", ref_vector, top_k * 3, filtros, with_payload=DISPLAY_FIELDS)
             for hit in track_hits:
-                if hit.id == scroll_result[0][0].id:
+                if hit.id == reference.id:
                     continue  # Saltar la canción original
                 combined_scores[hit.id]["score"] += hit.score * 0.5
                 combined_scores[hit.id]["count"] += 1
                 combined_scores[hit.id]["payload"] = hit.payload
 
     # Ordenar resultados
-    ranked = sorted(combined_scores.items(), key=lambda x: x[1]["score"], reverse=True)[:top_k]
+    ranked = sorted(combined_scores.items(), key=lambda x: x[1]["score"], reverse=True)
+    if COLLAPSE_CLUSTERS:
+        ranked = colapsar_por_cluster(ranked, lambda x: cluster_de(x[0], x[1]["payload"]))
+    ranked = ranked[:top_k]
 
     return {
         "query_input": data,  # devuelve toda la consulta del usuario
         "results": [
-            {
-                "rank": i + 1,
-                "artist": item[1]["payload"].get("artist"),
-                "title": item[1]["payload"].get("title"),
-                "album": item[1]["payload"].get("album"),
-                "letra": item[1]["payload"].get("lyric"),
-                "mbid": item[1]["payload"].get("mbid"),
-                "bpm": item[1]["payload"].get("bpm"),
-                "key": item[1]["payload"].get("key"),
-                "genre": item[1]["payload"].get("genre"),
-                "link": item[1]["payload"].get("link"),
-                "score": round(item[1]["score"], 4)
-            } for i, item in enumerate(ranked)
+            _formatear_resultado(i + 1, item[0], item[1]["payload"], item[1]["score"])
+            for i, item in enumerate(ranked)
         ]
     }
 
+
+def buscar_canciones_batch(json_input: str, collection_name="TFM", top_k=5, lambda_mmr=0.7):
+    """Busca varias frases semilla a la vez (p. ej. para generar una playlist).
+
+    Todas las frases se codifican en una sola llamada al modelo y se envían al
+    motor en una única petición batch. Devuelve los resultados de cada semilla
+    y una lista combinada sin duplicados, reordenada con MMR para dar variedad.
+    """
+    data = json.loads(json_input)
+    queries = [q for q in data.get("queries", []) if q]
+    if not queries:
+        return {"error": "Missing 'queries' field"}
+
+    top_k = int(data.get("top_k", top_k))
+    playlist_size = int(data.get("playlist_size", top_k * len(queries)))
+    lambda_mmr = float(data.get("diversity_lambda", lambda_mmr))
+    filtros = parsear_filtros(data)
+
+    query_vectors = model.encode(queries, normalize_embeddings=True)
+    responses = get_backend(collection_name).search_batch(
+        "lyrics_vector", query_vectors, top_k * 3, filtros,
+        with_payload=DISPLAY_FIELDS, with_vector=True,
+    )
+
+    per_query = []
+    candidates = {}
+    for query, hits in zip(queries, responses):
+        if COLLAPSE_CLUSTERS:
+            hits = colapsar_por_cluster(hits, lambda hit: cluster_de(hit.id, hit.payload))
+        per_query.append({
+            "query": query,
+            "results": [_formatear_resultado(i + 1, hit.id, hit.payload, hit.score) for i, hit in enumerate(hits[:top_k])],
+        })
+        for hit in hits:
+            # Un mismo tema puede aparecer en varias semillas: nos quedamos con su mejor score
+            clave = cluster_de(hit.id, hit.payload) if COLLAPSE_CLUSTERS else hit.id
+            if clave not in candidates or hit.score > candidates[clave].score:
+                candidates[clave] = hit
+
+    hits = list(candidates.values())
+    order = mmr(
+        [hit.score for hit in hits],
+        [hit.vector["lyrics_vector"] for hit in hits],
+        k=playlist_size,
+        lambda_=lambda_mmr,
+    )
+
+    return {
+        "query_input": data,
+        "per_query": per_query,
+        "results": [
+            _formatear_resultado(rank + 1, hits[i].id, hits[i].payload, hits[i].score)
+            for rank, i in enumerate(order)
+        ],
+    }
+
+
+def obtener_letra(song_id, collection_name="TFM"):
+    """Carga la letra de una canción bajo demanda (al abrirla en la interfaz)."""
+    if LYRICS_SOURCE == "postgres":
+        from common.db import execute_prepared
+
+        with _get_db_manager().get_connection() as conn:
+            cur = conn.cursor()
+            execute_prepared(cur, "letra_por_id", "SELECT letra FROM lyrics_database WHERE id = $1", (song_id,))
+            row = cur.fetchone()
+            cur.close()
+        return row[0] if row else None
+
+    payload = get_backend(collection_name).get_payload(song_id, ["lyric"])
+    return payload.get("lyric") if payload else None
+
+
+def _get_db_manager():
+    # Import diferido: el modo "qdrant" no necesita credenciales de Postgres
+    global _db_manager
+    if _db_manager is None:
+        from common.db import create_db_manager
+        _db_manager = create_db_manager("search", max_conn=2)
+    return _db_manager
+
+
+def _formatear_resultado(rank, song_id, payload, score):
+    return {
+        "rank": rank,
+        "id": song_id,
+        "artist": payload.get("artist"),
+        "title": payload.get("title"),
+        "album": payload.get("album"),
+        "mbid": payload.get("mbid"),
+        "bpm": payload.get("bpm"),
+        "key": payload.get("key"),
+        "genre": payload.get("genre"),
+        # Los puntos migrados antes guardaban el enlace como `yotube_link`
+        "link": payload.get("link") or payload.get("yotube_link"),
+        "score": round(score, 4)
+    }
+
 '''entrada = json.dumps({
     "query": "una canción sobre nostalgia y juventud",
     "artist_ref": "Executive Slacks",
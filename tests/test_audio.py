@@ -0,0 +1,62 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from common.audio import (  # noqa: E402
+    agrupar_parches, comando_ffmpeg, inicio_ventana, parches, parsear_salida_ytdlp, repartir_salidas, ventana_central,
+)
+
+
+def test_ventana_central():
+    audio = np.arange(100, dtype=np.float32)
+    assert ventana_central(audio, 2, sample_rate=10).tolist() == list(range(40, 60))
+    assert len(ventana_central(audio, 0, sample_rate=10)) == 100
+    assert len(ventana_central(audio, 50, sample_rate=10)) == 100
+
+
+def test_parches_y_relleno_de_pistas_cortas():
+    mel = np.ones((300, 96), dtype=np.float32)
+    assert parches(mel).shape == (3, 128, 96)
+    corto = parches(np.ones((10, 96)))
+    assert corto.shape == (1, 128, 96)
+    assert corto[0, 10:].sum() == 0
+
+
+def test_agrupar_y_repartir_por_pista():
+    pistas = [np.full((n, 2, 2), i, dtype=np.float32) for i, n in enumerate([3, 70, 1])]
+    lote, conteos = agrupar_parches(pistas, batch_size=64)
+    assert lote.shape[0] == 128
+    assert conteos == [3, 70, 1]
+
+    # Simula una salida por parche igual al valor de entrada
+    salidas = lote[:, 0, 0][:, np.newaxis]
+    por_pista = repartir_salidas(salidas, conteos)
+    assert [len(s) for s in por_pista] == [3, 70, 1]
+    assert [float(s.mean()) for s in por_pista] == [0.0, 1.0, 2.0]
+
+
+def test_parsear_salida_ytdlp():
+    salida = 'https://youtu.be/abc\nhttps://cdn/audio\n215.0\n{"User-Agent": "x"}\n'
+    stream = parsear_salida_ytdlp(salida)
+    assert stream.webpage_url == 'https://youtu.be/abc'
+    assert stream.stream_url == 'https://cdn/audio'
+    assert stream.duracion == 215.0
+    assert stream.headers == {"User-Agent": "x"}
+
+    sin_duracion = parsear_salida_ytdlp('u\ns\nNA\nNA\n')
+    assert sin_duracion.duracion is None and sin_duracion.headers == {}
+
+    with pytest.raises(RuntimeError):
+        parsear_salida_ytdlp('')
+
+
+def test_comando_ffmpeg_con_ventana():
+    assert inicio_ventana(200.0, 30) == 85.0
+    assert inicio_ventana(20.0, 30) is None
+    assert inicio_ventana(None, 30) is None
+
+    comando = comando_ffmpeg('https://cdn/audio', inicio=85.0, duracion=30, headers={"User-Agent": "x"})
+    assert comando.index('-ss') < comando.index('-i')
+    assert comando[comando.index('-t') + 1] == '30.000'
+    assert comando[comando.index('-headers') + 1] == 'User-Agent: x\r\n'
+    assert comando[-3:] == ['f32le', '-y', 'pipe:1']
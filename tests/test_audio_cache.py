@@ -0,0 +1,54 @@
+import os
+
+from common.audio_cache import AudioCache, obtener_audio, video_id
+
+
+def _fichero(tmp_path, nombre, tamano):
+    ruta = tmp_path / nombre
+    ruta.write_bytes(b'x' * tamano)
+    return str(ruta)
+
+
+def test_video_id():
+    assert video_id('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=3') == 'dQw4w9WgXcQ'
+    assert video_id('https://youtu.be/dQw4w9WgXcQ') == 'dQw4w9WgXcQ'
+    assert video_id('https://example.com/audio.mp3') is None
+    assert video_id(None) is None
+
+
+def test_guardar_y_obtener(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'), max_bytes=10_000)
+    assert cache.obtener('aaaaaaaaaaa') is None
+
+    cache.guardar_fichero('aaaaaaaaaaa', _fichero(tmp_path, 'a', 100), 'https://youtu.be/aaaaaaaaaaa', 180.0)
+    local = cache.obtener('aaaaaaaaaaa')
+    assert local.stream_url == cache.ruta('aaaaaaaaaaa')
+    assert local.duracion == 180.0
+    assert os.path.getsize(local.stream_url) == 100
+
+
+def test_expulsion_lru(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'), max_bytes=250)
+    for i, vid in enumerate(['aaaaaaaaaaa', 'bbbbbbbbbbb']):
+        cache.guardar_fichero(vid, _fichero(tmp_path, vid, 100), f'https://youtu.be/{vid}')
+        os.utime(cache.ruta(vid), (i, i))
+    # Leer 'a' la convierte en la más reciente: la expulsada debe ser 'b'
+    cache.obtener('aaaaaaaaaaa')
+    cache.guardar_fichero('ccccccccccc', _fichero(tmp_path, 'c', 100), 'https://youtu.be/ccccccccccc')
+
+    assert cache.obtener('bbbbbbbbbbb') is None
+    assert cache.obtener('aaaaaaaaaaa') is not None
+    assert cache.obtener('ccccccccccc') is not None
+    assert AudioCache(str(tmp_path / 'cache'), max_bytes=250)._bytes == 200
+
+
+def test_obtener_audio_no_llama_a_youtube_si_esta_en_cache(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path / 'cache'), max_bytes=10_000)
+    cache.guardar_fichero('aaaaaaaaaaa', _fichero(tmp_path, 'a', 10), 'https://youtu.be/aaaaaaaaaaa')
+
+    def sin_red(*args, **kwargs):
+        raise AssertionError('no debería resolverse en YouTube')
+
+    monkeypatch.setattr('common.audio_cache.resolver_youtube', sin_red)
+    stream = obtener_audio('ytsearch1:x', 'https://www.youtube.com/watch?v=aaaaaaaaaaa', cache=cache)
+    assert stream.stream_url == cache.ruta('aaaaaaaaaaa')
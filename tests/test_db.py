@@ -0,0 +1,218 @@
+import asyncio
+import csv
+import threading
+import time
+
+import pytest
+
+from common.db import (
+    AsyncDatabaseManager, ConnectionPool, DatabaseManager, PoolError, PoolTimeout, a_csv, copy_rows,
+    create_db_manager, execute_prepared, stage_setting,
+)
+
+
+class FakeConn:
+    pass
+
+
+class FakeCursor:
+    def __init__(self, conn=None):
+        self.connection = conn or FakeConn()
+        self.ejecutadas = []
+        self.copias = []
+
+    def execute(self, sql, params=None):
+        self.ejecutadas.append((sql, params))
+
+    def copy_expert(self, sql, buffer):
+        self.copias.append((sql, buffer.getvalue()))
+
+
+def test_connect_kwargs_con_timeout_y_nombre():
+    manager = DatabaseManager("postgresql://x", statement_timeout_ms=5000, application_name="tfm-search")
+    assert manager.connect_kwargs() == {"options": "-c statement_timeout=5000", "application_name": "tfm-search"}
+    assert DatabaseManager("postgresql://x").connect_kwargs() == {}
+
+
+def test_stage_setting_prioriza_entorno_por_etapa(monkeypatch):
+    monkeypatch.delenv("DB_STATEMENT_TIMEOUT_MS", raising=False)
+    monkeypatch.delenv("DB_STATEMENT_TIMEOUT_MS_SEARCH", raising=False)
+    assert stage_setting("search", "statement_timeout_ms") == 5000
+    assert stage_setting("otra", "statement_timeout_ms", 7) == 7
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "100")
+    assert stage_setting("search", "statement_timeout_ms") == "100"
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS_SEARCH", "200")
+    assert stage_setting("search", "statement_timeout_ms") == "200"
+
+
+def test_create_db_manager(monkeypatch):
+    monkeypatch.setenv("DB_MAX_CONN_GET_MBID", "4")
+    manager = create_db_manager("get_mbid", database_url="postgresql://x")
+    assert manager._max_conn == 4
+    assert manager.application_name == "tfm-get_mbid"
+    assert manager.statement_timeout_ms == 300000
+
+
+def test_execute_prepared_prepara_una_vez_por_conexion():
+    cur = FakeCursor()
+    execute_prepared(cur, "q", "SELECT $1, $2", (1, "a"))
+    execute_prepared(cur, "q", "SELECT $1, $2", (2, "b"))
+    assert cur.ejecutadas == [
+        ("PREPARE q AS SELECT $1, $2", None),
+        ("EXECUTE q (%s, %s)", (1, "a")),
+        ("EXECUTE q (%s, %s)", (2, "b")),
+    ]
+    # Otra conexión no tiene la sentencia preparada
+    otro = FakeCursor()
+    execute_prepared(otro, "q", "SELECT $1, $2", (3, "c"))
+    assert otro.ejecutadas[0][0] == "PREPARE q AS SELECT $1, $2"
+
+
+def test_copy_rows():
+    cur = FakeCursor()
+    copy_rows(cur, "t", ("a", "b"), [(1, None), (2, ["x"])])
+    sql, datos = cur.copias[0]
+    assert sql == "COPY t (a, b) FROM STDIN WITH (FORMAT csv)"
+    assert list(csv.reader(datos.splitlines())) == [["1", ""], ["2", '{"x"}']]
+    assert a_csv([]).getvalue() == ""
+
+
+class FakePgConn:
+    """Conexión falsa con lo que usa ConnectionPool."""
+    def __init__(self, viva=True):
+        self.closed = 0
+        self.viva = viva
+        self.rollbacks = 0
+        self.estado = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cur:
+            def execute(self, sql, params=None):
+                if not conn.viva:
+                    raise RuntimeError("server closed the connection unexpectedly")
+
+            def fetchone(self):
+                return (1,)
+
+            def close(self):
+                pass
+        return Cur()
+
+    def get_transaction_status(self):
+        return self.estado
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.estado = 0
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def test_pool_bloquea_hasta_timeout_y_despierta_al_devolver():
+    pool = ConnectionPool(FakePgConn, min_conn=0, max_conn=1, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+
+    recibida = []
+    hilo = threading.Thread(target=lambda: recibida.append(pool.getconn(timeout=2)))
+    hilo.start()
+    # Espera a que el hilo esté bloqueado en el pool
+    while pool.stats()["waits"] < 2:
+        time.sleep(0.01)
+    pool.putconn(conn)
+    hilo.join(2)
+    assert recibida == [conn]
+    stats = pool.stats()
+    assert stats["timeouts"] == 1 and stats["waits"] == 2 and stats["in_use"] == 1 and stats["total"] == 1
+
+
+def test_pool_es_thread_safe():
+    creadas = []
+
+    def conectar():
+        conn = FakePgConn()
+        creadas.append(conn)
+        return conn
+
+    pool = ConnectionPool(conectar, min_conn=0, max_conn=3, timeout=5)
+    en_uso = set()
+    maximo = [0]
+    cerrojo = threading.Lock()
+
+    def trabajar():
+        for _ in range(50):
+            conn = pool.getconn()
+            with cerrojo:
+                assert id(conn) not in en_uso
+                en_uso.add(id(conn))
+                maximo[0] = max(maximo[0], len(en_uso))
+            with cerrojo:
+                en_uso.discard(id(conn))
+            pool.putconn(conn)
+
+    hilos = [threading.Thread(target=trabajar) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert len(creadas) <= 3 and maximo[0] <= 3
+    assert pool.stats()["checkouts"] == 400 and pool.stats()["in_use"] == 0
+
+
+def test_pool_descarta_conexiones_muertas_y_viejas():
+    ahora = [0.0]
+    pool = ConnectionPool(FakePgConn, min_conn=1, max_conn=2, max_lifetime=100, check_idle_after=10,
+                          clock=lambda: ahora[0])
+    conn = pool.getconn()
+    pool.putconn(conn)
+    # Postgres se reinicia mientras la conexión está ociosa
+    conn.viva = False
+    ahora[0] = 20.0
+    nueva = pool.getconn()
+    assert nueva is not conn and conn.closed
+    pool.putconn(nueva)
+
+    # Superada la vida máxima se sustituye aunque funcione
+    ahora[0] = 200.0
+    otra = pool.getconn()
+    assert otra is not nueva and nueva.closed
+    assert pool.stats()["discarded"] == 2 and pool.stats()["total"] == 1
+
+
+def test_pool_deshace_transacciones_abiertas_al_devolver():
+    pool = ConnectionPool(FakePgConn, min_conn=0, max_conn=1)
+    conn = pool.getconn()
+    conn.estado = 2  # INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1 and pool.stats()["idle"] == 1
+    with pytest.raises(PoolError):
+        pool.putconn(conn)
+
+
+def test_pool_cerrado():
+    pool = ConnectionPool(FakePgConn, min_conn=1, max_conn=2)
+    conn = pool.getconn()
+    pool.closeall()
+    pool.putconn(conn)
+    assert conn.closed and pool.stats()["total"] == 0
+    with pytest.raises(PoolError):
+        pool.getconn()
+
+
+def test_async_database_manager_usa_el_pool():
+    manager = DatabaseManager("postgresql://x", max_conn=2)
+    manager._pool = ConnectionPool(FakePgConn, min_conn=0, max_conn=2)
+    async_db = AsyncDatabaseManager(manager)
+
+    async def consultar():
+        return await asyncio.gather(*(async_db.run(lambda conn, i: i, i) for i in range(5)))
+
+    assert asyncio.run(consultar()) == [0, 1, 2, 3, 4]
+    assert async_db.stats()["checkouts"] == 5 and async_db.stats()["in_use"] == 0
@@ -0,0 +1,67 @@
+from common.dedup import agrupar, filtro_canonicas, filtro_no_catalogadas, pares_similares, raices, similitud
+from common.music_metadata import clave_titulo, normalizar_texto
+
+
+def test_normalizar_texto_quita_acentos_puntuacion_y_mayusculas():
+    assert normalizar_texto("  Canción  del   Mariachi! ") == "cancion del mariachi"
+    assert normalizar_texto("AC∕DC") == normalizar_texto("ac/dc") == "ac dc"
+    assert normalizar_texto(None) == ""
+
+
+def test_clave_titulo_ignora_versiones():
+    base = clave_titulo("Bohemian Rhapsody")
+    assert clave_titulo("Bohemian Rhapsody (Remastered 2011)") == base
+    assert clave_titulo("Bohemian Rhapsody - Live at Wembley") == base
+    assert clave_titulo("Bohemian Rhapsody [Radio Edit]") == base
+
+
+def test_clave_titulo_quita_colaboraciones():
+    assert clave_titulo("Song (feat. Someone)") == clave_titulo("Song")
+    assert clave_titulo("Song ft. Someone") == clave_titulo("Song")
+
+
+def test_clave_titulo_conserva_guiones_que_son_parte_del_titulo():
+    assert clave_titulo("Me and You - Con Amor") != clave_titulo("Me and You")
+
+
+def test_agrupar_junta_variantes_y_erratas():
+    canonicas = agrupar([
+        (5, "Stairway to Heaven"),
+        (3, "Stairway to Heaven (Remastered 2012)"),
+        (8, "Stairway to Heaven's"),
+        (9, "Black Dog"),
+    ])
+    assert canonicas == {5: 3, 3: 3, 8: 3, 9: 9}
+
+
+def test_agrupar_no_junta_partes_distintas():
+    canonicas = agrupar([(1, "Another Brick in the Wall, Part 1"), (2, "Another Brick in the Wall, Part 2")])
+    assert canonicas == {1: 1, 2: 2}
+
+
+def test_similitud():
+    assert similitud("hola", "hola") == 1.0
+    assert similitud("", "hola") == 0.0
+
+
+def test_filtro_canonicas():
+    filtro = filtro_canonicas("lyrics_database", "l.id")
+    assert "cc.fuente = 'lyrics_database'" in filtro
+    assert "cc.song_id = l.id" in filtro
+
+
+def test_pares_similares_solo_compara_candidatos_del_indice():
+    claves = ["stairway to heaven", "stairway to heavens", "black dog", "part 1", "part 2"]
+    assert pares_similares(claves) == [("stairway to heaven", "stairway to heavens")]
+    assert pares_similares([]) == []
+
+
+def test_raices_une_transitivamente_en_la_menor_clave():
+    assert raices([("b", "c"), ("a", "b"), ("x", "y")]) == {"a": "a", "b": "a", "c": "a", "x": "x", "y": "x"}
+
+
+def test_filtro_no_catalogadas_cruza_las_dos_fuentes():
+    filtro = filtro_no_catalogadas("c.id")
+    assert "cl.grupo_id = cc.grupo_id" in filtro
+    assert "cl.fuente = 'lyrics_database'" in filtro
+    assert "cc.song_id = c.id" in filtro
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from obtain_metadata.essentia_analysis.download_analyze_music import descriptores  # noqa: E402
+
+
+class FakePool(dict):
+    """Imita el Pool de Essentia que devuelve MusicExtractor."""
+
+    def descriptorNames(self):
+        return list(self.keys())
+
+
+def test_descriptores_con_key_edma():
+    features = FakePool({
+        'rhythm.bpm': 121.7,
+        'rhythm.danceability': 1.3,
+        'tonal.key_edma.key': 'A',
+        'tonal.key_edma.scale': 'minor',
+        'tonal.key_edma.strength': 0.8,
+        'metadata.audio_properties.length': 215.0,
+        'lowlevel.mfcc.mean': [1, 2, 3],
+    })
+    datos = descriptores(features)
+    assert datos['ess_bpm'] == 121.7
+    assert (datos['ess_key'], datos['ess_scale']) == ('A', 'minor')
+    assert datos['ess_duration'] == 215.0
+    assert datos['ess_mfcc_mean'] == [1.0, 2.0, 3.0]
+    assert datos['ess_loudness'] is None
+
+
+def test_descriptores_versiones_antiguas():
+    features = FakePool({
+        'rhythm.bpm': 90,
+        'tonal.chords_key': 'C',
+        'tonal.chords_scale': 'major',
+        'metadata.audio_properties.analysis.length': 100.0,
+    })
+    datos = descriptores(features)
+    assert (datos['ess_key'], datos['ess_scale']) == ('C', 'major')
+    assert datos['ess_duration'] == 100.0
+    assert datos['ess_mfcc_mean'] is None
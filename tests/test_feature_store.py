@@ -0,0 +1,32 @@
+import csv
+
+import pytest
+
+from common.db import a_csv, literal_array
+from common.feature_store import ACTUALIZAR, RELLENAR, sql_upsert
+
+
+def test_sql_upsert_aplica_politicas():
+    sql = sql_upsert("song_tags", ("bpm", "initialkey", "genre"),
+                     politicas={"bpm": ACTUALIZAR, "initialkey": RELLENAR})
+    assert "INSERT INTO song_tags (song_id, bpm, initialkey, genre)\nVALUES %s" in sql
+    assert "bpm = COALESCE(EXCLUDED.bpm, song_tags.bpm)" in sql
+    assert "initialkey = COALESCE(song_tags.initialkey, EXCLUDED.initialkey)" in sql
+    assert "genre = EXCLUDED.genre" in sql
+    # Sin cambios no se reescribe la fila
+    assert "WHERE ROW(song_tags.bpm, song_tags.initialkey, song_tags.genre) IS DISTINCT FROM" in sql
+
+
+def test_sql_upsert_valida_familia_columnas_y_politica():
+    with pytest.raises(ValueError):
+        sql_upsert("lyrics_database", ("bpm",))
+    with pytest.raises(ValueError):
+        sql_upsert("song_tags", ("letra",))
+    with pytest.raises(ValueError):
+        sql_upsert("song_tags", ("bpm",), politicas={"bpm": "sumar"})
+
+
+def test_a_csv_usa_campos_vacios_para_null_y_literales_de_array():
+    filas = list(csv.reader(a_csv([(1, 120.0, None, 'rock, "pop"', ["hip hop", 'r"b'])])))
+    assert filas == [["1", "120.0", "", 'rock, "pop"', '{"hip hop","r\\"b"}']]
+    assert literal_array([]) == "{}"
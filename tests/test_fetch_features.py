@@ -0,0 +1,46 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip('pymongo')
+
+from obtain_metadata.get_features import fetch_features  # noqa: E402
+
+
+def _respuesta(json_data, status=200, headers=None):
+    response = MagicMock()
+    response.status_code = status
+    response.headers = headers or {}
+    response.json.return_value = json_data
+    return response
+
+
+def test_bulk_devuelve_primer_envio_por_mbid():
+    session = MagicMock()
+    session.get.return_value = _respuesta({
+        "a": {"0": {"highlevel": 1}, "1": {"highlevel": 2}},
+        "b": {"0": {"highlevel": 3}},
+        "mbid_mapping": {},
+    })
+    features = fetch_features.get_acousticbrainz_features_bulk(session, ["a", "b", "c"])
+    assert features == {"a": {"highlevel": 1}, "b": {"highlevel": 3}}
+    assert session.get.call_args.kwargs["params"] == {"recording_ids": "a;b;c"}
+
+
+def test_procesar_lote_deduplica_por_postgre_id(monkeypatch):
+    collection = MagicMock()
+    collection.find.return_value = [{"postgre_id": 1}]
+    llamadas = []
+
+    def bulk(session, mbids):
+        llamadas.append(mbids)
+        return {"m2": {"x": 1}}
+
+    monkeypatch.setattr(fetch_features, "get_acousticbrainz_features_bulk", bulk)
+    escritos = fetch_features.procesar_lote(MagicMock(), collection, [(1, "m1"), (2, "m2"), (3, "m3")])
+
+    assert collection.find.call_args.args[0] == {"postgre_id": {"$in": [1, 2, 3]}}
+    assert llamadas == [["m2", "m3"]]
+    assert escritos == 1
+    operaciones = collection.bulk_write.call_args.args[0]
+    assert operaciones[0]._filter == {"postgre_id": 2}
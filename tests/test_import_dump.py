@@ -0,0 +1,49 @@
+import io
+import json
+import tarfile
+from unittest.mock import MagicMock
+
+import pytest
+
+zstandard = pytest.importorskip('zstandard')
+pytest.importorskip('pymongo')
+
+from obtain_metadata.get_features import import_dump  # noqa: E402
+
+MBID_A = "0a1b2c3d-0000-0000-0000-00000000000a"
+MBID_B = "0a1b2c3d-0000-0000-0000-00000000000b"
+
+
+def _dump(tmp_path, nombre, miembros):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for ruta, contenido in miembros.items():
+            datos = json.dumps(contenido).encode()
+            info = tarfile.TarInfo(ruta)
+            info.size = len(datos)
+            tar.addfile(info, io.BytesIO(datos))
+    ruta = tmp_path / nombre
+    ruta.write_bytes(zstandard.ZstdCompressor().compress(buffer.getvalue()))
+    return str(ruta)
+
+
+def test_mbid_de_miembro():
+    assert import_dump.mbid_de_miembro(f"highlevel/0a/1b/{MBID_A.upper()}-0.json") == (MBID_A, 0)
+    assert import_dump.mbid_de_miembro("highlevel/README") is None
+    assert import_dump.mbid_de_miembro("x/abc-0.json") is None
+
+
+def test_importa_solo_el_catalogo_y_el_primer_envio(tmp_path):
+    ruta = _dump(tmp_path, "acousticbrainz-lowlevel-json-20220623-0.tar.zst", {
+        f"lowlevel/0a/{MBID_A}-0.json": {"bpm": 120},
+        f"lowlevel/0a/{MBID_A}-1.json": {"bpm": 999},
+        f"lowlevel/0a/{MBID_B}-0.json": {"bpm": 80},
+    })
+    mbids = {MBID_A: [1, 2]}
+    assert list(import_dump.leer_dump(ruta, mbids)) == [(MBID_A, {"bpm": 120})]
+
+    collection = MagicMock()
+    assert import_dump.importar(ruta, mbids, collection) == 2
+    operaciones = collection.bulk_write.call_args.args[0]
+    assert [op._filter for op in operaciones] == [{"postgre_id": 1}, {"postgre_id": 2}]
+    assert operaciones[0]._doc["$set"]["lowlevel"] == {"bpm": 120}
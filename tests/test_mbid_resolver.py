@@ -0,0 +1,74 @@
+from common.mbid_resolver import MbidResolver, consulta_individual, consulta_lote, emparejar
+
+
+class MockResp:
+    status_code = 200
+
+    def __init__(self, datos):
+        self.datos = datos
+
+    def raise_for_status(self):
+        return None
+
+    def json(self):
+        return self.datos
+
+
+def test_consultas_lucene_escapan_comillas_y_especiales():
+    assert consulta_lote('Guns "N" Roses', ["A", "B"]) == \
+        'artist:"Guns \\"N\\" Roses" AND (recording:"A" OR recording:"B")'
+    assert consulta_individual("AC/DC", "T.N.T!") == "artist:(AC\\/DC) AND recording:(T.N.T\\!)"
+
+
+def test_emparejar_usa_la_primera_coincidencia():
+    recordings = [
+        {"id": "1", "title": "Song A"},
+        {"id": "2", "title": "song a"},
+        {"id": "3", "title": "Otra"},
+    ]
+    assert emparejar(recordings, ["Song A", "Song B"]) == {"Song A": "1"}
+
+
+def test_resolver_lote_agrupa_titulos_y_cachea_negativos(monkeypatch):
+    consultas = []
+
+    def fake_get(url, params=None, **kwargs):
+        consultas.append(params["query"])
+        if " OR " in params["query"]:
+            return MockResp({"recordings": [{"id": "mbid-a", "title": "A"}, {"id": "mbid-b", "title": "B"}]})
+        return MockResp({"recordings": []})
+
+    monkeypatch.setattr('requests.get', fake_get)
+    resolver = MbidResolver(min_interval=0)
+    assert resolver.resolver_lote("Artista", ["A", "B", "C"]) == {"A": "mbid-a", "B": "mbid-b", "C": None}
+    # Una consulta para el lote y otra individual para el título que no apareció
+    assert len(consultas) == 2
+
+    # Todo sale de la caché, incluido el negativo
+    assert resolver.resolver_lote("ARTISTA", ["a", "C"]) == {"a": "mbid-a", "C": None}
+    assert resolver.resolver("Artista", "B") == "mbid-b"
+    assert resolver.peticiones == 2
+
+
+def test_resolver_lote_acota_las_busquedas_individuales(monkeypatch):
+    consultas = []
+
+    def fake_get(url, params=None, **kwargs):
+        consultas.append(params["query"])
+        if " OR " in params["query"]:
+            return MockResp({"recordings": [{"id": "mbid-a", "title": "A"}]})
+        return MockResp({"recordings": []})
+
+    monkeypatch.setattr('requests.get', fake_get)
+    resolver = MbidResolver(min_interval=0, batch_titles=10, max_fallback=2)
+    titulos = ["A"] + [f"T{i}" for i in range(8)]
+    resultado = resolver.resolver_lote("Artista", titulos)
+    assert resultado["A"] == "mbid-a"
+    # Una consulta de lote y solo dos individuales, no una por cada fallo
+    assert len(consultas) == 3
+    assert all(resultado[t] is None for t in titulos[1:])
+    # Solo los buscados uno a uno se guardan como negativos; el resto sigue pendiente
+    assert resolver.resolver_lote("Artista", titulos[1:3]) == {"T0": None, "T1": None}
+    assert len(consultas) == 3
+    resolver.resolver_lote("Artista", titulos[3:])
+    assert len(consultas) == 4 + 2
@@ -0,0 +1,119 @@
+import pytest
+
+from common.migrations import MIGRACIONES, Migracion, migrar, pendientes
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.sentencias.append(sql.strip())
+        self.conn.ultimo_param = params[0] if params else None
+
+    def fetchall(self):
+        return [(v,) for v in self.conn.aplicadas]
+
+    def fetchone(self):
+        # to_regclass: solo existen las tablas de conn.tablas
+        tabla = self.conn.ultimo_param
+        return (tabla if tabla in self.conn.tablas else None,)
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, aplicadas=(), tablas=()):
+        self.aplicadas = list(aplicadas)
+        self.tablas = set(tablas)
+        self.ultimo_param = None
+        self.sentencias = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.autocommit = True
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_versiones_unicas_y_crecientes():
+    versiones = [m.version for m in MIGRACIONES]
+    assert versiones == sorted(set(versiones))
+
+
+def test_pendientes_en_orden_y_sin_repetidas():
+    migraciones = [Migracion(3, "c", sql="C"), Migracion(1, "a", sql="A"), Migracion(2, "b", sql="B")]
+    assert [m.version for m in pendientes({2}, migraciones)] == [1, 3]
+    with pytest.raises(ValueError):
+        pendientes(set(), migraciones + [Migracion(1, "otra", sql="X")])
+
+
+def test_migrar_aplica_solo_las_pendientes_y_suelta_el_lock():
+    conn = FakeConn(aplicadas=[1])
+    migraciones = [Migracion(1, "a", sql="SELECT 'a'"), Migracion(2, "b", sql="SELECT 'b'")]
+    assert migrar(conn, migraciones) == [2]
+    assert "SELECT 'a'" not in conn.sentencias
+    assert "SELECT 'b'" in conn.sentencias
+    assert conn.sentencias[-1].startswith("SELECT pg_advisory_unlock")
+    assert conn.autocommit is True
+
+
+def test_migrar_sin_statement_timeout():
+    conn = FakeConn()
+    migrar(conn, [Migracion(1, "a", sql="SELECT 'a'"), Migracion(2, "b", sql="SELECT 'b'")])
+    sentencias = conn.sentencias
+    # Antes del lock y de cada migración, porque cada commit termina el SET LOCAL
+    assert sentencias[0] == "SET LOCAL statement_timeout = 0;"
+    for sql in ("SELECT 'a'", "SELECT 'b'"):
+        assert sentencias[sentencias.index(sql) - 1] == "SET LOCAL statement_timeout = 0;"
+
+
+def test_migrar_hace_rollback_si_falla():
+    def romper(cur):
+        raise RuntimeError("fallo")
+
+    conn = FakeConn()
+    with pytest.raises(RuntimeError):
+        migrar(conn, [Migracion(1, "rota", funcion=romper)])
+    assert conn.rollbacks == 1
+    assert conn.sentencias[-1].startswith("SELECT pg_advisory_unlock")
+
+
+def test_migrar_deja_pendiente_si_falta_la_tabla_requerida():
+    migraciones = [Migracion(1, "a", sql="SELECT 'a'", requiere="lyrics_database"),
+                   Migracion(2, "b", sql="SELECT 'b'")]
+    conn = FakeConn()
+    assert migrar(conn, migraciones) == [2]
+    assert "SELECT 'a'" not in conn.sentencias
+
+    conn = FakeConn(aplicadas=[2], tablas=["lyrics_database"])
+    assert migrar(conn, migraciones) == [1]
+
+
+def test_esquema_no_depende_de_vector_storage(monkeypatch):
+    sentencias = {}
+    for storage in ("bytea", "vector"):
+        monkeypatch.setenv("VECTOR_STORAGE", storage)
+        conn = FakeConn(tablas=["lyrics_database"])
+        migrar(conn)
+        sentencias[storage] = conn.sentencias
+    assert sentencias["bytea"] == sentencias["vector"]
+
+
+def test_columnas_movidas_se_borran_despues_de_copiarse():
+    from common.migrations import SIN_COLUMNAS_MOVIDAS_SQL
+
+    versiones = {m.nombre: m.version for m in MIGRACIONES}
+    assert versiones["feature_store_desde_columnas"] < versiones["song_vectors"] \
+        < versiones["lyrics_database_sin_columnas_movidas"]
+    assert "DROP COLUMN IF EXISTS letra_vec32" in SIN_COLUMNAS_MOVIDAS_SQL
+    assert "DROP COLUMN IF EXISTS bpm" in SIN_COLUMNAS_MOVIDAS_SQL
+    # El formato antiguo aún lo convierte vectors/convert_storage
+    assert "letra_vec," not in SIN_COLUMNAS_MOVIDAS_SQL and "track_vector" not in SIN_COLUMNAS_MOVIDAS_SQL
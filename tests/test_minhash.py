@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from common.minhash import (  # noqa: E402
+    _fusionar, buckets, filtro_no_duplicadas, firmas, limpiar_letra, shingles, similitud,
+)
+
+LETRA = """I walked along the empty road tonight
+thinking of the words you never said
+the city lights were fading out of sight
+and every song was playing in my head"""
+
+
+def test_shingles_son_estables_y_sin_repetir():
+    a = shingles("la la la la")
+    assert a.tolist() == shingles("la la la la").tolist()
+    assert len(a) == 1
+    assert shingles("").size == 0
+    # Textos más cortos que el shingle cuentan como un shingle
+    assert shingles("hola").size == 1
+
+
+def test_firmas_estiman_la_similitud():
+    directo = LETRA + "\n(applause) thank you"
+    otra = "a completely different song about summer and the sea and the sun"
+    fs = firmas([limpiar_letra(LETRA), limpiar_letra(directo), limpiar_letra(otra), ""])
+    assert fs.shape == (4, 128)
+    assert similitud(fs[0], fs[1]) > 0.6
+    assert similitud(fs[0], fs[2]) < 0.1
+    assert (fs[3] == 0xFFFFFFFF).all()
+
+
+def test_limpiar_letra_quita_el_pie():
+    assert limpiar_letra("Hola, Mundo!____Lyrics by Genius") == "hola mundo"
+    assert limpiar_letra(None) == ""
+
+
+def test_buckets_iguales_para_firmas_iguales():
+    fs = firmas(["uno dos tres cuatro", "uno dos tres cuatro", "cinco seis siete ocho"])
+    bks = buckets(fs, 16)
+    assert bks.shape == (3, 16) and bks.dtype == np.int64
+    assert (bks[0] == bks[1]).all()
+    assert not (bks[0] == bks[2]).any()
+    with pytest.raises(ValueError):
+        buckets(fs, 7)
+
+
+def test_fusionar_une_con_clusters_existentes():
+    # 10 y 11 ya están en el cluster 10; 4 lo estaba en el 4
+    existentes = {10: 10, 11: 10, 4: 4}
+    cambios = _fusionar(existentes, [20, 21, 22], [(20, 11), (21, 20), (20, 4)])
+    # La canción 20 une ambos clusters: el 10 pasa a 4
+    assert cambios == {20: 4, 21: 4, 22: 22, 10: 4}
+
+
+def test_filtro_no_duplicadas():
+    assert "lc.song_id = l.id" in filtro_no_duplicadas("l.id")
+    # Con miembros, la referencia es el menor id del cluster que cumple la condición
+    filtro = filtro_no_duplicadas("l.id", "o.song_id <> 4")
+    assert "o.song_id < l.id AND o.song_id <> 4" in filtro
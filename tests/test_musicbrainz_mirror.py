@@ -0,0 +1,66 @@
+from common.musicbrainz_mirror import MusicBrainzMirror, filas_indice
+
+
+def test_filas_indice_normaliza_y_descarta_vacios():
+    rows = [
+        ("Beyoncé", "Halo (Live)", "gid-1", 1),
+        ("", "Sin artista", "gid-2", 2),
+        ("Artista", "¿?", "gid-3", 3),
+    ]
+    assert list(filas_indice(rows)) == [("beyonce", "halo live", "gid-1", 1)]
+
+
+class FakeCursor:
+    def __init__(self, respuestas):
+        self.respuestas = respuestas
+        self.consultas = []
+
+    def execute(self, sql, params=None):
+        self.consultas.append((sql, params))
+
+    def fetchall(self):
+        return self.respuestas.pop(0)
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self, cursor):
+        self.cur = cursor
+
+    def get_connection(self):
+        db = self
+
+        class Ctx:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def cursor(self):
+                return db.cur
+
+        return Ctx()
+
+
+def test_resolver_exactos_y_luego_aproximados():
+    # Primera consulta: coincidencias exactas; segunda: trigramas para las que faltan
+    cur = FakeCursor([[(0, "mbid-0")], [(2, "mbid-2")]])
+    mirror = MusicBrainzMirror(FakeDB(cur), similarity=0.5)
+    resultado = mirror.resolver([("A", "Uno"), ("", "Sin artista"), ("A", "Tres")])
+    assert resultado == ["mbid-0", None, "mbid-2"]
+    # Los pares sin artista no se consultan; a la aproximada solo va el que faltaba
+    assert cur.consultas[0][1] == ([0, 2], ["a", "a"], ["uno", "tres"])
+    assert cur.consultas[-1][1] == ([2], ["a"], ["tres"])
+
+
+def test_resolver_sin_similitud_no_busca_aproximados():
+    cur = FakeCursor([[]])
+    mirror = MusicBrainzMirror(FakeDB(cur), similarity=0)
+    assert mirror.resolver([("A", "Uno")]) == [None]
+    assert len(cur.consultas) == 1
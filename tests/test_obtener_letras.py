@@ -3,8 +3,8 @@ import importlib
 
 def test_obtener_mbid_en_musicbrainz(monkeypatch):
     """Test obtener_mbid_en_musicbrainz with mocked requests."""
-    import pytest
-    from extract_data.lyrics.obtener_letras.obtener_letras import obtener_mbid_en_musicbrainz
+    from common.mbid_resolver import MbidResolver
+    from extract_data.lyrics.obtener_letras import obtener_letras
 
     class MockResp:
         status_code = 200
@@ -13,8 +13,19 @@ def test_obtener_mbid_en_musicbrainz(monkeypatch):
             return None
 
         def json(self):
-            return {'recordings': [{'id': 'mbid-123'}]}
+            return {'recordings': [{'id': 'mbid-123', 'title': 'Song'}]}
 
-    monkeypatch.setattr('requests.get', lambda *args, **kwargs: MockResp())
-    mbid = obtener_mbid_en_musicbrainz('Artist', 'Song')
-    assert mbid == 'mbid-123'
+    llamadas = []
+
+    def fake_get(*args, **kwargs):
+        llamadas.append(kwargs['params']['query'])
+        return MockResp()
+
+    # Resolvedor con la caché en memoria: no necesita Postgres
+    monkeypatch.setattr(obtener_letras, '_mbid_resolver', MbidResolver(min_interval=0))
+    monkeypatch.setattr('requests.get', fake_get)
+    assert obtener_letras.obtener_mbid_en_musicbrainz('Artist', 'Song') == 'mbid-123'
+    assert llamadas == ['artist:(Artist) AND recording:(Song)']
+    # La segunda vez sale de la caché
+    assert obtener_letras.obtener_mbid_en_musicbrainz('ARTIST', 'song') == 'mbid-123'
+    assert len(llamadas) == 1
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('pymongo')
+
+from datetime import datetime  # noqa: E402
+
+from obtain_metadata.mongo_to_postgres.parse_features_to_postgres import (  # noqa: E402
+    LAG_SECONDS, extraer_fila, fila_tags, filtro_desde,
+)
+
+
+def test_extraer_fila_separa_bpm_y_genero():
+    doc = {"postgre_id": 7, "features": {"metadata": {"tags": {
+        "bpm": ["124"], "initialkey": ["Am"], "genre": ["House", "Electronic"],
+    }}}}
+    assert extraer_fila(doc) == (7, 124.0, "Am", "House, Electronic")
+
+
+def test_extraer_fila_sin_etiquetas_o_bpm_invalido():
+    assert extraer_fila({"postgre_id": 1}) == (1, None, None, None)
+    doc = {"postgre_id": 2, "features": {"metadata": {"tags": {"bpm": ["n/a"], "genre": []}}}}
+    assert extraer_fila(doc) == (2, None, None, None)
+
+
+def test_fila_tags_anade_camelot_y_generos():
+    assert fila_tags((7, 124.0, "Am", "House, Electronic")) == (7, 124.0, "Am", "8A", "House, Electronic",
+                                                               ["house", "electronic"])
+    assert fila_tags((1, None, None, None)) == (1, None, None, None, None, None)
+
+
+def test_filtro_desde_reanuda_por_updated_at():
+    filtro = filtro_desde("2024-05-01T10:00:00")
+    desde = filtro["updated_at"]["$gte"]
+    assert (datetime(2024, 5, 1, 10) - desde).total_seconds() == LAG_SECONDS
+    # Sin marca o con un _id de versiones anteriores se proyecta todo
+    assert filtro_desde(None) == {"postgre_id": {"$exists": True}}
+    assert filtro_desde("65f1c0a2e4b0a1b2c3d4e5f6") == {"postgre_id": {"$exists": True}}
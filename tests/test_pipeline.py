@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+from common.pipeline import ejecutar_pipeline
+
+
+def test_procesa_todo_en_el_hilo_llamante():
+    hilo_principal = threading.get_ident()
+    vistos = []
+
+    def procesar(resultado):
+        assert threading.get_ident() == hilo_principal
+        vistos.append(resultado.valor)
+
+    procesados = ejecutar_pipeline(range(20), lambda x: x * 2, procesar, workers=3, queue_size=2)
+    assert procesados == 20
+    assert sorted(vistos) == [x * 2 for x in range(20)]
+
+
+def test_errores_llegan_como_resultado():
+    def preparar(x):
+        if x == 3:
+            raise ValueError("fallo")
+        return x
+
+    errores = []
+    ejecutar_pipeline(range(5), preparar, lambda r: r.error and errores.append(r.tarea), workers=2)
+    assert errores == [3]
+
+
+def test_descargas_en_paralelo():
+    activos, maximo = 0, 0
+    lock = threading.Lock()
+
+    def preparar(x):
+        nonlocal activos, maximo
+        with lock:
+            activos += 1
+            maximo = max(maximo, activos)
+        time.sleep(0.02)
+        with lock:
+            activos -= 1
+        return x
+
+    ejecutar_pipeline(range(12), preparar, lambda r: None, workers=4, queue_size=4)
+    assert maximo > 1
+
+
+def test_fallo_al_procesar_no_bloquea():
+    def procesar(resultado):
+        raise RuntimeError("fallo de base de datos")
+
+    with pytest.raises(RuntimeError):
+        ejecutar_pipeline(range(100), lambda x: x, procesar, workers=2, queue_size=1)
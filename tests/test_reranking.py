@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'streamlit', 'app'))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from reranking import cluster_de, colapsar_por_cluster, mmr  # noqa: E402
+
+
+def test_mmr_solo_relevancia_ordena_por_score():
+    vectores = np.eye(3)
+    assert mmr([0.2, 0.9, 0.5], vectores, k=3, lambda_=1.0) == [1, 2, 0]
+
+
+def test_mmr_penaliza_duplicados():
+    # Los candidatos 0 y 1 son casi idénticos; el 2 es distinto pero algo menos relevante
+    vectores = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]])
+    assert mmr([0.9, 0.89, 0.7], vectores, k=2, lambda_=0.5) == [0, 2]
+
+
+def test_mmr_sin_candidatos():
+    assert mmr([], np.empty((0, 2)), k=5) == []
+
+
+def test_colapsar_por_cluster_deja_el_primero():
+    items = [(5, {"lyric_cluster_id": 2}), (7, {}), (2, {"lyric_cluster_id": 2}), (9, None)]
+    colapsados = colapsar_por_cluster(items, lambda x: cluster_de(*x))
+    assert [song_id for song_id, _ in colapsados] == [5, 7, 9]
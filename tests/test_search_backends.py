@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('qdrant_client')
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'streamlit', 'app'))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+from search_backends import LocalBackend, medir_recall, top_k_exacto  # noqa: E402
+from search_filters import parsear_filtros  # noqa: E402
+
+
+def _payloads():
+    return [
+        {"artist": "A", "title": "uno", "bpm": 120.0, "key": "C major", "camelot": "8B", "genres": ["rock"]},
+        {"artist": "B", "title": "dos", "bpm": 90.0, "key": "Am", "camelot": "8A", "genres": ["pop", "rock"]},
+        {"artist": "C", "title": "tres", "bpm": None, "key": "H dorian", "camelot": None, "genres": []},
+        {"artist": "D", "title": "cuatro", "bpm": 122.0, "key": "G major", "camelot": "9B", "genres": ["jazz"]},
+    ]
+
+
+@pytest.fixture
+def backend():
+    vectores = np.array([[1, 0], [0.9, 0.1], [0, 1], [0.7, 0.7]], dtype=np.float32)
+    return LocalBackend([10, 11, 12, 13], {"lyrics_vector": vectores, "track_vector": vectores}, _payloads())
+
+
+def test_top_k_exacto_coincide_con_argsort_por_bloques():
+    rng = np.random.default_rng(0)
+    matriz = rng.normal(size=(1000, 16)).astype(np.float32)
+    consultas = rng.normal(size=(5, 16)).astype(np.float32)
+    filas, scores = top_k_exacto(matriz, consultas, k=7, block_size=128)
+    esperado = np.argsort(-(consultas @ matriz.T), axis=1)[:, :7]
+    assert np.array_equal(filas, esperado)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+
+def test_top_k_exacto_respeta_mascara():
+    matriz = np.eye(4, dtype=np.float32)
+    mascara = np.array([False, True, False, True])
+    filas, scores = top_k_exacto(matriz, np.ones((1, 4), dtype=np.float32), k=4, mascara=mascara)
+    assert set(filas[0][np.isfinite(scores[0])]) == {1, 3}
+
+
+def test_search_devuelve_coseno_ordenado(backend):
+    hits = backend.search("lyrics_vector", [1, 0], limit=2, with_payload=["title"])
+    assert [h.id for h in hits] == [10, 11]
+    assert hits[0].score == pytest.approx(1.0)
+    assert hits[0].payload == {"title": "uno"}
+
+
+def test_search_con_filtros(backend):
+    filtros = parsear_filtros({"genre": "rock", "bpm": 120, "bpm_tolerance": 5})
+    assert [h.id for h in backend.search("lyrics_vector", [0, 1], limit=4, filtros=filtros)] == [10]
+
+    filtros = parsear_filtros({"key": "C major", "compatible_keys": True})
+    ids = {h.id for h in backend.search("lyrics_vector", [1, 0], limit=4, filtros=filtros)}
+    assert ids == {10, 11, 13}
+
+    filtros = parsear_filtros({"key": "H dorian"})
+    assert [h.id for h in backend.search("lyrics_vector", [1, 0], limit=4, filtros=filtros)] == [12]
+
+
+def test_referencia_y_payload(backend):
+    ref = backend.find_reference("D", "cuatro")
+    assert ref.id == 13
+    assert len(ref.vector["track_vector"]) == 2
+    assert backend.find_reference("X", "nada") is None
+    assert backend.get_payload(11, ["artist", "lyric"]) == {"artist": "B"}
+
+
+def test_desde_npy_y_recall(tmp_path, backend):
+    vectores = np.random.default_rng(1).normal(size=(50, 8)).astype(np.float32)
+    np.save(tmp_path / "ids.npy", np.arange(50, dtype=np.int64))
+    np.save(tmp_path / "lyrics_vector.npy", vectores)
+    with open(tmp_path / "payload.jsonl", "w", encoding="utf-8") as f:
+        for i in range(50):
+            f.write(json.dumps({"artist": str(i), "title": "t"}) + "\n")
+
+    cargado = LocalBackend.desde_npy(str(tmp_path))
+    hits = cargado.search("lyrics_vector", vectores[7], limit=1)
+    assert hits[0].id == 7
+    assert medir_recall(cargado, cargado, "lyrics_vector", vectores[:5], k=5) == 1.0
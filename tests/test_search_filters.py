@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+from common.music_metadata import a_camelot, normalizar_generos, tonalidades_compatibles
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'streamlit', 'app'))
+
+
+@pytest.mark.parametrize('tonalidad, esperado', [
+    ('C major', '8B'),
+    ('C', '8B'),
+    ('A minor', '8A'),
+    ('Am', '8A'),
+    ('F#m', '11A'),
+    ('Bbm', '3A'),
+    ('Eb', '5B'),
+    ('F', '7B'),
+    ('8a', '8A'),
+    ('12B', '12B'),
+])
+def test_a_camelot(tonalidad, esperado):
+    assert a_camelot(tonalidad) == esperado
+
+
+def test_a_camelot_desconocida():
+    assert a_camelot('H dorian') is None
+    assert a_camelot(None) is None
+
+
+def test_tonalidades_compatibles_rueda():
+    assert tonalidades_compatibles('A minor') == ['8A', '8B', '7A', '9A']
+    # La rueda da la vuelta entre 12 y 1
+    assert tonalidades_compatibles('1B') == ['1B', '1A', '12B', '2B']
+
+
+def test_normalizar_generos():
+    assert normalizar_generos(['Rock', 'rock', 'Pop']) == ['rock', 'pop']
+    assert normalizar_generos('{Rock,"Hip Hop"}') == ['rock', 'hip hop']
+    assert normalizar_generos('rock, electronic') == ['rock', 'electronic']
+    assert normalizar_generos(None) == []
+
+
+@pytest.fixture
+def search_filters():
+    pytest.importorskip('qdrant_client')
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    import search_filters
+    return search_filters
+
+
+def test_construir_filtro_vacio(search_filters):
+    assert search_filters.construir_filtro({'query': 'x'}) is None
+
+
+def test_construir_filtro_bpm_con_tolerancia(search_filters):
+    filtro = search_filters.construir_filtro({'bpm': 120, 'bpm_tolerance': 5})
+    rango = filtro.must[0].range
+    assert (rango.gte, rango.lte) == (115.0, 125.0)
+
+
+def test_construir_filtro_tonalidad_y_generos(search_filters):
+    filtro = search_filters.construir_filtro({'key': 'Am', 'compatible_keys': True, 'genre': 'rock, pop'})
+    por_campo = {c.key: c.match for c in filtro.must}
+    assert por_campo['genres'].any == ['rock', 'pop']
+    assert set(por_campo['camelot'].any) == {'8A', '8B', '7A', '9A'}
@@ -0,0 +1,74 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from common.snapshot import HEADER_SIZE, abrir_snapshot, anadir_filas, ids_exportados  # noqa: E402
+
+
+def _lote(ids, dim=4):
+    vectores = np.array([[i] * dim for i in ids], dtype=np.float32)
+    return ids, {"lyrics_vector": vectores, "track_vector": vectores[:, :2]}, [{"title": str(i)} for i in ids]
+
+
+def test_anadir_y_abrir_incremental(tmp_path):
+    assert ids_exportados(str(tmp_path)).tolist() == []
+    anadir_filas(str(tmp_path), *_lote([1, 2, 5]))
+    total = anadir_filas(str(tmp_path), *_lote([7, 9]))
+    assert total == 5
+    assert ids_exportados(str(tmp_path)).tolist() == [1, 2, 5, 7, 9]
+
+    snapshot = abrir_snapshot(str(tmp_path))
+    assert isinstance(snapshot.ids, np.memmap)
+    assert snapshot.ids.tolist() == [1, 2, 5, 7, 9]
+    assert snapshot.vectores["lyrics_vector"].shape == (5, 4)
+    assert snapshot.vectores["track_vector"][3].tolist() == [7.0, 7.0]
+    assert snapshot.fila(7) == 3
+    assert snapshot.fila(3) is None
+    assert [p["title"] for p in snapshot.payloads()] == ["1", "2", "5", "7", "9"]
+    # Compatible con np.load sin el manifiesto
+    assert np.load(tmp_path / "lyrics_vector.npy").shape == (5, 4)
+
+
+def test_append_interrumpido_se_descarta(tmp_path):
+    anadir_filas(str(tmp_path), *_lote([1, 2]))
+    # Simula un append que escribió datos pero no llegó a confirmar el manifiesto
+    with open(tmp_path / "lyrics_vector.npy", "ab") as f:
+        f.write(b"\0" * 16)
+    with open(tmp_path / "payload.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"title": "basura"}\n')
+
+    anadir_filas(str(tmp_path), *_lote([3]))
+    snapshot = abrir_snapshot(str(tmp_path))
+    assert snapshot.vectores["lyrics_vector"][:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert [p["title"] for p in snapshot.payloads()] == ["1", "2", "3"]
+    assert (tmp_path / "lyrics_vector.npy").stat().st_size == HEADER_SIZE + 3 * 4 * 4
+
+
+def test_ids_fuera_de_orden(tmp_path):
+    # La canción 4 termina de vectorizarse después de que se exportara la 9
+    anadir_filas(str(tmp_path), *_lote([5, 9]))
+    anadir_filas(str(tmp_path), *_lote([4, 2]))
+    assert ids_exportados(str(tmp_path)).tolist() == [2, 4, 5, 9]
+
+    snapshot = abrir_snapshot(str(tmp_path))
+    assert snapshot.ids.tolist() == [5, 9, 4, 2]
+    assert snapshot.fila(4) == 2
+    assert snapshot.fila(9) == 1
+    assert snapshot.fila(3) is None
+    assert snapshot.vectores["lyrics_vector"][snapshot.fila(2), 0] == 2.0
+
+
+def test_ids_repetidos(tmp_path):
+    anadir_filas(str(tmp_path), *_lote([5]))
+    with pytest.raises(ValueError):
+        anadir_filas(str(tmp_path), *_lote([5]))
+    with pytest.raises(ValueError):
+        anadir_filas(str(tmp_path), *_lote([6, 6]))
+
+
+def test_atributos_distintos_se_rechazan(tmp_path):
+    anadir_filas(str(tmp_path), *_lote([1]), atributos={"track_pooling": "mean"})
+    anadir_filas(str(tmp_path), *_lote([2]), atributos={"track_pooling": "mean"})
+    with pytest.raises(ValueError):
+        anadir_filas(str(tmp_path), *_lote([3]), atributos={"track_pooling": "mean_std"})
+    assert ids_exportados(str(tmp_path)).tolist() == [1, 2]
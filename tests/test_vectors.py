@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from common.vectors import from_bytes, pool_embeddings, to_bytes  # noqa: E402
+
+
+def test_roundtrip_bytes_float32():
+    vector = np.array([0.5, -1.25, 3.0], dtype=np.float64)
+    data = to_bytes(vector)
+    assert len(data) == 3 * 4
+    decoded = from_bytes(memoryview(data))
+    assert decoded.dtype == np.float32
+    assert np.array_equal(decoded, vector.astype(np.float32))
+
+
+def test_pool_mean_y_mean_std():
+    frames = [[1.0, 2.0], [3.0, 4.0]]
+    assert np.allclose(pool_embeddings(frames, 'mean'), [2.0, 3.0])
+    pooled = pool_embeddings(frames, 'mean_std')
+    assert pooled.shape == (4,)
+    assert np.allclose(pooled, [2.0, 3.0, 1.0, 1.0])
+
+
+def test_pool_attention_resta_peso_a_ventanas_atipicas():
+    frames = np.array([[1.0, 0.0]] * 5 + [[-1.0, 0.0]])
+    media = pool_embeddings(frames, 'mean')
+    atencion = pool_embeddings(frames, 'attention')
+    assert atencion[0] > media[0]
+
+
+def test_pool_modo_desconocido():
+    with pytest.raises(ValueError):
+        pool_embeddings([[1.0]], 'max')
+
+
+def test_vector_storage_bytea_y_pgvector():
+    from common.vectors import VectorStorage
+
+    bytea = VectorStorage('bytea')
+    assert bytea.column_type() == 'BYTEA'
+    assert bytea.placeholder() == '%s'
+    assert np.allclose(bytea.decode(to_bytes([1.0, 2.0])), [1.0, 2.0])
+
+    halfvec = VectorStorage('halfvec')
+    assert halfvec.placeholder() == '%s::halfvec'
+    literal = halfvec.encode(np.array([0.5, -2.0]))
+    assert literal == '[0.5,-2.0]'
+    assert np.allclose(halfvec.decode(literal), [0.5, -2.0])
+
+    # float8[] antiguos llegan como listas de Python
+    assert halfvec.decode([1.0, 2.0]).dtype == np.float32
+
+    with pytest.raises(ValueError):
+        VectorStorage('json')
+
+
+def test_track_pooling_configurado(monkeypatch):
+    from common.vectors import filtro_pooling, get_track_pooling
+
+    monkeypatch.setenv('TRACK_POOLING', 'mean_std')
+    assert get_track_pooling() == 'mean_std'
+    # Las filas sin modo guardado son de mean
+    assert filtro_pooling('mean') == "COALESCE(v.track_pooling, 'mean') = 'mean'"
+    monkeypatch.setenv('TRACK_POOLING', 'max')
+    with pytest.raises(ValueError):
+        get_track_pooling()
+    with pytest.raises(ValueError):
+        filtro_pooling("mean'; DROP TABLE x; --")
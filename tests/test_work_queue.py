@@ -0,0 +1,102 @@
+"""
+Integration tests for the Postgres work queue (claims, leases and quarantine).
+Skipped when there is no database available.
+"""
+import pytest
+
+from common.config import config
+from common.db import DatabaseManager
+from common.migrations import aplicar_migraciones
+from common.work_queue import WorkQueue
+
+TASK = 'test_work_queue'
+
+
+@pytest.fixture
+def db_manager():
+    manager = DatabaseManager(config.database_url, min_conn=1, max_conn=4)
+    try:
+        with manager.get_connection() as conn:
+            conn.cursor().execute("SELECT 1")
+    except Exception as e:
+        pytest.skip(f"Postgres no disponible: {e}")
+    aplicar_migraciones(manager)
+    yield manager
+    with manager.get_connection() as conn:
+        conn.cursor().execute("DELETE FROM work_queue WHERE task_type = %s", (TASK,))
+    manager.close()
+
+
+def _cola(db_manager, worker, **kwargs):
+    return WorkQueue(db_manager, TASK, worker_id=worker, retry_delay_seconds=0, **kwargs)
+
+
+def test_replicas_no_reclaman_lo_mismo(db_manager):
+    a, b = _cola(db_manager, 'a'), _cola(db_manager, 'b')
+    assert a.encolar("SELECT generate_series(1, 10) AS id") == 10
+    assert a.encolar("SELECT generate_series(1, 10) AS id") == 0
+
+    lote_a, lote_b = a.reclamar(4), b.reclamar(4)
+    assert len(lote_a) == len(lote_b) == 4
+    assert not set(lote_a) & set(lote_b)
+
+    a.completar(lote_a)
+    assert a.resumen() == {'done': 4, 'claimed': 4, 'pending': 2}
+
+
+def test_lease_caducado_vuelve_a_la_cola(db_manager):
+    muerto = _cola(db_manager, 'muerto', lease_seconds=0)
+    muerto.encolar("SELECT 1 AS id")
+    assert muerto.reclamar(1) == [1]
+    assert _cola(db_manager, 'vivo').reclamar(1) == [1]
+
+
+def test_fallos_repetidos_van_a_cuarentena(db_manager):
+    cola = _cola(db_manager, 'a', max_attempts=2)
+    cola.encolar("SELECT 7 AS id")
+    for _ in range(2):
+        assert cola.reclamar(1) == [7]
+        cola.fallar(7, 'boom')
+    assert cola.reclamar(1) == []
+    assert cola.resumen() == {'failed': 1}
+    assert cola.reintentar_cuarentena() == 1
+    assert cola.reclamar(1) == [7]
+
+
+def test_encolar_reabre_los_terminados(db_manager):
+    cola = _cola(db_manager, 'a')
+    cola.encolar("SELECT 3 AS id")
+    cola.completar(cola.reclamar(1))
+    assert cola.resumen() == {'done': 1}
+    # El trabajo vuelve a hacer falta (p. ej. se borró el vector para recalcularlo)
+    assert cola.encolar("SELECT 3 AS id") == 1
+    assert cola.reclamar(1) == [3]
+    assert cola.encolar("SELECT 3 AS id") == 0
+
+
+def test_worker_con_lease_caducado_no_pisa_al_nuevo(db_manager):
+    muerto = _cola(db_manager, 'muerto', lease_seconds=0)
+    vivo = _cola(db_manager, 'vivo')
+    muerto.encolar("SELECT 5 AS id")
+    assert muerto.reclamar(1) == [5]
+    assert vivo.reclamar(1) == [5]
+    muerto.completar([5])
+    muerto.fallar(5, 'tarde')
+    assert vivo.resumen() == {'claimed': 1}
+    vivo.completar([5])
+    assert vivo.resumen() == {'done': 1}
+
+
+def test_mantener_leases_renueva_lo_que_sigue_en_proceso(monkeypatch):
+    cola = WorkQueue(None, TASK, lease_seconds=30, worker_id='a')
+    renovados = []
+    monkeypatch.setattr(cola, 'renovar', renovados.append)
+    cola._en_proceso.update({1, 2})
+    cola.mantener_leases()
+    # Aún no ha pasado un tercio del lease
+    assert renovados == []
+    cola._ultima_renovacion -= 11
+    cola.mantener_leases()
+    assert sorted(renovados[0]) == [1, 2]
+    cola.mantener_leases()
+    assert len(renovados) == 1
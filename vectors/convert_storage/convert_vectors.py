@@ -0,0 +1,153 @@
+"""Conversión única de los vectores antiguos al formato compacto.
+
+- lyrics_database.letra_vec (float8[])             -> song_vectors.letra_vec32 (float32)
+- lyrics_database.track_vector (JSONB por ventana) -> song_vectors.track_vec_pooled (float32 agregado)
+
+El formato destino lo decide VECTOR_STORAGE (bytea por defecto, o pgvector).
+Las migraciones crean las columnas compactas como BYTEA; si VECTOR_STORAGE pide
+otro tipo, antes de convertir se cambia el tipo de esas columnas reescribiendo
+sus valores por lotes.
+
+Con CONVERT_DROP_LEGACY=true se vacían las columnas antiguas al convertir; el
+espacio se recupera después con VACUUM FULL lyrics_database.
+"""
+import os
+from typing import Optional
+
+from common.logging import setup_logging
+from common.db import bulk_insert, create_db_manager
+from common.feature_store import ACTUALIZAR, guardar as guardar_features
+from common.migrations import aplicar_migraciones
+from common.vectors import VectorStorage, filtro_pooling, get_track_pooling, get_vector_storage, pool_embeddings
+
+logger = setup_logging()
+db_manager = create_db_manager("convert_vectors", max_conn=2)
+vector_storage = get_vector_storage()
+
+BATCH_SIZE = int(os.getenv('CONVERT_BATCH_SIZE', '1000'))
+TRACK_POOLING = get_track_pooling()
+DROP_LEGACY = os.getenv('CONVERT_DROP_LEGACY', 'false').lower() in ('1', 'true', 'yes')
+
+# Un vector de audio compacto de otro modo se vuelve a agregar desde las ventanas
+TRACK_PENDIENTE = f"(v.track_vec_pooled IS NULL OR NOT {filtro_pooling(TRACK_POOLING)})"
+PENDING_FILTER = (
+    "((v.letra_vec32 IS NULL AND l.letra_vec IS NOT NULL) "
+    f"OR ({TRACK_PENDIENTE} AND l.track_vector IS NOT NULL))"
+)
+
+
+COMPACT_COLUMNS = ('letra_vec32', 'track_vec_pooled')
+
+
+def tipo_columna(columna: str) -> Optional[str]:
+    """Tipo actual (bytea, vector, halfvec) de una columna de song_vectors."""
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT udt_name FROM information_schema.columns
+            WHERE table_name = 'song_vectors' AND column_name = %s;
+        """, (columna,))
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else None
+
+
+def cambiar_tipo_columna(columna: str, destino: VectorStorage):
+    """Pasa una columna compacta al tipo de `destino` (no hay cast de bytea a pgvector)."""
+    nueva = f"{columna}_conv"
+    tipo = destino.column_type()
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"ALTER TABLE song_vectors ADD COLUMN IF NOT EXISTS {nueva} {tipo};")
+        cur.close()
+
+    last_id = 0
+    while True:
+        with db_manager.get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                SELECT song_id, {columna} FROM song_vectors
+                WHERE {columna} IS NOT NULL AND {nueva} IS NULL AND song_id > %s
+                ORDER BY song_id LIMIT %s;
+            """, (last_id, BATCH_SIZE))
+            rows = cur.fetchall()
+            if rows:
+                # decode entiende tanto bytea como el literal de pgvector
+                bulk_insert(cur, f"""
+                    UPDATE song_vectors AS t SET {nueva} = v.valor
+                    FROM (VALUES %s) AS v (id, valor) WHERE t.song_id = v.id
+                """, [(id_, destino.encode(destino.decode(valor))) for id_, valor in rows],
+                    template=f"(%s, %s::{tipo})")
+            cur.close()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"ALTER TABLE song_vectors DROP COLUMN {columna};")
+        cur.execute(f"ALTER TABLE song_vectors RENAME COLUMN {nueva} TO {columna};")
+        cur.close()
+    logger.info(f"Columna {columna} convertida a {tipo}")
+
+
+def convertir_lote(last_id: int):
+    """Convierte un lote por keyset. Devuelve (último id, filas) o None si no quedan filas."""
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT l.id,
+                   CASE WHEN v.letra_vec32 IS NULL THEN l.letra_vec END,
+                   CASE WHEN {TRACK_PENDIENTE} THEN l.track_vector END
+            FROM lyrics_database l
+            LEFT JOIN song_vectors v ON v.song_id = l.id
+            WHERE {PENDING_FILTER} AND l.id > %s
+            ORDER BY l.id
+            LIMIT %s;
+        """, (last_id, BATCH_SIZE))
+        rows = cur.fetchall()
+        if not rows:
+            cur.close()
+            return None
+
+        valores = []
+        for id_, letra_vec, track_vector in rows:
+            letra = vector_storage.encode(letra_vec) if letra_vec is not None else None
+            track = None
+            if track_vector is not None:
+                track = vector_storage.encode(pool_embeddings(track_vector, TRACK_POOLING))
+            valores.append((id_, letra, track, TRACK_POOLING if track is not None else None))
+
+        guardar_features(cur, "song_vectors", ("letra_vec32", "track_vec_pooled", "track_pooling"), valores,
+                         politicas={c: ACTUALIZAR for c in ("letra_vec32", "track_vec_pooled", "track_pooling")})
+        if DROP_LEGACY:
+            bulk_insert(cur, """
+                UPDATE lyrics_database AS t SET
+                    letra_vec = CASE WHEN v.letra THEN NULL ELSE t.letra_vec END,
+                    track_vector = CASE WHEN v.track THEN NULL ELSE t.track_vector END
+                FROM (VALUES %s) AS v (id, letra, track)
+                WHERE t.id = v.id
+            """, [(id_, letra is not None, track is not None) for id_, letra, track, _ in valores])
+        cur.close()
+    return rows[-1][0], len(rows)
+
+
+def main():
+    aplicar_migraciones(db_manager)
+    for columna in COMPACT_COLUMNS:
+        if tipo_columna(columna) not in (None, vector_storage.column_type().lower()):
+            cambiar_tipo_columna(columna, vector_storage)
+    last_id = 0
+    convertidas = 0
+    while True:
+        resultado = convertir_lote(last_id)
+        if resultado is None:
+            break
+        last_id, filas = resultado
+        convertidas += filas
+        logger.info(f"Convertidas {convertidas} filas (último id {last_id})")
+    logger.info("✅ Conversión de vectores finalizada")
+
+
+if __name__ == '__main__':
+    main()
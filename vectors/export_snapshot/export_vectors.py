@@ -0,0 +1,68 @@
+"""Exporta el catálogo vectorizado a un snapshot `.npy` memory-mappable.
+
+Los trabajos offline (deduplicación, clustering, evaluación de recall o
+SEARCH_BACKEND=local) abren el snapshot con `common.snapshot.abrir_snapshot`
+sin leer Postgres fila a fila. Cada ejecución añade solo las canciones del
+catálogo que aún no están en el snapshot, sea cual sea su id (una canción
+puede vectorizarse después de otras con id mayor); para regenerarlo entero
+basta con apuntar SNAPSHOT_PATH a un directorio vacío.
+"""
+import os
+
+import numpy as np
+
+from common.logging import setup_logging
+from common.db import create_db_manager, literal_array
+from common.catalogo import ids_vectorizados, leer_catalogo
+from common.snapshot import anadir_filas, ids_exportados
+from common.vectors import get_track_pooling
+
+logger = setup_logging()
+db_manager = create_db_manager("export_snapshot", max_conn=2)
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'data/vector_snapshot')
+BATCH_SIZE = int(os.getenv('SNAPSHOT_BATCH_SIZE', '5000'))
+# Queda en el manifest: no se mezclan en un snapshot vectores de audio de dos modos
+TRACK_POOLING = get_track_pooling()
+
+
+def pendientes_de_exportar() -> np.ndarray:
+    """Anti-join entre los ids del catálogo y los que ya tiene el snapshot."""
+    return np.setdiff1d(ids_vectorizados(db_manager, TRACK_POOLING), ids_exportados(SNAPSHOT_PATH),
+                        assume_unique=True)
+
+
+def exportar():
+    pendientes = pendientes_de_exportar()
+    logger.info(f"Exportando a {SNAPSHOT_PATH} {len(pendientes)} canciones nuevas")
+    nuevas = 0
+    for inicio in range(0, len(pendientes), BATCH_SIZE):
+        tramo = pendientes[inicio:inicio + BATCH_SIZE]
+        lotes = leer_catalogo(db_manager, BATCH_SIZE, incluir_letra=False, desde_id=int(tramo[0]) - 1,
+                              condicion=f"l.id = ANY('{literal_array(tramo.tolist())}'::int[])",
+                              pooling=TRACK_POOLING)
+        canciones = [c for lote in lotes for c in lote]
+        if not canciones:
+            continue
+        filas = anadir_filas(
+            SNAPSHOT_PATH,
+            [c.id for c in canciones],
+            {
+                "lyrics_vector": np.vstack([c.lyrics_vector for c in canciones]),
+                "track_vector": np.vstack([c.track_vector for c in canciones]),
+            },
+            [c.payload for c in canciones],
+            atributos={"track_pooling": TRACK_POOLING},
+        )
+        nuevas += len(canciones)
+        logger.info(f"Snapshot con {filas} filas ({nuevas}/{len(pendientes)} nuevas)")
+    return nuevas
+
+
+def main():
+    nuevas = exportar()
+    logger.info(f"✅ Snapshot actualizado: {nuevas} filas nuevas")
+
+
+if __name__ == '__main__':
+    main()
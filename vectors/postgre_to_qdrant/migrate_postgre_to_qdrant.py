@@ -1,24 +1,73 @@
 import os
-import time
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, VectorParams, Distance
+from qdrant_client.models import (
+    PointStruct, VectorParams, Distance, PayloadSchemaType, UpdateStatus, HnswConfigDiff,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, BinaryQuantization, BinaryQuantizationConfig,
+    SetPayload, SetPayloadOperation, Filter, IsEmptyCondition, PayloadField,
+)
 from common.retry import retry
 
-from common.config import config
 from common.logging import setup_logging
-from common.db import DatabaseManager
+from common.db import create_db_manager
+from common.catalogo import CancionVectorizada, leer_catalogo, leer_payloads
+from common.migrations import aplicar_migraciones
+from common.vectors import get_track_pooling
 
 logger = setup_logging()
-db_manager = DatabaseManager(config.database_url, min_conn=1, max_conn=5)
+db_manager = create_db_manager("qdrant_migration", max_conn=5)
 logger.info('Base de Postgres (pool) configurada')
 
-# Crear columna vector_migrado si no existe
-pg_cursor.execute("""
-    ALTER TABLE lyrics_database
-    ADD COLUMN IF NOT EXISTS vector_migrado BOOLEAN DEFAULT FALSE;
-""")
-pg_conn.commit()
+COLLECTION = "TFM"
+BATCH_SIZE = int(os.getenv('MIGRATE_BATCH_SIZE', '500'))
+# Lotes que pueden estar construyéndose/subiéndose a la vez
+MAX_IN_FLIGHT = int(os.getenv('MIGRATE_MAX_IN_FLIGHT', '4'))
+# Con wait=False Qdrant confirma al encolar la operación (status acknowledged)
+# sin esperar a que se aplique al índice
+WAIT_FOR_INDEX = os.getenv('MIGRATE_WAIT', 'false').lower() in ('1', 'true', 'yes')
+
+# La letra completa en el payload ocupa RAM en Qdrant; la búsqueda puede
+# cargarla bajo demanda desde Postgres (LYRICS_SOURCE=postgres)
+STORE_LYRICS = os.getenv('QDRANT_STORE_LYRICS', 'true').lower() in ('1', 'true', 'yes')
+
+# Cuantización de la colección: none, scalar (int8) o binary. Los vectores
+# cuantizados se quedan en RAM y los originales pueden ir a disco (on_disk)
+# para reordenar (rescore) los candidatos al buscar.
+QUANTIZATION = os.getenv('QDRANT_QUANTIZATION', 'none').lower()
+VECTORS_ON_DISK = os.getenv('QDRANT_VECTORS_ON_DISK', 'false').lower() in ('1', 'true', 'yes')
+HNSW_M = os.getenv('QDRANT_HNSW_M')
+HNSW_EF_CONSTRUCT = os.getenv('QDRANT_HNSW_EF_CONSTRUCT')
+
+# Campos del payload que se filtran en la búsqueda y su tipo de índice
+PAYLOAD_INDEXES = {
+    "bpm": PayloadSchemaType.FLOAT,
+    "camelot": PayloadSchemaType.KEYWORD,
+    # Tonalidad original, para las que no se pueden pasar a Camelot (key_literal)
+    "key": PayloadSchemaType.KEYWORD,
+    "genres": PayloadSchemaType.KEYWORD,
+    "artist": PayloadSchemaType.KEYWORD,
+    "title": PayloadSchemaType.KEYWORD,
+}
+
+# Versión de los campos de `construir_payload`; se sube cuando cambian (p. ej. al
+# añadir camelot y genres) para que los puntos ya migrados se actualicen
+PAYLOAD_VERSION = 2
+# Los vectores de audio de la colección tienen que ser todos del mismo modo
+TRACK_POOLING = get_track_pooling()
+
+# Canciones que aún no están en Qdrant, o cuyos vectores (song_vectors v) han
+# cambiado desde que se subieron (condición para leer_catalogo)
+PENDING_FILTER = (
+    "NOT EXISTS (SELECT 1 FROM qdrant_sync q WHERE q.song_id = l.id "
+    "AND (v.updated_at IS NULL OR q.migrado_at >= v.updated_at))"
+)
+# Canciones en Qdrant con un payload de una versión anterior y los mismos
+# vectores (si han cambiado, PENDING_FILTER las vuelve a subir enteras)
+OUTDATED_PAYLOAD_FILTER = (
+    "EXISTS (SELECT 1 FROM qdrant_sync q WHERE q.song_id = l.id "
+    f"AND q.payload_version < {PAYLOAD_VERSION} "
+    "AND (v.updated_at IS NULL OR q.migrado_at >= v.updated_at))"
+)
 
 # Conectar a Qdrant
 logger.info('Conectando a Qdrant')
@@ -26,100 +75,247 @@ qdrant = QdrantClient(host=os.getenv('QDRANT_HOST', 'localhost'), port=int(os.ge
 logger.info('Qdrant conectado')
 
 
+def construir_punto(cancion: CancionVectorizada) -> PointStruct:
+    return PointStruct(
+        id=cancion.id,
+        vector={
+            "track_vector": cancion.track_vector.tolist(),
+            "lyrics_vector": cancion.lyrics_vector.tolist(),
+        },
+        payload=cancion.payload
+    )
+
+
 @retry(max_attempts=4, initial_delay=1, backoff=2, exceptions=(Exception,))
 def upsert_points(qdrant_client, points):
     # Wrapper to allow retrying transient errors from Qdrant
-    qdrant_client.upsert(collection_name="TFM", points=points)
+    result = qdrant_client.upsert(collection_name=COLLECTION, points=points, wait=WAIT_FOR_INDEX)
+    if result.status not in (UpdateStatus.ACKNOWLEDGED, UpdateStatus.COMPLETED):
+        raise RuntimeError(f"Qdrant devolvió estado {result.status}")
 
-# Leer un ejemplo para obtener dimensiones
-with db_manager.get_connection() as conn:
-    cur = conn.cursor()
-    logger.info('Realizando consulta de ejemplo')
-    cur.execute("SELECT track_vector, letra_vec FROM lyrics_database WHERE track_vector IS NOT NULL AND letra_vec IS NOT NULL AND vector_migrado = FALSE LIMIT 1")
-    example = cur.fetchone()
-    cur.close()
-
-if not example:
-    logger.info("No hay datos para migrar.")
-    exit()
-logger.info('Resultados recuperados')
-
-# Obtener dimensiones automáticamente
-dim_audio = len(np.mean(example[0], axis=0)) if isinstance(example[0], list) and len(example[0])>0 else len(example[0])
-dim_lyrics = len(example[1])
-
-# Crear colección con vectores múltiples
-logger.info('Creando colección...')
-if not qdrant.collection_exists("TFM"):
-    qdrant.create_collection(
-        collection_name="TFM",
-        vectors_config={
-            "track_vector": VectorParams(size=dim_audio, distance=Distance.COSINE),
-            "lyrics_vector": VectorParams(size=dim_lyrics, distance=Distance.COSINE),
-        }
-    )
-else:
-    logger.info("✅ La colección 'TFM' ya existe.")
 
-# Bucle por lotes más grande
-batch_size = int(os.getenv('MIGRATE_BATCH_SIZE', '100'))
-while True:
-    logger.info("Consultando lote...")
-    with db_manager.get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT id, artista, cancion, letra, album, mbid, track_vector, letra_vec, link, bpm, initialkey, genre 
-            FROM lyrics_database
-            WHERE track_vector IS NOT NULL AND letra_vec IS NOT NULL AND vector_migrado = FALSE
-            LIMIT %s;
-        """, (batch_size,))
-        rows = cur.fetchall()
-        cur.close()
+@retry(max_attempts=4, initial_delay=1, backoff=2, exceptions=(Exception,))
+def set_payloads(qdrant_client, payloads):
+    """Actualiza en una sola petición el payload de varios puntos, sin tocar sus vectores."""
+    operaciones = [SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[id_]))
+                   for id_, payload in payloads]
+    for result in qdrant_client.batch_update_points(collection_name=COLLECTION, update_operations=operaciones,
+                                                    wait=WAIT_FOR_INDEX):
+        if result.status not in (UpdateStatus.ACKNOWLEDGED, UpdateStatus.COMPLETED):
+            raise RuntimeError(f"Qdrant devolvió estado {result.status}")
 
-    if not rows:
-        logger.info("✅ Todos los datos han sido migrados.")
-        break
 
+def procesar_lote(canciones):
+    """Construye los puntos de un lote y los sube. Devuelve los ids confirmados por Qdrant."""
     points = []
-    ids_to_update = []
-
-    for row in rows:
-        id_, artist, title, lyric, album, mbid, audio_vec, lyrics_vec, link, bpm, initialkey, genre = row
+    for cancion in canciones:
         try:
-            mean_audio_vec = np.mean(audio_vec, axis=0).tolist() if isinstance(audio_vec, list) and isinstance(audio_vec[0], list) else audio_vec
-            metadata = {
-                "artist": artist, "title": title,
-                "lyric": lyric, "album": album, "mbid": mbid,
-                "yotube_link": link, "bpm": bpm, "key": initialkey,
-                "genre": genre
-            }
-            points.append(PointStruct(
-                id=id_,
-                vector={
-                    "track_vector": mean_audio_vec,
-                    "lyrics_vector": lyrics_vec,
-                },
-                payload=metadata
-            ))
-            ids_to_update.append(id_)
+            points.append(construir_punto(cancion))
         except Exception as e:
-            logger.error(f"❌ Error procesando id {id_}: {e}", exc_info=True)
-
+            logger.error(f"❌ Error procesando id {cancion.id}: {e}", exc_info=True)
     if points:
-        logger.info(f"Subiendo {len(points)} puntos...")
-        try:
-            upsert_points(qdrant, points)
-        except Exception:
-            logger.exception("Error subiendo puntos a Qdrant, reintentando en el siguiente lote")
+        upsert_points(qdrant, points)
+    return [p.id for p in points]
+
+
+def marcar_migrados(ids):
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO qdrant_sync (song_id, payload_version) SELECT unnest(%s::int[]), %s
+            ON CONFLICT (song_id) DO UPDATE SET
+                payload_version = EXCLUDED.payload_version, migrado_at = CURRENT_TIMESTAMP;
+            """,
+            (ids, PAYLOAD_VERSION)
+        )
+        cur.close()
+
+
+def sincronizar_clusters():
+    """Actualiza `lyric_cluster_id` en los puntos ya migrados cuyo cluster de letra ha cambiado."""
+    with db_manager.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT c.lyric_cluster_id, array_agg(c.song_id)
+            FROM lyric_clusters c
+            JOIN qdrant_sync q ON q.song_id = c.song_id
+            WHERE c.updated_at > q.migrado_at
+            GROUP BY c.lyric_cluster_id;
+        """)
+        grupos = cur.fetchall()
+        cur.close()
+
+    actualizados = []
+    for cluster, ids in grupos:
+        qdrant.set_payload(collection_name=COLLECTION, payload={"lyric_cluster_id": cluster}, points=ids,
+                           wait=WAIT_FOR_INDEX)
+        actualizados.extend(ids)
+    if actualizados:
         with db_manager.get_connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                "UPDATE lyrics_database SET vector_migrado = TRUE WHERE id = ANY(%s);",
-                (ids_to_update,)
-            )
+            cur.execute("UPDATE qdrant_sync SET migrado_at = CURRENT_TIMESTAMP WHERE song_id = ANY(%s);",
+                        (actualizados,))
             cur.close()
-        logger.info("✅ Lote procesado.")
+        logger.info(f"{len(actualizados)} puntos con cluster de letra actualizado")
+
+
+def actualizar_payloads():
+    """Pone al día el payload de los puntos migrados con una versión anterior.
+
+    Se usa `set_payload`, que conserva los campos que no se envían (la letra, si
+    se subió), en lugar de volver a subir los vectores.
+    """
+    actualizados = 0
+    for lote in leer_payloads(db_manager, BATCH_SIZE, condicion=OUTDATED_PAYLOAD_FILTER, pooling=TRACK_POOLING):
+        if not lote:
+            continue
+        set_payloads(qdrant, lote)
+        marcar_migrados([id_ for id_, _ in lote])
+        actualizados += len(lote)
+    if actualizados:
+        logger.info(f"{actualizados} puntos con payload actualizado a la versión {PAYLOAD_VERSION}")
+
+
+def configuracion_cuantizacion():
+    if QUANTIZATION == 'none':
+        return None
+    if QUANTIZATION == 'scalar':
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=float(os.getenv('QDRANT_QUANTILE', '0.99')),
+            always_ram=True,
+        ))
+    if QUANTIZATION == 'binary':
+        # Pensada para vectores grandes (Effnet, 1280 dims); requiere oversampling al buscar
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"QDRANT_QUANTIZATION desconocida: {QUANTIZATION} (válidas: none, scalar, binary)")
+
+
+def configuracion_hnsw():
+    if not HNSW_M and not HNSW_EF_CONSTRUCT:
+        return None
+    return HnswConfigDiff(
+        m=int(HNSW_M) if HNSW_M else None,
+        ef_construct=int(HNSW_EF_CONSTRUCT) if HNSW_EF_CONSTRUCT else None,
+    )
+
+
+def crear_coleccion(example: CancionVectorizada):
+    # Obtener dimensiones automáticamente
+    dim_audio = len(example.track_vector)
+    dim_lyrics = len(example.lyrics_vector)
+
+    logger.info('Creando colección...')
+    if not qdrant.collection_exists(COLLECTION):
+        qdrant.create_collection(
+            collection_name=COLLECTION,
+            vectors_config={
+                "track_vector": VectorParams(size=dim_audio, distance=Distance.COSINE, on_disk=VECTORS_ON_DISK),
+                "lyrics_vector": VectorParams(size=dim_lyrics, distance=Distance.COSINE, on_disk=VECTORS_ON_DISK),
+            },
+            quantization_config=configuracion_cuantizacion(),
+            hnsw_config=configuracion_hnsw(),
+        )
+        logger.info(f"Colección creada (cuantización={QUANTIZATION}, on_disk={VECTORS_ON_DISK})")
+    else:
+        logger.info(f"✅ La colección '{COLLECTION}' ya existe.")
+        comprobar_coleccion(dim_audio, dim_lyrics)
+    crear_indices_payload()
+
+
+def comprobar_coleccion(dim_audio: int, dim_lyrics: int):
+    """Se niega a mezclar en la colección vectores de otra dimensión o de otro pooling."""
+    vectores = qdrant.get_collection(COLLECTION).config.params.vectors
+    for nombre, dim in (("track_vector", dim_audio), ("lyrics_vector", dim_lyrics)):
+        if vectores[nombre].size != dim:
+            raise ValueError(
+                f"La colección '{COLLECTION}' tiene {nombre} de {vectores[nombre].size} dimensiones y los "
+                f"vectores actuales tienen {dim} (TRACK_POOLING={TRACK_POOLING}); bórrala junto con "
+                "qdrant_sync para volver a subirlos"
+            )
+    puntos, _ = qdrant.scroll(
+        COLLECTION, limit=1, with_payload=["track_pooling"], with_vectors=False,
+        scroll_filter=Filter(must_not=[IsEmptyCondition(is_empty=PayloadField(key="track_pooling"))]),
+    )
+    if puntos and puntos[0].payload.get("track_pooling") != TRACK_POOLING:
+        raise ValueError(
+            f"La colección '{COLLECTION}' tiene vectores de audio con pooling "
+            f"{puntos[0].payload.get('track_pooling')} y TRACK_POOLING={TRACK_POOLING}; bórrala junto con "
+            "qdrant_sync para volver a subirlos"
+        )
+
+
+def crear_indices_payload():
+    # Índices de payload para que el HNSW filtrado no recurra a fuerza bruta
+    existing_indexes = qdrant.get_collection(COLLECTION).payload_schema or {}
+    for field_name, field_schema in PAYLOAD_INDEXES.items():
+        if field_name not in existing_indexes:
+            logger.info(f"Creando índice de payload para '{field_name}'")
+            qdrant.create_payload_index(collection_name=COLLECTION, field_name=field_name, field_schema=field_schema)
+
+
+def migrar():
+    """Lee por keyset, construye y sube lotes en paralelo con un máximo de lotes en vuelo.
+
+    Una fila solo se marca como migrada cuando Qdrant ha confirmado su lote; los
+    lotes que fallan se quedan pendientes para la siguiente ejecución.
+    """
+    migrados = 0
+    fallidos = 0
+
+    def recoger(done):
+        nonlocal migrados, fallidos
+        for future in done:
+            try:
+                ids = future.result()
+            except Exception:
+                fallidos += 1
+                logger.exception("Error subiendo lote a Qdrant; sus filas quedan pendientes")
+                continue
+            if ids:
+                marcar_migrados(ids)
+                migrados += len(ids)
+                logger.info(f"✅ Lote confirmado ({migrados} puntos migrados)")
+
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as executor:
+        in_flight = set()
+        # Si la letra no va al payload no se lee: es la columna más pesada
+        for canciones in leer_catalogo(db_manager, BATCH_SIZE, condicion=PENDING_FILTER,
+                                       incluir_letra=STORE_LYRICS, pooling=TRACK_POOLING):
+            if len(in_flight) >= MAX_IN_FLIGHT:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                recoger(done)
+            in_flight.add(executor.submit(procesar_lote, canciones))
+        done, _ = wait(in_flight)
+        recoger(done)
+
+    return migrados, fallidos
+
+
+def main():
+    aplicar_migraciones(db_manager)
+    if qdrant.collection_exists(COLLECTION):
+        crear_indices_payload()
+        sincronizar_clusters()
+        actualizar_payloads()
+
+    # Leer un ejemplo para obtener dimensiones
+    logger.info('Realizando consulta de ejemplo')
+    primer_lote = next(leer_catalogo(db_manager, batch_size=1, condicion=PENDING_FILTER, pooling=TRACK_POOLING), [])
+    example = primer_lote[0] if primer_lote else None
+
+    if not example:
+        logger.info("No hay datos para migrar.")
+        return
+    logger.info('Resultados recuperados')
+
+    crear_coleccion(example)
+    migrados, fallidos = migrar()
+    if fallidos:
+        logger.warning(f"{fallidos} lotes fallaron; vuelve a ejecutar la migración para reintentarlos")
+    logger.info(f'Migración finalizada: {migrados} puntos migrados')
 
-    time.sleep(0.5)  # Pequeña pausa
 
-logger.info('Migración finalizada')
+if __name__ == '__main__':
+    main()